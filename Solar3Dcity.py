@@ -29,16 +29,26 @@
 # THE SOFTWARE.
 
 import polygon3dmodule
-import markup3dmodule
+import citytable
+import geometrystore
+import crs
+import stations as weatherstations
+import journal as runjournal
+import metrics
 from lxml import etree
 import irr
+import TOF
+import uncertainty
+import skymatrix
 import argparse
+import collections
+import csv
 import glob
+import gzip
 import os
-import pickle
-from scipy import interpolate
+import StringIO
+import traceback
 import numpy as np
-import math
 
 #-- Name spaces
 ns_citygml = "http://www.opengis.net/citygml/2.0"
@@ -71,367 +81,738 @@ PARSER.add_argument('-o', '--results',
     help='Directory where the enriched "solar" CityGML file(s) should be written.', required=True)
 PARSER.add_argument('-f', '--factors',
     help='Load the TOF if previously precomputed', required=False)
-ARGS = vars(PARSER.parse_args())
-DIRECTORY = ARGS['directory']
-RESULT = ARGS['results']
-FACTORS = ARGS['factors']
-#-- Load the pre-computed dictionary
-if not FACTORS:
-    loadDict = False
-else:
-    loadDict = True
-
-
-#-- If the TOFs are already precomputed
-if loadDict:
-    with open(FACTORS, "rb") as myFile:
-        TOF_strings = pickle.load(myFile)
-    TOF = {}
-
-    for azStr in TOF_strings:
-        azFloat = round(float(azStr), 2)
-        TOF[azFloat] = {}
-        for tiStr in TOF_strings[azStr]:
-            tiFloat = round(float(tiStr), 2)
-            TOF[azFloat][tiFloat] = float(TOF_strings[azStr][tiStr])
-    TS = sorted(TOF)
-    res = TS[1]-TS[0]
-
-else:
-    pass#import knmicloud
-
-
-def squareVerts(a,t,res):
-    """Get the vertices of the interpolation square."""
-    invRes = 1/res
-    aB = math.trunc(a*invRes)/invRes
-    aT = math.ceil(a*invRes)/invRes
-    if aT == aB:
-        aT += res#1.0
-    tB = math.trunc(t*invRes)/invRes
-    tT = math.ceil(t*invRes)/invRes
-    if tT == tB:
-        tT += res#1.0
-    return [[aB, aT], [tB, tT]]
-
-
-def bilinear_interpolation(x, y, points):
-    # Function taken from http://stackoverflow.com/a/8662355/4443114
-    '''Interpolate (x,y) from values associated with four points.
-
-    The four points are a list of four triplets:  (x, y, value).
-    The four points can be in any order.  They should form a rectangle.
-
-        >>> bilinear_interpolation(12, 5.5,
-        ...                        [(10, 4, 100),
-        ...                         (20, 4, 200),
-        ...                         (10, 6, 150),
-        ...                         (20, 6, 300)])
-        165.0
-
-    '''
-    # See formula at:  http://en.wikipedia.org/wiki/Bilinear_interpolation
-
-    points = sorted(points)               # order points by x, then by y
-    (x1, y1, q11), (_x1, y2, q12), (x2, _y1, q21), (_x2, _y2, q22) = points
-
-    if x1 != _x1 or x2 != _x2 or y1 != _y1 or y2 != _y2:
-        raise ValueError('points do not form a rectangle')
-    if not x1 <= x <= x2 or not y1 <= y <= y2:
-        raise ValueError('(x, y) not within the rectangle')
-
-    return (q11 * (x2 - x) * (y2 - y) +
-            q21 * (x - x1) * (y2 - y) +
-            q12 * (x2 - x) * (y - y1) +
-            q22 * (x - x1) * (y - y1)
-           ) / ((x2 - x1) * (y2 - y1) + 0.0)
-
-
-def interpolator(grid_subset, coord):
-    """Bilinear interpolation of TOF values."""
-    #-- Azimuths in the subset grid
-    azG = np.array(grid_subset[0])
-    tiG = np.array(grid_subset[1])
-    values = []
-    values.append((azG[0], tiG[1], TOF[azG[0]][tiG[1]]))
-    values.append((azG[0], tiG[0], TOF[azG[0]][tiG[0]]))
-    values.append((azG[1], tiG[1], TOF[azG[1]][tiG[1]]))
-    values.append((azG[1], tiG[0], TOF[azG[1]][tiG[0]]))
-    return bilinear_interpolation(coord[0], coord[1], values)
-
-def irr_from_tof(tilt, azimuth):
-    """Construct the square with four TOF values around the point for interpolation."""
-    gs = squareVerts(azimuth,tilt,res)
-    return interpolator(gs, [azimuth,tilt])
-
-
-class Building(object):
-    def __init__(self, xml, id):
-        #-- ID of the building
-        self.id = id
-        #-- XML tree of the building
-        self.xml = xml
-        #-- Data for each roof surface required for the computation of the solar stuff
-        self.roofdata = {}
-        #-- List of IDs of openings, not to mess with usable roof surfaces
-        self.listOfOpenings = []
-        #-- Compute the total areas of surfaces per semantic class (not really required; reserved for future use)
-        #-- RoofSurface
-        self.RoofSurfaceArea = self.roofarea()
-        #-- WallSurface
-        self.WallSurfaceArea = self.wallarea()
-        #-- GroundSurface
-        self.GroundSurfaceArea = self.groundarea()
-        #-- Openings
-        self.OpeningArea = self.openingarea()
-        #-- All surfaces (including openings)
-        self.AllArea = self.allarea()
-        #-- All surfaces without openings
-        self.RealArea = self.AllArea - self.OpeningArea
-        #-- Do the solar estimation
-        self.solarinfo()
-
-    def solarinfo(self):        
-        """Computes the area, azimuth, and tilt for each roof surface (id compulsory)."""
-        place = (52.01, 4.36)
-        for roofsurface in self.roofsurfaces:
-            #-- Skip the openings
-            if roofsurface.attrib['{%s}id' %ns_gml] in self.listOfOpenings:
-                continue
-            #-- Add it to the list
-            listofxmlroofsurfaces.append(roofsurface)
-            #-- gml:id of the polygon
-            pid = roofsurface.attrib['{%s}id' %ns_gml]
-            #-- Area
-            area = polygon3dmodule.getAreaOfGML(roofsurface, True)
-            #-- Compute the normal
-            norm = polygon3dmodule.getNormal(markup3dmodule.GMLpoints(markup3dmodule.polydecomposer(roofsurface)[0][0]))
-            #-- Get the azimuth and tilt from the surface normal
-            az, tilt = polygon3dmodule.getAngles(norm)
-            az = round(az, 3)
-            #-- 360 -> 0 degrees
-            if az == 360.0:
-                az = 0.0
-            tilt = round(tilt, 3)
-            #-- Peculiar problems with the normals, with a cheap solution. Luckily very uncommon.
-            if tilt == 180:
-                tilt = 0.0
-            if tilt >= 180:
-                tilt = tilt - 180.01
-            elif tilt > 90:
-                tilt = tilt - 90.01
-            elif tilt == 90:
-                tilt = 89.9
-            #-- Flat surfaces always have the azimuth zero
-            if tilt == 0.0:
-                az = 0.0
-            #-- If the TOF file is loaded, sample the irradiance
-            if loadDict:
-                irradiation = irr_from_tof(tilt, az)
-            #-- If the TOF file is not loaded, estimate the values
+PARSER.add_argument('-m', '--metrics',
+    help='Write the timings and counters of the run to this JSON file.', required=False)
+PARSER.add_argument('--interpolation', choices=TOF.INTERPOLATIONS,
+    help='Interpolation of the TOF: bilinear, or a bicubic spline (more accurate with coarse TOFs).', required=False, default='linear')
+PARSER.add_argument('--hours',
+    help='Without a TOF or with --locate: integrate all daylight hours at once (0), or this number of representative hours of the year (faster, less accurate).', required=False)
+PARSER.add_argument('--sky',
+    help='Without a TOF or with --locate: evaluate each surface with the cumulative sky with the patches of this Reinhart subdivision (1 is Tregenza, 145 patches; see skymatrix.py).', required=False)
+PARSER.add_argument('--walls', action='store_true',
+    help='Also estimate the irradiation of the wall surfaces (facades), and their totals per building.')
+PARSER.add_argument('--monthly', action='store_true',
+    help='With --locate or --sky: also estimate the irradiation of each month (irradiationJan ... irradiationDec).')
+PARSER.add_argument('-l', '--locate', action='store_true',
+    help='Estimate the irradiation at the location of each building (from its coordinates) instead of a single place.')
+PARSER.add_argument('--cluster',
+    help='With --locate: size of the cells (degrees) sharing a TOF.', required=False, default='0.5')
+PARSER.add_argument('--tofstep',
+    help='With --locate: resolution (degrees) of the TOFs computed for the cells.', required=False, default='5')
+PARSER.add_argument('--tofdir',
+    help='With --locate: directory where the TOFs of the cells are stored and reused.', required=False)
+PARSER.add_argument('-w', '--stations',
+    help='With --locate: catalogue of weather stations (CSV, or a directory with EPW files); each building gets the weather of the nearest one.', required=False)
+PARSER.add_argument('-u', '--uncertainty',
+    help='Number of realizations of the positional error of the vertices (Monte Carlo); the statistics of the roofs are written to a CSV file.', required=False, default='0')
+PARSER.add_argument('--error', choices=uncertainty.ErrorModel.KINDS,
+    help='With --uncertainty: distribution of the error of the coordinates.', required=False, default='normal')
+PARSER.add_argument('--sigmaxy',
+    help='With --uncertainty: standard deviation (m) of the error in x and y.', required=False, default='0.1')
+PARSER.add_argument('--sigmaz',
+    help='With --uncertainty: standard deviation (m) of the error in z.', required=False, default='0.1')
+PARSER.add_argument('--confidence',
+    help='With --uncertainty: level of the confidence intervals.', required=False, default='0.95')
+PARSER.add_argument('--seed',
+    help='With --uncertainty: seed of the random errors, for reproducible runs.', required=False)
+PARSER.add_argument('-d', '--database',
+    help='Also store the results of the roofs and buildings in this SQLite database (see resultsdb.py for the queries).', required=False)
+PARSER.add_argument('-j', '--jobs',
+    help='Number of processes computing files in parallel (files are read and written by separate threads).', required=False, default='1')
+PARSER.add_argument('-q', '--queue',
+    help='Number of files waiting between the stages when there are several jobs.', required=False, default='2')
+PARSER.add_argument('--restart', action='store_true',
+    help='Process all files again, instead of resuming from the journal of an earlier run with the same options.')
+PARSER.add_argument('--profile', nargs='?', const='Solar3Dcity.prof',
+    help='Run under cProfile and dump the statistics to this file (default Solar3Dcity.prof).', required=False)
+
+#-- The stages of the processing of a CityGML file: parse, classify, geometry, irradiation, enrich, write
+
+#-- Number of orientations computed without a TOF after which they are recorded in the journal
+CHECKPOINT = 20
+#-- The arguments which do not change the results, a run can be resumed with others
+RESUMABLE = ['jobs', 'queue', 'metrics', 'profile', 'restart']
+
+def enrich(root, table, walls=False):
+    """Adds the solar data to the roof surfaces (and wall surfaces) and buildings in the XML tree (not to the context buildings)."""
+    classes = (citytable.ROOF, citytable.WALL) if walls else (citytable.ROOF,)
+    evaluated = np.zeros(len(table), dtype=bool)
+    evaluated[table.evaluated(classes)] = True
+    total = table.totalIrradiation()
+    #-- The polygons are in the order of the table, also the ones without a gml:id
+    for k, rsxml in enumerate(citytable.polygons(root)):
+        if not evaluated[k]:
+            continue
+        s = etree.SubElement(rsxml, "area")
+        s.text = str(float(table.area[k]))
+        s.attrib['unit'] = 'm^2'
+        i = etree.SubElement(rsxml, "totalIrradiation")
+        i.text = str(total[k])
+        i.attrib['unit'] = 'kWh'
+        a = etree.SubElement(rsxml, "azimuth")
+        a.text = str(float(table.azimuth[k]))
+        a.attrib['unit'] = 'degree'
+        t = etree.SubElement(rsxml, "tilt")
+        t.text = str(float(table.tilt[k]))
+        t.attrib['unit'] = 'degree'
+        ni = etree.SubElement(rsxml, "irradiation")
+        ni.text = str(table.irradiation[k])
+        ni.attrib['unit'] = 'kWh/m^2'
+        #-- The other layers of the TOF, e.g. irradiationP90
+        if table.layers is not None:
+            for name, values in table.layers.items():
+                li = etree.SubElement(rsxml, layerElement(name))
+                li.text = str(values[k])
+                li.attrib['unit'] = 'kWh/m^2'
+
+    roofarea = table.roofarea()
+    yearly = table.yearlyIrradiation()
+    if walls:
+        wallarea = table.wallarea()
+        wallyearly = table.yearlyIrradiation(citytable.WALL)
+    for b, bxml in enumerate(citytable.buildings(root)):
+        if b in table.context:
+            continue
+        s = etree.SubElement(bxml, "roofArea")
+        s.text = str(float(roofarea[b]))
+        s.attrib['unit'] = 'm^2'
+        i = etree.SubElement(bxml, "yearlyIrradiation")
+        i.text = str(yearly[b])
+        i.attrib['unit'] = 'kWh'
+        if walls:
+            w = etree.SubElement(bxml, "wallArea")
+            w.text = str(float(wallarea[b]))
+            w.attrib['unit'] = 'm^2'
+            wi = etree.SubElement(bxml, "yearlyWallIrradiation")
+            wi.text = str(wallyearly[b])
+            wi.attrib['unit'] = 'kWh'
+
+
+def layerElement(name):
+    """Name of the element of a layer of the TOF: p90 becomes irradiationP90."""
+    return 'irradiation' + name[0].upper() + name[1:]
+
+
+def writeCityGML(root, path):
+    """Serialises the enriched CityGML (atomically, an interrupted run leaves no partial file)."""
+    runjournal.writeFile(path, etree.tostring(root))
+
+
+def cityGMLFiles(directory):
+    """All CityGML files in the directory, also the gzipped ones."""
+    return sorted(glob.glob(os.path.join(directory, "*.gml")) + glob.glob(os.path.join(directory, "*.gml.gz")))
+
+
+def inputFiles(directory):
+    """All CityGML files in the directory and all geometry stores (see geometrystore.py)."""
+    return cityGMLFiles(directory) + geometrystore.stores(directory)
+
+
+def openCityGML(path):
+    """Opens a CityGML file for reading, decompressing it if it is gzipped."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def baseName(path):
+    """Name of the CityGML file without the extension(s): Delft.gml and Delft.gml.gz become Delft."""
+    f = os.path.basename(path)
+    if f.endswith('.gz'):
+        f = f[:-3]
+    return f[:f.rfind('.')]
+
+
+def solarPath(path, result):
+    """Path of the enriched file in the directory result: Delft.gml becomes Delft-solar.gml."""
+    return os.path.join(result, baseName(path) + '-solar.gml')
+
+
+def csvPath(path, result):
+    """Path of the surfaces with their irradiation as CSV in the directory result: Delft.s3d becomes Delft-solar.csv."""
+    return os.path.join(result, baseName(path) + '-solar.csv')
+
+
+def outputPath(path, result):
+    """Path of the output of a CityGML file (see solarPath) or of a geometry store (see csvPath)."""
+    if geometrystore.isStore(path):
+        return csvPath(path, result)
+    return solarPath(path, result)
+
+
+def uncertaintyPath(path, result):
+    """Path of the statistics of the error propagation in the directory result: Delft.gml becomes Delft-uncertainty.csv."""
+    return os.path.join(result, baseName(path) + '-uncertainty.csv')
+
+
+class Result(object):
+    """The result of the processing of a CityGML: the table with the buildings and polygons, and the enriched tree
+    (None for a geometry store) and the catalogue of the weather stations of the buildings, if there is one.
+    With the error propagation, uncertainty holds the statistics of the roofs (see uncertainty.propagate).
+    With walls, the wall surfaces are evaluated too."""
+    def __init__(self, name, root, cityObjects, table, stations=None, walls=False):
+        self.name = name
+        self.root = root
+        self.cityObjects = cityObjects
+        self.table = table
+        self.stations = stations
+        self.walls = walls
+        self.uncertainty = None
+
+    def hasRoofs(self):
+        """True if there are roof surfaces with an area."""
+        return self.table.roofarea().sum() > 0
+
+    def buildings(self):
+        """List of the buildings with their gml:id, roof area (m^2) and yearly irradiation (kWh), the same of their
+        walls if they are evaluated, and their location and weather station when they are known. The context buildings
+        are left out."""
+        roofarea = self.table.roofarea()
+        yearly = self.table.yearlyIrradiation()
+        own = self.table.ownBuildings()
+        buildings = [{'id' : self.table.bid[b], 'roofArea' : float(roofarea[b]), 'yearlyIrradiation' : float(yearly[b])}
+                     for b in own]
+        if self.walls:
+            wallarea = self.table.wallarea()
+            wallyearly = self.table.yearlyIrradiation(citytable.WALL)
+            for b, building in zip(own, buildings):
+                building['wallArea'] = float(wallarea[b])
+                building['yearlyWallIrradiation'] = float(wallyearly[b])
+        if self.table.latitude is not None:
+            for b, building in zip(own, buildings):
+                building['latitude'] = float(self.table.latitude[b])
+                building['longitude'] = float(self.table.longitude[b])
+        if self.stations is not None and self.table.station is not None:
+            for b, building in zip(own, buildings):
+                building['station'] = self.stations.codes[self.table.station[b]]
+        return buildings
+
+    def roofs(self, cls=citytable.ROOF):
+        """List of the roof surfaces with their gml:id, building, area (m^2), azimuth, tilt (degrees),
+        irradiation (kWh/m^2) and total irradiation (kWh), and the irradiation of the other layers of the TOF if it has any."""
+        table = self.table
+        total = table.totalIrradiation()
+        roofs = [{'id' : table.pid(k), 'building' : table.bid[table.building[k]], 'area' : float(table.area[k]),
+                  'azimuth' : float(table.azimuth[k]), 'tilt' : float(table.tilt[k]),
+                  'irradiation' : float(table.irradiation[k]), 'totalIrradiation' : float(total[k])}
+                 for k in table.select(cls)]
+        if table.layers is not None:
+            for roof, k in zip(roofs, table.select(cls)):
+                for name, values in table.layers.items():
+                    roof[layerElement(name)] = float(values[k])
+        return roofs
+
+    def failed(self):
+        """The buildings which failed (gml:id -> error), their polygons are not evaluated. The context buildings are left out."""
+        return dict((self.table.bid[b], error) for b, error in self.table.failures.items() if b not in self.table.context)
+
+    def wallSurfaces(self):
+        """List of the wall surfaces, as roofs() (empty if the walls are not evaluated)."""
+        if not self.walls:
+            return []
+        return self.roofs(citytable.WALL)
+
+    def tocsv(self):
+        """The roof (and wall) surfaces as CSV, with a column per item of roofs()."""
+        surfaces = [dict(s, surface='roof') for s in self.roofs()] + [dict(s, surface='wall') for s in self.wallSurfaces()]
+        columns = ['id', 'building', 'surface', 'area', 'azimuth', 'tilt', 'irradiation', 'totalIrradiation']
+        if self.table.layers is not None:
+            columns += [layerElement(name) for name in self.table.layers]
+        f = StringIO.StringIO()
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows([s[c] for c in columns] for s in surfaces)
+        return f.getvalue()
+
+    def tostring(self):
+        """The enriched CityGML, or the surfaces as CSV (see tocsv) if there is no tree."""
+        if self.root is None:
+            return self.tocsv()
+        return etree.tostring(self.root)
+
+
+class Engine(object):
+    """Estimates the solar irradiation of the roofs of CityGML files.
+    The TOF (or the weather data) is loaded once, so the engine can be reused for many files.
+    With locate, the place of each building is derived from its coordinates, and the buildings are grouped in
+    cells of cluster degrees, each with its own TOF (computed with the resolution tofstep, kept in memory for the
+    last tofcache cells and stored in tofdir if it is given). With a catalogue of weather stations (a StationCatalogue,
+    or the path of a CSV file or a directory of EPW files), the TOFs use the weather of the station nearest to each building.
+    With realizations, the positional error of the vertices (an uncertainty.ErrorModel) is propagated to the roofs
+    by Monte Carlo; this needs a TOF or locate.
+    The TOFs are interpolated bilinearly or with a bicubic spline (interpolation, see TOF.TOFGrid).
+    With hours (0 for all daylight hours, or a number of representative hours, see irr.representative_hours), the
+    irradiation without a TOF is computed with the vectorised model for all new orientations of a file at once,
+    and the TOFs of the locations are computed from these hours. With monthly, the TOFs of the locations have the
+    layers of the months too (see TOF.computeGrid). With sky (a subdivision of the sky, see skymatrix.py), each surface
+    is evaluated with the cumulative sky of the place (or of each location) instead of a TOF, with the months too if
+    monthly. With walls, the wall surfaces (facades) are evaluated with the roofs, in the same lookup."""
+    def __init__(self, factors=None, place=(52.01, 4.36), station_code=irr.STATION_CODE, verbose=True,
+                 locate=False, cluster=0.5, tofstep=5.0, tofcache=16, tofdir=None, stations=None,
+                 realizations=0, errors=None, confidence=0.95, seed=None, interpolation='linear', hours=None,
+                 monthly=False, walls=False, journal=None, sky=None):
+        #-- The pre-computed TOF: a path, a TOFGrid, or None to estimate the irradiation from the weather data
+        if isinstance(factors, basestring):
+            factors = TOF.loadGrid(factors, interpolation)
+        self.tof = factors
+        self.place = place
+        self.station_code = station_code
+        self.records = None
+        #-- The representative hours of the year (irr.representative_hours), or None to integrate the records with solpy
+        self.bins = hours
+        self.hours = None
+        #-- The subdivision of the cumulative sky, and the sky of the place (skymatrix.SkyMatrix) when it is computed
+        self.sky = sky
+        self.skymatrix = None
+        self.monthly = monthly
+        #-- Irradiation estimated without the TOF, per (tilt, azimuth), since many roofs share the orientation
+        self.irrCache = {}
+        #-- Print the progress of each file
+        self.verbose = verbose
+        #-- TOFs per location
+        self.cluster = cluster
+        if isinstance(stations, basestring):
+            stations = weatherstations.catalogue(stations)
+        self.stations = stations
+        self.tofs = TOF.TOFCache(tofstep, tofcache, tofdir, station_code, stations, interpolation, hours or 0, monthly, sky) if locate else None
+        #-- The layers of the TOF(s), the first one is the irradiation
+        if locate or sky:
+            self.layers = TOF.MONTHLY if monthly else None
+        else:
+            self.layers = getattr(self.tof, 'layers', None)
+        #-- Error propagation
+        if realizations and self.tof is None and not locate and not sky:
+            raise ValueError("The error propagation needs a TOF, the TOFs of the locations, or the cumulative sky.")
+        self.realizations = realizations
+        self.errors = errors
+        self.confidence = confidence
+        self.seed = seed
+        #-- The classes of the polygons which are evaluated
+        self.walls = walls
+        self.classes = (citytable.ROOF, citytable.WALL) if walls else (citytable.ROOF,)
+        #-- The journal of the run (journal.RunJournal): the orientations computed without a TOF are recorded in it in
+        #-- batches, and reused when the run is resumed
+        self.journal = journal
+        if journal is not None:
+            self.irrCache.update(journal.orientations)
+
+    def locate(self, table):
+        """Sets the latitude and longitude of the buildings of the table from their centroids, and their nearest
+        weather station if there is a catalogue. If the CRS of the file is not supported, the place of the engine is used."""
+        n = len(table.bid)
+        if crs.isSupported(table.srsName):
+            table.latitude, table.longitude = crs.toLatLon(table.srsName, table.centroid[:, 0], table.centroid[:, 1])
+        else:
+            if self.verbose:
+                print "\tThe CRS %s is not supported, all buildings are placed at %s." % (table.srsName, self.place)
+            table.latitude = np.zeros(n) + self.place[0]
+            table.longitude = np.zeros(n) + self.place[1]
+        #-- Buildings without geometry
+        unknown = np.isnan(table.latitude) | np.isnan(table.longitude)
+        table.latitude[unknown] = self.place[0]
+        table.longitude[unknown] = self.place[1]
+        if self.stations is not None:
+            table.station = self.stations.nearest(table.latitude, table.longitude)[0]
+
+    def irradiation(self, azimuth, tilt, latitude=None, longitude=None, station=None, runmetrics=None):
+        """Yearly irradiation (kWh/m^2) of the surfaces with the azimuths and tilts. Returns the values and the number of cache hits.
+        With the TOFs per location, the latitude and longitude of each surface (and the index of its weather station) are used.
+        With TOFs with layers (see TOF.computeEnsemble), the values are an array (surfaces x layers).
+        With runmetrics, the progress of the surfaces estimated one by one with solpy is printed."""
+        azimuth = np.asarray(azimuth, dtype=float)
+        tilt = np.asarray(tilt, dtype=float)
+        if self.tofs is not None and latitude is not None:
+            #-- The stations and the centres of the cells of the surfaces, and the TOF of each station and cell
+            cells = np.column_stack([np.round(np.asarray(latitude) / self.cluster), np.round(np.asarray(longitude) / self.cluster)]) * self.cluster
+            if station is not None:
+                cells = np.column_stack([station, cells])
+            values = np.empty((len(azimuth), len(self.layers)) if self.layers else len(azimuth))
+            if len(cells) == 0:
+                return values, 0
+            hits = self.tofs.hits
+            #-- The groups are sorted by station, so the weather of a station is read once
+            groups, inverse = np.unique(cells, axis=0, return_inverse=True)
+            for g, group in enumerate(groups):
+                surfaces = inverse == g
+                if station is not None:
+                    grid = self.tofs.get(group[1:], int(group[0]))
+                else:
+                    grid = self.tofs.get(group)
+                values[surfaces] = grid.lookup(azimuth[surfaces], tilt[surfaces])
+            return values, self.tofs.hits - hits
+        #-- If the TOF is loaded, sample the irradiance
+        if self.tof is not None and self.sky is None:
+            return self.tof.lookup(azimuth, tilt), 0
+        #-- If the TOF is not loaded, estimate the values
+        if self.records is None:
+            self.records = irr.weather(self.station_code)
+        if self.sky is not None:
+            return self.skyIrradiation(azimuth, tilt)
+        #-- The surfaces without an orientation (e.g. of the failed buildings) are not evaluated
+        values = np.empty(len(azimuth))
+        values.fill(np.nan)
+        known = np.where(~(np.isnan(azimuth) | np.isnan(tilt)))[0]
+        if self.bins is not None:
+            values[known], cacheHits = self.hoursIrradiation(azimuth[known], tilt[known])
+            return values, cacheHits
+        cacheHits = 0
+        computed = []
+        for done, k in enumerate(known):
+            if runmetrics is not None and self.verbose:
+                runmetrics.progress(done + 1, len(known), 'surfaces')
+            key = (tilt[k], azimuth[k])
+            if key in self.irrCache:
+                cacheHits += 1
             else:
-                irradiation = irr.yearly_total_irr(place, az, tilt)
-            #-- Add the values
-            self.roofdata[pid] = {'area' : area, 'azimuth' : az, 'tilt' : tilt, 'irradiation' : irradiation, 'total_irradiation' : irradiation*area}
-            roofsurfacedata[pid] = {'area' : area, 'azimuth' : az, 'tilt' : tilt, 'irradiation' : irradiation, 'total_irradiation' : irradiation*area}
-            #self.roofdata.append([self.id, pid, area, az, tilt, irradiation, irradiation*area])
-        self.sumIrr = 0
-        #-- Sum the values for the building
-        for rs in self.roofdata:
-            self.sumIrr += self.roofdata[rs]['total_irradiation']
-
-    def roofarea(self):
-        """The total area of RoofSurface."""
-        self.roofs = []
-        self.roofsurfaces = []
-        roofarea = 0.0
-        openings = 0.0
-        for child in self.xml.getiterator():
-            if child.tag == '{%s}RoofSurface' %ns_bldg:
-                self.roofs.append(child)
-                openings += oparea(child)
-        for surface in self.roofs:
-            for w in surface.findall('.//{%s}Polygon' %ns_gml):
-                self.roofsurfaces.append(w)
-        for roofsurface in self.roofsurfaces:
-            roofarea += polygon3dmodule.getAreaOfGML(roofsurface, True)
-            #-- Compute the normal
-            norm = polygon3dmodule.getNormal(markup3dmodule.GMLpoints(markup3dmodule.polydecomposer(roofsurface)[0][0]))
-            polygon3dmodule.getAngles(norm)
-        return roofarea - openings
-
-    def wallarea(self):
-        """The total area of WallSurfaces."""
-        self.walls = []
-        self.wallsurfaces = []
-        wallarea = 0.0
-        openings = 0.0
-        #-- Account for openings
-        for child in self.xml.getiterator():
-            if child.tag == '{%s}WallSurface' %ns_bldg:
-                self.walls.append(child)
-                openings += oparea(child)
-        for surface in self.walls:
-            for w in surface.findall('.//{%s}Polygon' %ns_gml):
-                self.wallsurfaces.append(w)
-        for wallsurface in self.wallsurfaces:
-            wallarea += polygon3dmodule.getAreaOfGML(wallsurface, True)
-        return wallarea - openings
-
-    def groundarea(self):
-        """The total area of GroundSurfaces."""
-        self.grounds = []
-        groundarea = 0.0
-        for child in self.xml.getiterator():
-            if child.tag == '{%s}GroundSurface' %ns_bldg:
-                self.grounds.append(child)
-        self.count = 0
-        for groundsurface in self.grounds:
-            self.count += 1
-            groundarea += polygon3dmodule.getAreaOfGML(groundsurface, True)
-        return groundarea
-
-    def openingarea(self):
-        """The total area of Openings."""
-        matching = []
-        self.openings = []
-        openingarea = 0.0
-        for child in self.xml.getiterator():
-            if child.tag == '{%s}opening' %ns_bldg:
-                matching.append(child)
-                #-- Store the list of openings
-                for o in child.findall('.//{%s}Polygon' %ns_gml):
-                    self.listOfOpenings.append(o.attrib['{%s}id' %ns_gml])
-        for match in matching:
-            for child in match.getiterator():
-                if child.tag == '{%s}surfaceMember' %ns_gml:
-                    self.openings.append(child)
-        self.count = 0
-        for openingsurface in self.openings:
-            self.count += 1
-            openingarea += polygon3dmodule.getAreaOfGML(openingsurface, True)
-        return openingarea
-
-    def allarea(self):
-        """The total area of all surfaces."""
-        self.allareas = []
-        allarea = 0.0
-        # for child in self.xml.getiterator():
-        #   if child.tag == '{%s}surfaceMember' %ns_gml:
-        #       self.allareas.append(child)
-        self.allareas = self.xml.findall('.//{%s}Polygon' %ns_gml)
-        self.count = 0
-        for poly in self.allareas:
-            self.count += 1
-            allarea += polygon3dmodule.getAreaOfGML(poly, True)
-        return allarea
-
-def oparea(xmlelement):
-    """The total area of Openings in the XML tree."""
-    matching = []
-    openings = []
-    openingarea = 0.0
-    for child in xmlelement.getiterator():
-        if child.tag == '{%s}opening' %ns_bldg:
-            #print 'opening'
-            matching.append(child)
-    for match in matching:
-        for child in match.getiterator():
-            if child.tag == '{%s}surfaceMember' %ns_gml:
-                openings.append(child)
-    for openingsurface in openings:
-        openingarea += polygon3dmodule.getAreaOfGML(openingsurface, True)
-    return openingarea  
-
-
-print "I am Solar3Dcity. Let me search for your CityGML files..."
-
-#-- Find all CityGML files in the directory
-os.chdir(DIRECTORY)
-for f in glob.glob("*.gml"):
-    FILENAME = f[:f.rfind('.')]
-    FULLPATH = DIRECTORY + f
-
-    CITYGML = etree.parse(FULLPATH)
-    root = CITYGML.getroot()
-    cityObjects = []
-    buildings = []
-
-    listofxmlroofsurfaces = []
-    roofsurfacedata = {}
-
-    #-- Find all instances of cityObjectMember and put them in a list
-    for obj in root.getiterator('{%s}cityObjectMember'% ns_citygml):
-        cityObjects.append(obj)
-
-    print FILENAME
-    print "\tThere are", len(cityObjects), "cityObject(s) in this CityGML file"
-
-    for cityObject in cityObjects:
-        for child in cityObject.getchildren():
-            if child.tag == '{%s}Building' %ns_bldg:
-                buildings.append(child)
-
-    #-- Store the buildings as classes
-    buildingclasses = []
-    for b in buildings:
-        id = b.attrib['{%s}id' %ns_gml]
-        buildingclasses.append(Building(b, id))
-
-    print "\tI have read all buildings, now I will search for roofs and estimate their solar irradiation..."
-
-    #-- Store the obtained data in a dictionary
-    solardata = {}
-
-    #-- Check if there are roof surfaces in the file
-    rsc = 0
-
-    #-- Iterate all buildings
-    for bu in buildingclasses:
-        solardata[bu.id] = {'roofarea' : bu.roofarea(), 'totalIrradiation' : bu.sumIrr}
-        rsc += bu.RoofSurfaceArea
-
-    if rsc > 0:
-
-        print '\tEnriching CityGML file with the solar irradiation data...'
-
-        for rsxml in listofxmlroofsurfaces:
-            rsid = rsxml.attrib['{%s}id' %ns_gml]
-            s = etree.SubElement(rsxml, "area")
-            s.text = str(roofsurfacedata[rsid]['area'])
-            s.attrib['unit'] = 'm^2'
-            i = etree.SubElement(rsxml, "totalIrradiation")
-            i.text = str(roofsurfacedata[rsid]['total_irradiation'])
-            i.attrib['unit'] = 'kWh'
-            a = etree.SubElement(rsxml, "azimuth")
-            a.text = str(roofsurfacedata[rsid]['azimuth'])
-            a.attrib['unit'] = 'degree'
-            t = etree.SubElement(rsxml, "tilt")
-            t.text = str(roofsurfacedata[rsid]['tilt'])
-            t.attrib['unit'] = 'degree'
-            ni = etree.SubElement(rsxml, "irradiation")
-            ni.text = str(roofsurfacedata[rsid]['irradiation'])
-            ni.attrib['unit'] = 'kWh/m^2'
-
-
-
-        for b in buildings:
-            bid = b.attrib['{%s}id' %ns_gml]
-            s = etree.SubElement(b, "roofArea")
-            s.text = str(solardata[bid]['roofarea'])
-            s.attrib['unit'] = 'm^2'
-            i = etree.SubElement(b, "yearlyIrradiation")
-            i.text = str(solardata[bid]['totalIrradiation'])
-            i.attrib['unit'] = 'kWh'
-
-
-        os.chdir(RESULT)
-        with open(RESULT + FILENAME + '-solar.gml', 'w') as f:
-                f.write(etree.tostring(root))
-
-        print "\tFile written."
-
+                self.irrCache[key] = irr.yearly_total_irr(self.place, azimuth[k], tilt[k], self.records)
+                computed.append(key)
+                if self.journal is not None and len(computed) == CHECKPOINT:
+                    self.journal.addOrientations((key, self.irrCache[key]) for key in computed)
+                    computed = []
+            values[k] = self.irrCache[key]
+        if self.journal is not None:
+            self.journal.addOrientations((key, self.irrCache[key]) for key in computed)
+        return values, cacheHits
+
+    def hoursIrradiation(self, azimuth, tilt):
+        """Yearly irradiation of the surfaces (with an orientation) from the representative hours, computed at once for
+        the orientations which are not in the cache yet. Returns the values and the number of cache hits."""
+        if self.hours is None:
+            self.hours = irr.representative_hours(self.place, irr.record_arrays(self.records), self.bins)
+        keys = zip(tilt, azimuth)
+        missing = list(set(key for key in keys if key not in self.irrCache))
+        if missing:
+            tilts, azimuths = np.array(missing).T
+            self.irrCache.update(zip(missing, irr.hours_irradiation(self.hours, azimuths, tilts)))
+        values = np.array([self.irrCache[key] for key in keys])
+        return values, len(keys) - len(missing)
+
+    def skyIrradiation(self, azimuth, tilt):
+        """Yearly irradiation of the surfaces from the cumulative sky of the place, computed when it is first needed from
+        all daylight hours or the representative hours. Each orientation is evaluated once. Returns the values and the
+        number of surfaces sharing the orientation of another one (as cache hits)."""
+        if self.skymatrix is None:
+            hours = irr.representative_hours(self.place, irr.record_arrays(self.records), self.bins or 0, monthly=self.monthly)
+            self.skymatrix = skymatrix.SkyMatrix(hours, self.sky)
+        if len(azimuth) == 0:
+            return self.skymatrix.lookup(azimuth, tilt), 0
+        orientations, inverse = np.unique(np.column_stack([azimuth, tilt]), axis=0, return_inverse=True)
+        return self.skymatrix.lookup(orientations[:, 0], orientations[:, 1])[inverse], len(azimuth) - len(orientations)
+
+    def solarinfo(self, table, runmetrics=None):
+        """Estimates the irradiation of each roof surface from its azimuth and tilt. Returns the number of cache hits."""
+        return self.solarinfoBatch([table], runmetrics)
+
+    def solarinfoBatch(self, tables, runmetrics=None):
+        """Estimates the irradiation of the roof (and wall) surfaces of many tables with a single lookup (printing its
+        progress in runmetrics, see irradiation). Returns the number of cache hits."""
+        if not tables:
+            return 0
+        roofs = [table.evaluated(self.classes) for table in tables]
+        latitude = longitude = station = None
+        if self.tofs is not None:
+            for table in tables:
+                if table.latitude is None:
+                    self.locate(table)
+            latitude = np.concatenate([t.latitude[t.building[r]] for t, r in zip(tables, roofs)])
+            longitude = np.concatenate([t.longitude[t.building[r]] for t, r in zip(tables, roofs)])
+            if self.stations is not None:
+                station = np.concatenate([t.station[t.building[r]] for t, r in zip(tables, roofs)])
+        values, cacheHits = self.irradiation(np.concatenate([t.azimuth[r] for t, r in zip(tables, roofs)]),
+                                             np.concatenate([t.tilt[r] for t, r in zip(tables, roofs)]),
+                                             latitude, longitude, station, runmetrics)
+        ends = np.cumsum([len(r) for r in roofs])
+        for table, r, v in zip(tables, roofs, np.split(values, ends[:-1])):
+            #-- With the layers of a TOF, the first one is the irradiation
+            if v.ndim == 2:
+                if table.layers is None:
+                    table.layers = collections.OrderedDict((name, np.zeros(len(table)) + np.nan) for name in self.layers[1:])
+                for l, name in enumerate(self.layers[1:]):
+                    table.layers[name][r] = v[:, l + 1]
+                v = v[:, 0]
+            table.irradiation[r] = v
+        return cacheHits
+
+    def propagate(self, result):
+        """Propagates the positional error of the vertices to the roofs of the result, which have their irradiation already
+        (see uncertainty.propagate). The statistics are stored in result.uncertainty."""
+        table = result.table
+
+        def lookup(roofs, azimuth, tilt):
+            latitude = longitude = station = None
+            if self.tofs is not None:
+                b = np.repeat(table.building[roofs], azimuth.shape[1])
+                latitude = table.latitude[b]
+                longitude = table.longitude[b]
+                if table.station is not None:
+                    station = table.station[b]
+            values = self.irradiation(azimuth.ravel(), tilt.ravel(), latitude, longitude, station)[0]
+            #-- Only the first layer of a TOF with layers
+            if values.ndim == 2:
+                values = values[:, 0]
+            return values.reshape(azimuth.shape)
+
+        #-- The same seed gives the same errors for each file, whatever the order of the files
+        rng = np.random.RandomState(self.seed)
+        result.uncertainty = uncertainty.propagate(table, result.root, lookup, self.realizations, self.errors, self.confidence, rng)
+        return result.uncertainty
+
+    def prepare(self, root, name='', runmetrics=None):
+        """Reads the buildings and the geometry of their polygons from the CityGML tree. Returns a Result without the irradiation."""
+        if runmetrics is None:
+            runmetrics = metrics.RunMetrics(name)
+
+        with runmetrics.stage('classify'):
+            cityObjects, table = citytable.readCityGML(root)
+
+        if self.verbose:
+            print name
+            print "\tThere are", cityObjects, "cityObject(s) in this CityGML file"
+            print "\tI have read all buildings, now I will search for roofs and estimate their solar irradiation..."
+
+        with runmetrics.stage('geometry'):
+            #-- The rings are kept for the error propagation, so it does not read them from the tree again
+            table.geometry(root, self.classes, rings=bool(self.realizations))
+        if self.verbose:
+            polygon3dmodule.printValidationSummary(table.ringreasons)
+        self.count(table, runmetrics)
+        return Result(name, root, cityObjects, table, self.stations, self.walls)
+
+    def count(self, table, runmetrics):
+        """Counts the buildings and polygons of the table in runmetrics (without the context buildings), and reports the
+        buildings which failed."""
+        failures = sorted((b, error) for b, error in table.failures.items() if b not in table.context)
+        runmetrics.count('files')
+        runmetrics.count('buildings', len(table.bid) - len(table.context))
+        if table.context:
+            runmetrics.count('context_buildings', len(table.context))
+        runmetrics.count('roof_polygons', len(table.select(citytable.ROOF)))
+        if self.walls:
+            runmetrics.count('wall_polygons', len(table.select(citytable.WALL)))
+        runmetrics.count('openings_skipped', len(table.select(citytable.OPENING)))
+        invalid, ringreasons = table.invalid, table.ringreasons
+        if table.context:
+            own = ~np.in1d(table.building, list(table.context))
+            invalid = invalid[own]
+            #-- Without the rings, the invalid rings of the context buildings are counted too
+            if table.rings is not None:
+                ringreasons = ringreasons[own[table.rings[2]]]
+        runmetrics.count('invalid_polygons', np.count_nonzero(invalid))
+        runmetrics.count('invalid_rings', np.count_nonzero(ringreasons))
+        runmetrics.count('failed_buildings', len(failures))
+        if self.verbose:
+            for b, error in failures:
+                print "\tBuilding %s is not evaluated: %s" % (table.bid[b], error)
+
+    def complete(self, result, runmetrics=None):
+        """Enriches the tree of the result with the irradiation of its roofs."""
+        if runmetrics is None:
+            runmetrics = metrics.RunMetrics(result.name)
+        #-- Check if there are roof surfaces in the file
+        if result.hasRoofs():
+            if self.verbose:
+                print '\tEnriching CityGML file with the solar irradiation data...'
+            with runmetrics.stage('enrich'):
+                enrich(result.root, result.table, self.walls)
+        elif self.verbose:
+            print "\tI am afraid I did not find any RoofSurface in your CityGML file."
+        return result
+
+    def processTree(self, root, name='', runmetrics=None):
+        """Estimates the solar irradiation of the roofs of the CityGML tree and enriches it. Returns a Result."""
+        if runmetrics is None:
+            runmetrics = metrics.RunMetrics(name)
+        result = self.prepare(root, name, runmetrics)
+        self.evaluate(result, runmetrics)
+        return self.complete(result, runmetrics)
+
+    def evaluate(self, result, runmetrics):
+        """Estimates the irradiation of the surfaces of a Result from prepare() (and propagates the positional error)."""
+        with runmetrics.stage('irradiation'):
+            cacheHits = self.solarinfo(result.table, runmetrics)
+        if self.tofs is not None:
+            runmetrics.count('tof_cache_hits', cacheHits)
+        elif self.tof is None:
+            surfaces = result.table.evaluated(self.classes)
+            nsurfaces = np.count_nonzero(~np.isnan(result.table.tilt[surfaces]))
+            runmetrics.count('cache_hits', cacheHits)
+            runmetrics.count('cache_misses', nsurfaces - cacheHits)
+        if self.realizations and result.hasRoofs():
+            if self.verbose:
+                print "\tPropagating the positional error in %d realizations..." % self.realizations
+            with runmetrics.stage('uncertainty'):
+                self.propagate(result)
+            runmetrics.count('realizations', self.realizations * len(result.uncertainty['roofs']))
+        return result
+
+    def processStream(self, stream, name='', runmetrics=None):
+        """Processes a CityGML from a file object or a string. Returns a Result."""
+        if runmetrics is None:
+            runmetrics = metrics.RunMetrics(name)
+        with runmetrics.stage('parse'):
+            if isinstance(stream, basestring):
+                root = etree.fromstring(stream)
+            else:
+                root = etree.parse(stream).getroot()
+        return self.processTree(root, name, runmetrics)
+
+    def processStore(self, path, name='', runmetrics=None):
+        """Processes a geometry store (see geometrystore.py) instead of the CityGML it was compiled from: nothing is
+        parsed or computed again but the irradiation. The Result has no tree. Returns a Result."""
+        if runmetrics is None:
+            runmetrics = metrics.RunMetrics(name)
+        with runmetrics.stage('load store'):
+            cityObjects, table = geometrystore.load(path)
+        if self.verbose:
+            print name
+            print "\tThere are", cityObjects, "cityObject(s) in this geometry store"
+            if geometrystore.isStale(path):
+                print "\tThe CityGML of this store has changed since it was compiled, compile it again to use the changes."
+        self.count(table, runmetrics)
+        result = self.evaluate(Result(name, None, cityObjects, table, self.stations, self.walls), runmetrics)
+        if self.verbose and not result.hasRoofs():
+            print "\tI am afraid I did not find any RoofSurface in your geometry store."
+        return result
+
+    def processFile(self, path, result=None, runmetrics=None, database=None):
+        """Processes a CityGML file (or a geometry store) and, if the directory result is given, writes the enriched file
+        (Delft.gml becomes Delft-solar.gml, see outputPath) to it, and the results to the database (a resultsdb.ResultsDB) if it is given.
+        The timings and counters are added to runmetrics. Returns a Result."""
+        if runmetrics is None:
+            runmetrics = metrics.RunMetrics(path)
+        runmetrics.startFile(path)
+        if geometrystore.isStore(path):
+            res = self.processStore(path, baseName(path), runmetrics)
+        else:
+            with openCityGML(path) as stream:
+                res = self.processStream(stream, baseName(path), runmetrics)
+        if result is not None and res.hasRoofs():
+            with runmetrics.stage('write'):
+                if res.root is not None:
+                    writeCityGML(res.root, solarPath(path, result))
+                else:
+                    runjournal.writeFile(csvPath(path, result), res.tocsv())
+                if res.uncertainty is not None:
+                    runjournal.writeFile(uncertaintyPath(path, result), uncertainty.tocsv(res.table, res.uncertainty))
+            if self.verbose:
+                print "\tFile written."
+        if database is not None:
+            with runmetrics.stage('database'):
+                database.addResult(res)
+        runmetrics.endFile()
+        return res
+
+    def processDirectory(self, directory, result, runmetrics=None, database=None):
+        """Processes all CityGML files (and geometry stores) in the directory. A file which fails is reported (and counted
+        in runmetrics) and the others are processed. With the journal, the files which were done in an earlier run are
+        skipped, and each file is recorded when it is done."""
+        #-- Find all CityGML files in the directory
+        for f in inputFiles(directory):
+            if self.journal is not None and self.journal.done(f):
+                if self.verbose:
+                    print "%s was done in an earlier run." % baseName(f)
+                continue
+            try:
+                res = self.processFile(f, result, runmetrics, database)
+            except Exception:
+                print "\t%s: failed\n%s" % (baseName(f), traceback.format_exc())
+                if runmetrics is not None:
+                    runmetrics.count('failed_files')
+                    runmetrics.endFile()
+                continue
+            if self.journal is not None:
+                self.journal.fileDone(f, outputPath(f, result) if result is not None and res.hasRoofs() else None, res.failed())
+
+
+def engineOptions(ARGS):
+    """The keyword arguments of the Engine from the parsed command line arguments."""
+    FACTORS = ARGS['factors']
+    options = {'factors' : FACTORS, 'interpolation' : ARGS['interpolation']}
+    if ARGS['locate']:
+        if FACTORS:
+            print "The TOF %s is not used, the TOFs are computed for the location of the buildings." % FACTORS
+        options = {'locate' : True, 'cluster' : float(ARGS['cluster']), 'tofstep' : float(ARGS['tofstep']), 'tofdir' : ARGS['tofdir'],
+                   'interpolation' : ARGS['interpolation']}
+        if ARGS['stations']:
+            options['stations'] = ARGS['stations']
+        if ARGS['monthly']:
+            options['monthly'] = True
+    elif ARGS['sky']:
+        if FACTORS:
+            print "The TOF %s is not used, the surfaces are evaluated with the cumulative sky." % FACTORS
+        options['factors'] = None
+        if ARGS['monthly']:
+            options['monthly'] = True
+    elif ARGS['stations']:
+        print "The weather stations are only used with --locate."
+    elif ARGS['monthly']:
+        print "The monthly irradiation is only estimated with --locate or --sky, or with a monthly TOF (TOF.py --monthly)."
+    if ARGS['sky']:
+        options['sky'] = int(ARGS['sky'])
+    if int(ARGS['uncertainty']):
+        if not FACTORS and not ARGS['locate'] and not ARGS['sky']:
+            PARSER.error("The error propagation needs a TOF (-f), --locate or --sky.")
+        options['realizations'] = int(ARGS['uncertainty'])
+        options['errors'] = uncertainty.ErrorModel(ARGS['error'], float(ARGS['sigmaxy']), float(ARGS['sigmaz']))
+        options['confidence'] = float(ARGS['confidence'])
+        options['seed'] = int(ARGS['seed']) if ARGS['seed'] else None
+
+    if ARGS['hours'] is not None:
+        options['hours'] = int(ARGS['hours'])
+    if ARGS['walls']:
+        options['walls'] = True
+    return options
+
+
+def main():
+    ARGS = vars(PARSER.parse_args())
+    DIRECTORY = ARGS['directory']
+    RESULT = ARGS['results']
+
+    runmetrics = metrics.RunMetrics('Solar3Dcity', ARGS)
+
+    print "I am Solar3Dcity. Let me search for your CityGML files..."
+
+    options = engineOptions(ARGS)
+
+    database = None
+    if ARGS['database']:
+        import resultsdb
+        database = resultsdb.ResultsDB(ARGS['database'])
+
+    #-- The journal of the run, to resume it if it is interrupted
+    if ARGS['restart'] and os.path.exists(os.path.join(RESULT, runjournal.JOURNAL)):
+        os.remove(os.path.join(RESULT, runjournal.JOURNAL))
+    journal = runjournal.RunJournal(RESULT, dict((k, v) for k, v in ARGS.items() if k not in RESUMABLE))
+
+    #-- Several files at once: reading, computing and writing overlap
+    if int(ARGS['jobs']) > 1:
+        import pipeline
+        function = pipeline.processDirectory
+        args = (options, DIRECTORY, RESULT, int(ARGS['jobs']), int(ARGS['queue']), runmetrics, database, journal)
     else:
-        print "\tI am afraid I did not find any RoofSurface in your CityGML file."
+        #-- Load the pre-computed dictionary
+        with runmetrics.stage('load TOF'):
+            engine = Engine(journal=journal, **options)
+        function = engine.processDirectory
+        args = (DIRECTORY, RESULT, runmetrics, database)
+
+    if ARGS['profile']:
+        metrics.profiled(function, ARGS['profile'], *args)
+    else:
+        function(*args)
+
+    journal.close()
+    if database is not None:
+        with runmetrics.stage('database'):
+            database.close()
+
+    runmetrics.summary()
+    if ARGS['metrics']:
+        runmetrics.dump(ARGS['metrics'])
+
+    print "All done."
+
 
-print "All done."
\ No newline at end of file
+if __name__ == '__main__':
+    main()
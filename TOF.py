@@ -31,20 +31,43 @@
 import cPickle as pickle
 import irr
 import argparse
+import collections
+import glob
+import os
 import numpy as np
+from scipy.interpolate import CubicSpline
+import metrics
+import journal
+import skymatrix
 
 #-- Parse command-line arguments
 PARSER = argparse.ArgumentParser(description='Estimate the tilt and orientation factor (TOF) for the annual insolation.')
 PARSER.add_argument('-lat', '--latitude',
-	help='latitude of the place', required=False)
+    help='latitude of the place', required=False)
 PARSER.add_argument('-lon', '--longitude',
-	help='longitude of the place', required=False)
+    help='longitude of the place', required=False)
 PARSER.add_argument('-f', '--factors',
-	help='Load the TOF if previously precomputed', required=False)
+    help='Load the TOF if previously precomputed', required=False)
 PARSER.add_argument('-s', '--step',
-	help='Resolution of the computations.', required=False)
+    help='Resolution of the computations.', required=False)
 PARSER.add_argument('-p', '--plot',
     help='Plot the TOFs.', required=False)
+PARSER.add_argument('-i', '--interpolation', choices=['linear', 'spline'],
+    help='Interpolation of the TOF; with spline, its coefficients are stored next to it.', required=False, default='linear')
+PARSER.add_argument('--hours',
+    help='Compute the TOF at once from all daylight hours (0) or from this number of representative hours, and report the error against all hours.', required=False)
+PARSER.add_argument('-y', '--years', nargs='+',
+    help='Compute the TOF for several weather years at once (EPW files, or a directory with them), with the layers mean, std, P50 and P90 of the years.', required=False)
+PARSER.add_argument('--monthly', action='store_true',
+    help='Also store the irradiation of each month as layers of the TOF (computed at once, like --hours 0).')
+PARSER.add_argument('--sky',
+    help='Compute the TOF at once from the cumulative sky with the patches of this Reinhart subdivision (1 is Tregenza, 145 patches; see skymatrix.py), and report its error against the integration of the hours.', required=False)
+PARSER.add_argument('-r', '--reference',
+    help='Report the error of the interpolated TOF on the nodes of a denser reference TOF (a file, or the resolution of a TOF computed for the comparison).', required=False)
+PARSER.add_argument('-m', '--metrics',
+    help='Write the timings and counters of the run to this JSON file.', required=False)
+PARSER.add_argument('--profile', nargs='?', const='TOF.prof',
+    help='Run under cProfile and dump the statistics to this file (default TOF.prof).', required=False)
 
 def argRead(ar, default=None):
     """Corrects the argument input in case it is not in the format True/False."""
@@ -61,67 +84,337 @@ def argRead(ar, default=None):
         raise ValueError("Argument value not recognised.")
     return ar
 
-ARGS = vars(PARSER.parse_args())
-LATITUDE = ARGS['latitude']
-LONGITUDE = ARGS['longitude']
-FACTORS = ARGS['factors']
-STEP = ARGS['step']
-PLOT = argRead(ARGS['plot'], False)
-
-#-- Place [lat, lon]
-if LATITUDE and LONGITUDE:
-	PLACE = (float(LATITUDE), float(LONGITUDE))
-else:
-	PLACE = (52.01, 4.36)
-
-#-- Load the pre-computed TOF dictionary
-if not FACTORS:
-	loadDict = False
-else:
-	loadDict = True
-
-#-- Azimuth-tilt-step in degrees
-if STEP:
-	STEP = float(STEP)
-else:
-	STEP = 15.0
-
-asteps = int(360.0 / STEP)
-tsteps = int(90.0 / STEP)
-azimuths = np.linspace(0.0, 360.0, asteps + 1)
-tilts = np.linspace(0.0, 90.0, tsteps + 1)
-
-#-- If the TOFs are already precomputed
-if loadDict:
-    with open(FACTORS, "rb") as myFile:
-        TOF = pickle.load(myFile)
-
-else:
-	#-- Create the dictionary
+
+def computeTOF(place, step, runmetrics=None):
+    """Computes the yearly irradiation for all azimuths and tilts with the resolution step (degrees).
+    Returns the TOF dictionary (azimuth -> tilt -> irradiation, with the angles as strings)."""
+    if runmetrics is None:
+        runmetrics = metrics.RunMetrics('TOF')
+    asteps = int(360.0 / step)
+    tsteps = int(90.0 / step)
+    azimuths = np.linspace(0.0, 360.0, asteps + 1)
+    tilts = np.linspace(0.0, 90.0, tsteps + 1)
+    total = len(azimuths) * len(tilts)
+    cached = irr.cacheHits
+
+    #-- Create the dictionary
     TOF = {}
 
     #-- For each azimuth
     for az in azimuths:
 
-    	#-- Open a sub-dictionary
+        #-- Open a sub-dictionary
         TOF[str(az)] = {}
 
         #-- For each tilt
         for tr in tilts:
-        	#-- Get the total yearly solar irradiation
-            total = irr.yearly_total_irr(PLACE, az, tr)#, INTERVAL, cloud_cover)
+            #-- Get the total yearly solar irradiation
+            with runmetrics.stage('integration'):
+                total_irr = irr.yearly_total_irr(place, az, tr)#, INTERVAL, cloud_cover)
             #-- Store it in the dictionary
-            TOF[str(az)][str(tr)] = total
+            TOF[str(az)][str(tr)] = total_irr
+            runmetrics.count('orientations')
             #-- Print the progress
-            print "Azimuth:", az, "\tTilt:", tr, "\tIrradiation:", total, "kWh/m^2"
-
-    #-- Store the obtained values to save time later
-    if TOF:
-        with open('TOF.dict', 'wb') as dict_items_save:
-            pickle.dump(TOF, dict_items_save)
-
-
-if PLOT:
+            print "Azimuth:", az, "\tTilt:", tr, "\tIrradiation:", total_irr, "kWh/m^2"
+            runmetrics.progress(runmetrics.counters['orientations'], total, 'orientations')
+
+    runmetrics.count('cache_hits', irr.cacheHits - cached)
+    return TOF
+
+
+def saveTOF(TOF, path='TOF.dict'):
+    """Stores the obtained values to save time later (atomically, an interrupted run does not leave a partial TOF)."""
+    journal.writeFile(path, pickle.dumps(TOF))
+
+
+def loadTOF(path):
+    """Loads the pre-computed TOF dictionary."""
+    with open(path, "rb") as myFile:
+        return pickle.load(myFile)
+
+
+#-- The interpolations of a TOFGrid
+INTERPOLATIONS = ('linear', 'spline')
+#-- The layers of a monthly TOF
+MONTHLY = ['year'] + irr.MONTHS
+
+
+def gridValues(TOF):
+    """The azimuths, tilts and values (azimuths x tilts) of a TOF dictionary."""
+    #-- The keys of the pickled dictionary are strings
+    azimuths = sorted(float(az) for az in TOF)
+    azKeys = dict((round(float(az), 2), az) for az in TOF)
+    tiKeys = dict((round(float(ti), 2), ti) for ti in TOF[azKeys[round(azimuths[0], 2)]])
+    tilts = sorted(tiKeys)
+    values = [[float(TOF[azKeys[round(az, 2)]][tiKeys[round(ti, 2)]]) for ti in tilts] for az in azimuths]
+    return azimuths, tilts, values
+
+
+class TOFGrid(object):
+    """The TOF as a regular grid (azimuths x tilts) for the vectorised interpolation of many surfaces at once.
+    The interpolation is bilinear, or a bicubic spline (periodic in azimuth) with the coefficients of each cell of the grid.
+    A TOF can have several layers (such as the mean and the percentiles of several weather years), which are the last
+    axis of the values (azimuths x tilts x layers) and are interpolated together."""
+    def __init__(self, TOF=None, azimuths=None, tilts=None, values=None, interpolation='linear', layers=None):
+        if TOF is not None and 'layers' in TOF:
+            #-- A TOF with layers is a dictionary of the TOF dictionaries of the layers
+            layers = TOF['layers']
+            grids = [gridValues(TOF['TOF'][layer]) for layer in layers]
+            azimuths, tilts = grids[0][:2]
+            values = np.stack([grid[2] for grid in grids], axis=-1)
+        elif TOF is not None:
+            azimuths, tilts, values = gridValues(TOF)
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError("Interpolation not supported: %s" % interpolation)
+        self.azimuths = np.asarray(azimuths, dtype=float)
+        self.tilts = np.asarray(tilts, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        self.interpolation = interpolation
+        #-- The names of the layers, or None
+        self.layers = list(layers) if layers is not None else None
+        #-- Resolution of the grid in degrees
+        self.res = self.azimuths[1] - self.azimuths[0]
+        #-- The coefficients of the spline, computed when they are first needed (see splineCoefficients)
+        self.coefficients = None
+
+    def todict(self):
+        """The TOF dictionary (azimuth -> tilt -> irradiation, with the angles as strings), as saved by saveTOF.
+        With layers, a dictionary with the names of the layers and the TOF dictionary of each."""
+        if self.layers is not None:
+            return {'layers' : self.layers, 'TOF' : dict((layer, self.layer(layer).todict()) for layer in self.layers)}
+        return dict((str(az), dict((str(ti), self.values[i, j]) for j, ti in enumerate(self.tilts))) for i, az in enumerate(self.azimuths))
+
+    def layer(self, name):
+        """The TOFGrid of a layer."""
+        return TOFGrid(azimuths=self.azimuths, tilts=self.tilts, values=self.values[:, :, self.layers.index(name)],
+                       interpolation=self.interpolation)
+
+    def lookup(self, azimuth, tilt):
+        """Yearly irradiation (kWh/m^2) of the surfaces with the azimuths and tilts, interpolated from the grid."""
+        if self.interpolation == 'spline':
+            return self.splineLookup(azimuth, tilt)
+        return self.linearLookup(azimuth, tilt)
+
+    def linearLookup(self, azimuth, tilt):
+        """Yearly irradiation (kWh/m^2) of the surfaces with the azimuths and tilts, interpolated from the four surrounding
+        values of the grid. On a node of the grid the value of the node is returned. With layers, the values of the
+        surfaces are arrays of the layers."""
+        a = np.atleast_1d(np.asarray(azimuth, dtype=float))
+        t = np.atleast_1d(np.asarray(tilt, dtype=float))
+        res = self.res
+        invRes = 1 / res
+        #-- The vertices of the interpolation square
+        aB = np.trunc(a * invRes) / invRes
+        aT = np.ceil(a * invRes) / invRes
+        aT = np.where(aT == aB, aT + res, aT)
+        tB = np.trunc(t * invRes) / invRes
+        tT = np.ceil(t * invRes) / invRes
+        tT = np.where(tT == tB, tT + res, tT)
+        #-- Their indices in the grid (on the upper edges of the grid the square is the last one of the grid)
+        i = np.clip(np.rint((aB - self.azimuths[0]) * invRes).astype(int), 0, None)
+        edge = i > len(self.azimuths) - 2
+        i[edge] = len(self.azimuths) - 2
+        aB = np.where(edge, self.azimuths[i], aB)
+        aT = np.where(edge, self.azimuths[i + 1], aT)
+        j = np.clip(np.rint((tB - self.tilts[0]) * invRes).astype(int), 0, None)
+        edge = j > len(self.tilts) - 2
+        j[edge] = len(self.tilts) - 2
+        tB = np.where(edge, self.tilts[j], tB)
+        tT = np.where(edge, self.tilts[j + 1], tT)
+        q11 = self.values[i, j]
+        q12 = self.values[i, j + 1]
+        q21 = self.values[i + 1, j]
+        q22 = self.values[i + 1, j + 1]
+        #-- The distances are broadcast over the layers
+        layers = self.values.shape[2:]
+        a, aB, aT, t, tB, tT = [x.reshape((-1,) + (1,) * len(layers)) for x in (a, aB, aT, t, tB, tT)]
+        values = (q11 * (aT - a) * (tT - t) +
+                  q21 * (a - aB) * (tT - t) +
+                  q12 * (aT - a) * (t - tB) +
+                  q22 * (a - aB) * (t - tB)
+                 ) / ((aT - aB) * (tT - tB) + 0.0)
+        return values.reshape(np.shape(azimuth) + layers)
+
+    def splineCoefficients(self):
+        """The coefficients of the bicubic spline, an array (4 x azimuth cells x 4 x tilt cells [x layers]): in the cell (i, j)
+        the value is the sum of c[p, i, q, j] * (azimuth - azimuths[i])^(3 - p) * (tilt - tilts[j])^(3 - q).
+        The spline is the tensor product of cubic splines along the tilt (not-a-knot) and along the azimuth (periodic)."""
+        if self.coefficients is None:
+            values = self.values.copy()
+            #-- 0 and 360 degrees are the same orientation
+            values[-1] = values[0]
+            alongTilt = CubicSpline(self.tilts, values, axis=1).c
+            #-- The coefficients along the tilt (4 x tilt cells x azimuths) are in turn interpolated along the azimuth
+            self.coefficients = CubicSpline(self.azimuths, alongTilt, axis=2, bc_type='periodic').c
+        return self.coefficients
+
+    def splineLookup(self, azimuth, tilt):
+        """Yearly irradiation (kWh/m^2) of the surfaces with the azimuths and tilts, from the bicubic spline of the grid.
+        The azimuths wrap around 360 degrees; the tilts outside the grid are extrapolated from its first or last cell."""
+        c = self.splineCoefficients()
+        a = np.asarray(azimuth, dtype=float).ravel()
+        t = np.asarray(tilt, dtype=float).ravel()
+        a = self.azimuths[0] + (a - self.azimuths[0]) % (self.azimuths[-1] - self.azimuths[0])
+        i = np.clip(np.searchsorted(self.azimuths, a, side='right') - 1, 0, len(self.azimuths) - 2)
+        j = np.clip(np.searchsorted(self.tilts, t, side='right') - 1, 0, len(self.tilts) - 2)
+        layers = self.values.shape[2:]
+        da = (a - self.azimuths[i]).reshape((-1,) + (1,) * len(layers))
+        dt = (t - self.tilts[j]).reshape((-1,) + (1,) * len(layers))
+        #-- Horner's scheme in the tilt for each power of the azimuth, then in the azimuth
+        values = np.zeros((len(a),) + layers)
+        for p in range(4):
+            cell = c[p, i, :, j]
+            values = values * da + ((cell[:, 0] * dt + cell[:, 1]) * dt + cell[:, 2]) * dt + cell[:, 3]
+        return values.reshape(np.shape(azimuth) + layers)
+
+
+def splinePath(path):
+    """File of the spline coefficients of the TOF in path."""
+    return path + '.spline.npz'
+
+
+def saveSpline(grid, path):
+    """Stores the spline coefficients of the TOFGrid next to its TOF file (path)."""
+    with open(splinePath(path), 'wb') as f:
+        np.savez(f, azimuths=grid.azimuths, tilts=grid.tilts, values=grid.values, coefficients=grid.splineCoefficients())
+
+
+def loadGrid(path, interpolation='linear'):
+    """Loads a pre-computed TOF as a TOFGrid. With the spline, its coefficients are loaded from the file next to the TOF
+    (see saveSpline) if they were computed from the same values."""
+    grid = TOFGrid(loadTOF(path), interpolation=interpolation)
+    if interpolation == 'spline' and os.path.exists(splinePath(path)):
+        stored = np.load(splinePath(path))
+        if (stored['values'].shape == grid.values.shape and np.array_equal(stored['values'], grid.values) and
+                np.array_equal(stored['azimuths'], grid.azimuths) and np.array_equal(stored['tilts'], grid.tilts)):
+            grid.coefficients = stored['coefficients']
+    return grid
+
+
+def interpolationError(grid, reference):
+    """The error of the interpolation of the TOFGrid on the nodes of the denser reference TOFGrid which are not nodes of the grid.
+    Returns a dictionary with the maximum and mean absolute error (kWh/m^2), the RMS error and the maximum relative error (%)."""
+    azimuths, tilts = np.meshgrid(reference.azimuths, reference.tilts, indexing='ij')
+    onGrid = np.in1d(azimuths.ravel(), grid.azimuths).reshape(azimuths.shape) & np.in1d(tilts.ravel(), grid.tilts).reshape(tilts.shape)
+    #-- Only the orientations within the grid
+    inside = ~onGrid & (tilts <= grid.tilts[-1]) & (azimuths <= grid.azimuths[-1])
+    if not inside.any():
+        raise ValueError("The reference TOF has no orientations between the nodes of the TOF.")
+    error = grid.lookup(azimuths[inside], tilts[inside]) - reference.values[inside]
+    return {'nodes' : int(inside.sum()), 'max' : np.abs(error).max(), 'mean' : np.abs(error).mean(), 'rms' : np.sqrt((error ** 2).mean()),
+            'relative' : 100. * (np.abs(error) / reference.values[inside]).max()}
+
+
+def computeGrid(place, step, records=None, arrays=None, interpolation='linear', bins=0, monthly=False, sky=None):
+    """Computes the TOF of the place with the resolution step (degrees) at once, with the vectorised irradiation model.
+    The weather is given as records or as their record_arrays, and integrated over all daylight hours or over bins
+    representative hours (see irr.yearly_grid). With monthly, the TOF has the layers of the year and of the months (MONTHLY).
+    With sky, the orientations are looked up in the cumulative sky with the patches of that subdivision (see skymatrix.py)."""
+    azimuths = np.linspace(0.0, 360.0, int(360.0 / step) + 1)
+    tilts = np.linspace(0.0, 90.0, int(90.0 / step) + 1)
+    if sky:
+        if arrays is None:
+            arrays = irr.record_arrays(records or irr.weather(irr.STATION_CODE))
+        values = skymatrix.grid(place, azimuths, tilts, arrays, bins, monthly, sky)
+    else:
+        values = irr.yearly_grid(place, azimuths, tilts, records, arrays=arrays, bins=bins, monthly=monthly)
+    return TOFGrid(azimuths=azimuths, tilts=tilts, values=values, interpolation=interpolation, layers=MONTHLY if monthly else None)
+
+
+
+def computeEnsemble(place, step, paths, interpolation='linear', monthly=False):
+    """Computes the TOF of the place with the resolution step (degrees) for the weather years in the EPW files (paths) in one pass,
+    with the layers irr.ENSEMBLE_LAYERS (mean, standard deviation, P50 and P90 of the years), and with monthly the mean of
+    each month (irr.MONTHS). The names of the years are in years."""
+    azimuths = np.linspace(0.0, 360.0, int(360.0 / step) + 1)
+    tilts = np.linspace(0.0, 90.0, int(90.0 / step) + 1)
+    years = irr.weather_years(paths)
+    totals = irr.ensemble_grid(place, azimuths, tilts, years, monthly=monthly)
+    if monthly:
+        values = np.concatenate([irr.ensemble_layers(totals[..., 0]), totals[..., 1:].mean(axis=0)], axis=-1)
+        layers = irr.ENSEMBLE_LAYERS + irr.MONTHS
+    else:
+        values = irr.ensemble_layers(totals)
+        layers = irr.ENSEMBLE_LAYERS
+    grid = TOFGrid(azimuths=azimuths, tilts=tilts, values=values, interpolation=interpolation, layers=layers)
+    grid.years = years[0]
+    return grid
+
+
+class TOFCache(object):
+    """TOFs of places, computed when they are first needed. The last size TOFs are kept in memory (least recently
+    used first out); if a directory is given, the TOFs are also stored there and loaded from it.
+    The weather comes from station_code, or from a station of the catalogue stations (see stations.py), and is integrated
+    over all daylight hours or over bins representative hours. With monthly, the TOFs have the layers of the months.
+    With sky, the places get their cumulative sky (a skymatrix.SkyMatrix with the patches of that subdivision, which is
+    looked up like a TOF) instead of a TOF; the skies are not stored in the directory, they take less time to compute than to load."""
+    def __init__(self, step=5.0, size=16, directory=None, station_code=irr.STATION_CODE, stations=None, interpolation='linear', bins=0,
+                 monthly=False, sky=None):
+        self.step = step
+        self.sky = sky
+        self.interpolation = interpolation
+        self.bins = bins
+        self.monthly = monthly
+        self.size = size
+        self.directory = directory
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.station_code = station_code
+        self.stations = stations
+        #-- The record_arrays of each station, read once
+        self.weather = {}
+        self.grids = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def code(self, station=None):
+        """Code of the station (an index in the catalogue), or of the default station if it is None."""
+        if station is None:
+            return self.station_code
+        return self.stations.codes[station]
+
+    def path(self, place, station=None):
+        """File of the TOF of the place and station in the directory."""
+        hours = '_h%d' % self.bins if self.bins else ''
+        monthly = '_monthly' if self.monthly else ''
+        return os.path.join(self.directory, 'TOF_%s_%.4f_%.4f_%g%s%s.dict' % (self.code(station), place[0], place[1], self.step, hours, monthly))
+
+    def arrays(self, station=None):
+        """The weather of the station as record_arrays, read when it is first needed."""
+        code = self.code(station)
+        if code not in self.weather:
+            if station is None:
+                self.weather[code] = irr.record_arrays(irr.weather(code))
+            else:
+                self.weather[code] = irr.read_epw(self.stations.paths[station])[1]
+        return self.weather[code]
+
+    def get(self, place, station=None):
+        """The TOFGrid (or SkyMatrix) of the place (latitude, longitude) with the weather of the station."""
+        place = (round(place[0], 4), round(place[1], 4))
+        key = (self.code(station), place)
+        if key in self.grids:
+            self.hits += 1
+            grid = self.grids.pop(key)
+        else:
+            self.misses += 1
+            if self.sky:
+                grid = skymatrix.SkyMatrix(irr.representative_hours(place, self.arrays(station), self.bins, monthly=self.monthly), self.sky)
+            elif self.directory and os.path.exists(self.path(place, station)):
+                grid = loadGrid(self.path(place, station), self.interpolation)
+            else:
+                grid = computeGrid(place, self.step, arrays=self.arrays(station), interpolation=self.interpolation, bins=self.bins,
+                                   monthly=self.monthly)
+                if self.directory:
+                    saveTOF(grid.todict(), self.path(place, station))
+            if len(self.grids) >= self.size:
+                self.grids.popitem(last=False)
+        self.grids[key] = grid
+        return grid
+
+
+def plotTOF(TOF):
+    """Plots the TOF to TOF-plot.pdf."""
     #-- Plotting time!
     import matplotlib as mpl
     #from matplotlib import rc
@@ -207,4 +500,115 @@ if PLOT:
     # plt.xlabel(xl, fontsize=12)
     # plt.ylabel(yl, fontsize=12)
     # plt.savefig('TOF-plot-360.pdf', bbox_inches='tight')
-    # plt.show()
\ No newline at end of file
+    # plt.show()
+
+
+def main():
+    ARGS = vars(PARSER.parse_args())
+    LATITUDE = ARGS['latitude']
+    LONGITUDE = ARGS['longitude']
+    FACTORS = ARGS['factors']
+    STEP = ARGS['step']
+    PLOT = argRead(ARGS['plot'], False)
+
+    #-- Place [lat, lon]
+    if LATITUDE and LONGITUDE:
+        PLACE = (float(LATITUDE), float(LONGITUDE))
+    else:
+        PLACE = (52.01, 4.36)
+
+    #-- Azimuth-tilt-step in degrees
+    if STEP:
+        STEP = float(STEP)
+    else:
+        STEP = 15.0
+
+    runmetrics = metrics.RunMetrics('TOF', ARGS)
+
+    #-- If the TOFs are already precomputed
+    if FACTORS:
+        with runmetrics.stage('load TOF'):
+            TOF = loadTOF(FACTORS)
+
+    #-- An ensemble of weather years, in one pass
+    elif ARGS['years']:
+        PATHS = []
+        for path in ARGS['years']:
+            PATHS.extend(sorted(glob.glob(os.path.join(path, '*.epw'))) if os.path.isdir(path) else [path])
+        with runmetrics.stage('integration'):
+            GRID = computeEnsemble(PLACE, STEP, PATHS, monthly=ARGS['monthly'])
+        TOF = GRID.todict()
+        mean = GRID.values[:, :, 0]
+        i, j = np.unravel_index(np.argmax(mean), mean.shape)
+        print "%d weather years: %s" % (len(GRID.years), ', '.join(GRID.years))
+        print "Best orientation (azimuth %g, tilt %g) [kWh/m^2]: %s" % (GRID.azimuths[i], GRID.tilts[j],
+            ', '.join('%s %.1f' % (layer, GRID.values[i, j, l]) for l, layer in enumerate(GRID.layers)))
+
+    #-- All orientations at once, with the vectorised model
+    elif ARGS['hours'] is not None or ARGS['monthly'] or ARGS['sky']:
+        BINS = int(ARGS['hours'] or 0)
+        SKY = int(ARGS['sky'] or 0)
+        with runmetrics.stage('integration'):
+            if ARGS['profile']:
+                TOF = metrics.profiled(computeGrid, ARGS['profile'], PLACE, STEP, bins=BINS, monthly=ARGS['monthly'], sky=SKY).todict()
+            else:
+                TOF = computeGrid(PLACE, STEP, bins=BINS, monthly=ARGS['monthly'], sky=SKY).todict()
+        if SKY:
+            with runmetrics.stage('sky error'):
+                ERROR = skymatrix.accuracy(PLACE, SKY, STEP, BINS)
+            print "Cumulative sky of %d sources." % ERROR['sources']
+            print "Error against the integration of the hours [kWh/m^2]: max %.2f, mean %.2f, bias %.2f, max relative %.2f%%" % (ERROR['max'], ERROR['mean'], ERROR['bias'], ERROR['relative'])
+            print "Integration: %.2f s, the sky %.3f s and its lookup %.3f s." % (ERROR['time'], ERROR['skytime'], ERROR['lookuptime'])
+        elif BINS:
+            with runmetrics.stage('reduction error'):
+                ERROR = irr.reduction_error(PLACE, BINS, STEP)
+            print "%d records, %d of them in daylight, reduced to %d representative hours." % (ERROR['records'], ERROR['daylight'], ERROR['hours'])
+            print "Error against all hours [kWh/m^2]: max %.2f, mean %.2f, bias %.2f, max relative %.2f%%" % (ERROR['max'], ERROR['mean'], ERROR['bias'], ERROR['relative'])
+            print "Integration: %.2f s with all hours, %.2f s with the representative hours (including their clustering)." % (ERROR['time'], ERROR['reducedtime'])
+
+    else:
+        if ARGS['profile']:
+            TOF = metrics.profiled(computeTOF, ARGS['profile'], PLACE, STEP, runmetrics)
+        else:
+            TOF = computeTOF(PLACE, STEP, runmetrics)
+
+    if not FACTORS:
+        #-- Store the obtained values to save time later
+        if TOF:
+            with runmetrics.stage('save TOF'):
+                saveTOF(TOF)
+
+    #-- The coefficients of the spline are stored next to the TOF
+    if ARGS['interpolation'] == 'spline':
+        with runmetrics.stage('spline'):
+            saveSpline(TOFGrid(TOF, interpolation='spline'), FACTORS or 'TOF.dict')
+
+    #-- The report and the plot are of the first layer of a TOF with layers (the mean of the years)
+    GRID = TOFGrid(TOF)
+    if GRID.layers is not None:
+        GRID = GRID.layer(GRID.layers[0])
+
+    #-- The error of the interpolations on the nodes of a denser TOF
+    if ARGS['reference']:
+        with runmetrics.stage('reference'):
+            if os.path.exists(ARGS['reference']):
+                REFERENCE = loadGrid(ARGS['reference'])
+            else:
+                REFERENCE = computeGrid(PLACE, float(ARGS['reference']))
+        print "Error of the interpolation on %d orientations of the reference TOF (%g degrees):" % (interpolationError(GRID, REFERENCE)['nodes'], REFERENCE.res)
+        print "\t\tmax [kWh/m^2]\tmean\tRMS\tmax [%]"
+        for method in INTERPOLATIONS:
+            GRID.interpolation = method
+            error = interpolationError(GRID, REFERENCE)
+            print "\t%s\t%.2f\t\t%.2f\t%.2f\t%.2f" % (method, error['max'], error['mean'], error['rms'], error['relative'])
+
+    runmetrics.summary()
+    if ARGS['metrics']:
+        runmetrics.dump(ARGS['metrics'])
+
+    if PLOT:
+        plotTOF(GRID.todict())
+
+
+if __name__ == '__main__':
+    main()
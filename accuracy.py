@@ -0,0 +1,251 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Accuracy versus speed of the ways to estimate the yearly irradiation of an orientation.
+
+Random orientations are evaluated with the direct model (irr.yearly_total_irr, solpy, one orientation at a time) as
+the reference, and with each shortcut:
+
+    TOF <step> linear/spline   a TOF with the resolution step (degrees), interpolated bilinearly or with the spline
+    hours <n>                  the vectorised model with n representative hours (see irr.representative_hours)
+    sky <n>                    the cumulative sky with the patches of the Reinhart subdivision n (see skymatrix.py)
+    vectorised                 the vectorised model with all daylight hours (the same values as the direct model)
+
+For each, the error distribution against the reference is reported next to the number of lookups per second and the
+time to precompute it (for a TOF also the estimated time with solpy, node by node). The reference values are computed
+once and kept in a cache file, which is reused as long as the place and the weather are the same.
+
+    python accuracy.py -n 1000 -s 15 10 5 2 --sky 1 2 --hours 250 1000
+
+Without -w, the weather is the EPW file of the default station which caelum keeps locally (it is only downloaded if
+it is not there yet), so the harness runs offline."""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+import irr
+import journal
+import skymatrix
+import TOF
+
+#-- Cache of the reference values in the working directory
+CACHE = 'accuracy-reference.json'
+#-- The lookups of a method are repeated for at least this time (seconds), for a stable throughput
+MINTIME = 0.2
+
+
+def loadWeather(path=None, station_code=irr.STATION_CODE):
+    """The weather records (as solpy reads them) and their record_arrays, from an EPW file or else from the station.
+    Returns the records, the arrays, the station (name, code, latitude, longitude, or None) and a key of the weather."""
+    if path is None:
+        records = irr.weather(station_code)
+        return records, irr.record_arrays(records), None, 'station %s' % station_code
+    station, arrays = irr.read_epw(path)
+    times, ghi, dhi, dni, etr = arrays
+    records = [{'utc_datetime' : t, 'GHI (W/m^2)' : ghi[k], 'DHI (W/m^2)' : dhi[k], 'DNI (W/m^2)' : dni[k], 'ETR (W/m^2)' : etr[k]}
+               for k, t in enumerate(times)]
+    return records, arrays, station, '%s %d %d' % ((os.path.abspath(path),) + journal.fingerprint(path))
+
+
+def orientations(n, seed=0):
+    """n random orientations: the azimuths uniform in [0, 360) and the tilts in [0, 90] degrees, rounded as the
+    orientations of the polygons (see citytable.orientation)."""
+    rng = np.random.RandomState(seed)
+    return np.round(rng.uniform(0., 360., n), 3), np.round(rng.uniform(0., 90., n), 3)
+
+
+class ReferenceCache(object):
+    """The direct irradiation of orientations at a place with a weather, stored in the file path."""
+    def __init__(self, path, place, weather):
+        self.path = path
+        self.key = {'place' : list(place), 'weather' : weather}
+        self.values = {}
+        #-- Time of the direct model per orientation, measured when values are computed
+        self.seconds = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored.get('key') == self.key:
+                self.values = stored['values']
+                self.seconds = stored.get('seconds')
+
+    def save(self):
+        if self.path:
+            journal.writeFile(self.path, json.dumps({'key' : self.key, 'values' : self.values, 'seconds' : self.seconds}))
+
+    def get(self, place, records, azimuths, tilts, checkpoint=50):
+        """The direct irradiation of the orientations, computing the missing ones (and saving them every checkpoint)."""
+        keys = ['%.3f %.3f' % (az, ti) for az, ti in zip(azimuths, tilts)]
+        missing = [(key, az, ti) for key, az, ti in zip(keys, azimuths, tilts) if key not in self.values]
+        if missing:
+            print "Computing the direct irradiation of %d orientations (%d cached)..." % (len(missing), len(keys) - len(missing))
+            started = time.time()
+            for k, (key, az, ti) in enumerate(missing):
+                self.values[key] = irr.yearly_total_irr(place, az, ti, records)
+                if (k + 1) % checkpoint == 0:
+                    self.seconds = (time.time() - started) / (k + 1)
+                    self.save()
+                    print "\t%d/%d" % (k + 1, len(missing))
+            self.seconds = (time.time() - started) / len(missing)
+            self.save()
+        return np.array([self.values[key] for key in keys])
+
+
+def errorStatistics(values, reference):
+    """The distribution of the error of the values: mean absolute, RMS, 95th and 99th percentile and maximum of the
+    absolute error, mean error (bias) in kWh/m^2, and the maximum relative error (%)."""
+    error = values - reference
+    absolute = np.abs(error)
+    p95, p99 = np.percentile(absolute, [95, 99])
+    return {'mean' : absolute.mean(), 'rms' : np.sqrt((error ** 2).mean()), 'p95' : p95, 'p99' : p99, 'max' : absolute.max(),
+            'bias' : error.mean(), 'relative' : 100. * (absolute / reference).max()}
+
+
+def throughput(lookup, azimuths, tilts, mintime=MINTIME):
+    """Lookups per second of the function lookup(azimuths, tilts), and its values."""
+    started = time.time()
+    values = lookup(azimuths, tilts)
+    count = 1
+    while time.time() - started < mintime:
+        lookup(azimuths, tilts)
+        count += 1
+    return count * len(azimuths) / (time.time() - started), values
+
+
+def methods(place, arrays, steps=(), skies=(), bins=(), vectorised=True):
+    """The methods to evaluate: a list of (name, precompute time in seconds, nodes of the TOF or None, lookup function)."""
+    found = []
+    started = time.time()
+    daylight = irr.representative_hours(place, arrays, 0)
+    hourstime = time.time() - started
+    if vectorised:
+        found.append(('vectorised', hourstime, None, lambda az, ti: irr.hours_irradiation(daylight, az, ti)))
+    for step in steps:
+        started = time.time()
+        grid = TOF.computeGrid(place, step, arrays=arrays)
+        gridtime = time.time() - started
+        nodes = grid.values.size
+        found.append(('TOF %g linear' % step, gridtime, nodes, grid.lookup))
+        spline = TOF.TOFGrid(azimuths=grid.azimuths, tilts=grid.tilts, values=grid.values, interpolation='spline')
+        started = time.time()
+        spline.splineCoefficients()
+        found.append(('TOF %g spline' % step, gridtime + time.time() - started, nodes, spline.lookup))
+    for n in bins:
+        started = time.time()
+        hours = irr.representative_hours(place, arrays, n)
+        found.append(('hours %d' % n, time.time() - started, None, lambda az, ti, hours=hours: irr.hours_irradiation(hours, az, ti)))
+    for subdivision in skies:
+        started = time.time()
+        sky = skymatrix.SkyMatrix(irr.representative_hours(place, arrays, 0), subdivision)
+        found.append(('sky %d' % subdivision, time.time() - started, None, sky.lookup))
+    return found
+
+
+def validate(place, records, arrays, weather, n=1000, seed=0, steps=(), skies=(), bins=(), cache=CACHE, reference='direct'):
+    """Evaluates the methods (see methods) on n random orientations against the reference: the direct model ('direct',
+    with the cache) or the vectorised model with all daylight hours ('vectorised'). Returns the list of the results."""
+    azimuths, tilts = orientations(n, seed)
+    results = []
+    if reference == 'direct':
+        references = ReferenceCache(cache, place, weather)
+        expected = references.get(place, records, azimuths, tilts)
+        if references.seconds:
+            results.append({'method' : 'direct', 'precompute' : 0., 'nodes' : None, 'rate' : 1. / references.seconds,
+                            'mean' : 0., 'rms' : 0., 'p95' : 0., 'p99' : 0., 'max' : 0., 'bias' : 0., 'relative' : 0.})
+    else:
+        references = None
+        expected = irr.hours_irradiation(irr.representative_hours(place, arrays, 0), azimuths, tilts)
+    for name, precompute, nodes, lookup in methods(place, arrays, steps, skies, bins, reference == 'direct'):
+        rate, values = throughput(lookup, azimuths, tilts)
+        result = {'method' : name, 'precompute' : precompute, 'nodes' : nodes, 'rate' : rate}
+        if nodes is not None and references is not None and references.seconds:
+            #-- The TOF computed node by node with solpy, as TOF.py without --hours
+            result['solpy'] = nodes * references.seconds
+        result.update(errorStatistics(values, expected))
+        results.append(result)
+    return results
+
+
+def printResults(results):
+    print "%-16s %12s %8s %12s %8s %8s %8s %8s %8s %8s %8s" % ('method', 'precompute s', 'nodes', 'lookups/s', 'mean', 'RMS', 'P95', 'P99', 'max', 'bias', 'max %')
+    for r in results:
+        precompute = '%.2f' % r['precompute']
+        if 'solpy' in r:
+            precompute += ' (%.0f)' % r['solpy']
+        print "%-16s %12s %8s %12.0f %8.2f %8.2f %8.2f %8.2f %8.2f %8.2f %8.2f" % (r['method'], precompute, r['nodes'] or '', r['rate'],
+            r['mean'], r['rms'], r['p95'], r['p99'], r['max'], r['bias'], r['relative'])
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Accuracy versus speed of the TOF interpolations and the other shortcuts of the irradiation model.')
+    PARSER.add_argument('-n', '--orientations',
+        help='Number of random orientations.', required=False, default='1000')
+    PARSER.add_argument('--seed',
+        help='Seed of the random orientations.', required=False, default='0')
+    PARSER.add_argument('-s', '--steps', nargs='*',
+        help='Resolutions (degrees) of the TOFs.', required=False, default=['15', '10', '5', '2'])
+    PARSER.add_argument('--sky', nargs='*',
+        help='Subdivisions of the cumulative sky.', required=False, default=['1', '2'])
+    PARSER.add_argument('--hours', nargs='*',
+        help='Numbers of representative hours.', required=False, default=['250', '1000'])
+    PARSER.add_argument('-w', '--weather',
+        help='EPW file of the weather (by default the one of the default station, as Solar3Dcity uses it).', required=False)
+    PARSER.add_argument('-lat', '--latitude',
+        help='Latitude of the place (by default the one of the EPW file, or Delft).', required=False)
+    PARSER.add_argument('-lon', '--longitude',
+        help='Longitude of the place.', required=False)
+    PARSER.add_argument('--reference', choices=['direct', 'vectorised'],
+        help='The reference: the direct model (solpy, cached), or the vectorised model with all daylight hours (the same values, much faster).', required=False, default='direct')
+    PARSER.add_argument('--cache',
+        help='File of the cached reference values.', required=False, default=CACHE)
+    PARSER.add_argument('-o', '--results',
+        help='Write the results to this JSON file.', required=False)
+    ARGS = vars(PARSER.parse_args())
+
+    RECORDS, ARRAYS, STATION, WEATHER = loadWeather(ARGS['weather'])
+    if ARGS['latitude'] and ARGS['longitude']:
+        PLACE = (float(ARGS['latitude']), float(ARGS['longitude']))
+    elif STATION is not None:
+        PLACE = (STATION[2], STATION[3])
+    else:
+        PLACE = (52.01, 4.36)
+    print "%d random orientations at %s with the weather of %s, against the %s model." % (int(ARGS['orientations']), PLACE,
+        ARGS['weather'] or 'station %s' % irr.STATION_CODE, ARGS['reference'])
+    RESULTS = validate(PLACE, RECORDS, ARRAYS, WEATHER, int(ARGS['orientations']), int(ARGS['seed']), [float(s) for s in ARGS['steps']],
+                       [int(s) for s in ARGS['sky']], [int(h) for h in ARGS['hours']], ARGS['cache'], ARGS['reference'])
+    print "Errors in kWh/m^2 (the precomputation of a TOF with solpy, node by node, in brackets):"
+    printResults(RESULTS)
+    if ARGS['results']:
+        with open(ARGS['results'], 'w') as f:
+            json.dump({'place' : PLACE, 'weather' : WEATHER, 'orientations' : int(ARGS['orientations']), 'reference' : ARGS['reference'],
+                       'results' : RESULTS}, f, indent=1)
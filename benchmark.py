@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Benchmark of Solar3Dcity on synthetic cities.
+
+Each case (level of detail and number of buildings) is generated with citygen and run in a
+separate process, so the peak memory of a case is not polluted by the others.
+The time of each stage is measured, and the results are stored as JSON.
+Optionally the results are compared with a previous run to catch regressions."""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import citygen
+
+#-- The stages of Solar3Dcity, in order
+STAGES = ['parse', 'classify', 'geometry', 'irradiation', 'enrich', 'write']
+
+#-- The TOF shipped with the package
+DEFAULT_TOF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TOF_Delft_1.dict')
+
+
+def runCase(path, tof, output):
+    """Runs Solar3Dcity on a file and writes the result to the directory output. Returns a dictionary with the results."""
+    import metrics
+    import Solar3Dcity
+    engine = Solar3Dcity.Engine(tof)
+    runmetrics = metrics.RunMetrics('benchmark')
+    engine.processFile(path, output, runmetrics)
+    report = runmetrics.report()
+    filereport = report['files'][0]
+    timings = dict((s, filereport['stages'].get(s, {'wall' : 0.0})['wall']) for s in STAGES)
+    total = sum(timings.values())
+    nbuildings = filereport['counters'].get('buildings', 0)
+    return {'buildings' : nbuildings,
+            'roofs' : filereport['counters'].get('roof_polygons', 0),
+            'stages' : timings,
+            'total' : total,
+            'buildings_per_sec' : nbuildings / total if total > 0 else None,
+            'peak_rss_kb' : report['peak_rss_kb']}
+
+
+def benchmark(sizes, lods, roof, holes, openings, tof, repeat=1, workdir=None):
+    """Generates the synthetic cities and runs each case in a subprocess. Returns the list of results."""
+    cleanup = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='solar3dcity-bench-')
+    results = []
+    try:
+        #-- Files without any roof (no buildings, and a building without geometry) must run through
+        for n, empty in [(0, 0), (0, 1)]:
+            path = os.path.join(workdir, 'city-empty-%d.gml' % empty)
+            citygen.writeCity(path, n, empty=empty)
+            subprocess.check_output([sys.executable, os.path.abspath(__file__), '--case', path, '-f', tof, '--output', workdir])
+        for lod in lods:
+            for n in sizes:
+                path = os.path.join(workdir, 'city-lod%d-%d.gml' % (lod, n))
+                citygen.writeCity(path, n, lod, roof, holes, openings)
+                size = os.path.getsize(path)
+                for r in range(repeat):
+                    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--case', path, '-f', tof, '--output', workdir])
+                    result = json.loads(out.strip().splitlines()[-1])
+                    result.update({'lod' : lod, 'size' : n, 'file_bytes' : size, 'repeat' : r})
+                    results.append(result)
+                    print "LOD%d %7d buildings: %8.2f s %10.1f buildings/s %8.1f MB peak RSS" % (lod, n, result['total'], result['buildings_per_sec'], result['peak_rss_kb'] / 1024.)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir)
+    return results
+
+
+def bestOf(results):
+    """Fastest repetition for each case."""
+    best = {}
+    for r in results:
+        key = (r['lod'], r['size'])
+        if key not in best or r['total'] < best[key]['total']:
+            best[key] = r
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """Lists the cases that are slower or use more memory than in the baseline by more than the tolerance (fraction)."""
+    regressions = []
+    new = bestOf(results)
+    old = bestOf(baseline)
+    for key in sorted(new):
+        if key not in old:
+            continue
+        for metric in ['total', 'peak_rss_kb'] + ['stages.' + s for s in STAGES]:
+            if metric.startswith('stages.'):
+                a = old[key]['stages'][metric[7:]]
+                b = new[key]['stages'][metric[7:]]
+            else:
+                a = old[key][metric]
+                b = new[key][metric]
+            #-- Ignore the noise of very short stages
+            if metric.startswith('stages.') and max(a, b) < 0.05:
+                continue
+            if a > 0 and (b - a) / a > tolerance:
+                regressions.append('LOD%d %d buildings: %s %.3f -> %.3f (+%.0f%%)' % (key[0], key[1], metric, a, b, 100. * (b - a) / a))
+    return regressions
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Benchmark Solar3Dcity on synthetic CityGML files.')
+    PARSER.add_argument('-n', '--sizes', nargs='+',
+        help='Numbers of buildings.', required=False, default=['10', '100', '1000'])
+    PARSER.add_argument('-l', '--lods', nargs='+',
+        help='Levels of detail.', required=False, default=['1', '2', '3'])
+    PARSER.add_argument('-r', '--roof',
+        help='Roof complexity: number of roof facets.', required=False, default='2')
+    PARSER.add_argument('--holes', action='store_true',
+        help='Cut a hole in each roof facet (a roof window at LOD3).')
+    PARSER.add_argument('--openings',
+        help='Number of windows per wall (LOD3).', required=False, default='2')
+    PARSER.add_argument('-f', '--factors',
+        help='TOF to sample the irradiation from.', required=False, default=DEFAULT_TOF)
+    PARSER.add_argument('--repeat',
+        help='Number of runs of each case (the fastest one is used for comparisons).', required=False, default='1')
+    PARSER.add_argument('-o', '--results',
+        help='Write the results to this JSON file.', required=False)
+    PARSER.add_argument('-c', '--compare',
+        help='JSON file of a previous run to compare with.', required=False)
+    PARSER.add_argument('-t', '--tolerance',
+        help='Allowed slowdown as a fraction before it is reported as a regression.', required=False, default='0.2')
+    PARSER.add_argument('--workdir',
+        help='Keep the generated files in this directory.', required=False)
+    PARSER.add_argument('--case',
+        help=argparse.SUPPRESS, required=False)
+    PARSER.add_argument('--output',
+        help=argparse.SUPPRESS, required=False)
+    ARGS = vars(PARSER.parse_args())
+
+    #-- A single case in a child process
+    if ARGS['case']:
+        print json.dumps(runCase(ARGS['case'], ARGS['factors'], ARGS['output']))
+        sys.exit(0)
+
+    results = benchmark([int(n) for n in ARGS['sizes']], [int(l) for l in ARGS['lods']], int(ARGS['roof']), ARGS['holes'], int(ARGS['openings']), ARGS['factors'], int(ARGS['repeat']), ARGS['workdir'])
+    report = {'date' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python' : platform.python_version(),
+              'machine' : platform.platform(),
+              'results' : results}
+    if ARGS['results']:
+        with open(ARGS['results'], 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if ARGS['compare']:
+        with open(ARGS['compare']) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, float(ARGS['tolerance']))
+        if regressions:
+            print "Regressions:"
+            for r in regressions:
+                print "\t" + r
+            sys.exit(1)
+        print "No regressions."
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Generator of synthetic CityGML 2.0 cities for testing and benchmarking Solar3Dcity.
+
+The buildings are placed on a jittered grid with random footprint rotations, heights and roof pitches.
+The roof complexity is the number of roof facets: 1 is a flat roof, 2 a gabled roof,
+and 3 or more a pyramidal roof on a regular polygonal footprint with as many sides.
+All polygons are oriented outwards and have gml:ids."""
+
+import argparse
+import math
+import random
+
+#-- Name spaces
+ns_citygml = "http://www.opengis.net/citygml/2.0"
+
+ns_gml = "http://www.opengis.net/gml"
+ns_bldg = "http://www.opengis.net/citygml/building/2.0"
+ns_xsi = "http://www.w3.org/2001/XMLSchema-instance"
+ns_xAL = "urn:oasis:names:tc:ciq:xsdschema:xAL:2.0"
+ns_xlink = "http://www.w3.org/1999/xlink"
+ns_dem = "http://www.opengis.net/citygml/relief/2.0"
+
+#-- Origin of the city (somewhere in Delft, in EPSG:28992)
+ORIGIN = (85000.0, 446000.0)
+
+#-- Distance between the buildings on the grid
+SPACING = 30.0
+
+
+def ring(points):
+    """Closes the ring and formats it as a gml:posList."""
+    pts = points + [points[0]]
+    return ' '.join('%.3f %.3f %.3f' % tuple(p) for p in pts)
+
+
+def scaled(points, factor):
+    """Ring scaled around its centroid, used for holes and openings."""
+    n = float(len(points))
+    c = [sum(p[i] for p in points) / n for i in range(3)]
+    return [[c[i] + factor * (p[i] - c[i]) for i in range(3)] for p in points]
+
+
+class Ids(object):
+    """Generator of unique gml:ids."""
+    def __init__(self):
+        self.count = 0
+
+    def next(self, prefix):
+        self.count += 1
+        return '%s%d' % (prefix, self.count)
+
+
+def polygonXML(pid, exterior, interiors=[]):
+    """A <gml:Polygon> with the exterior and interior rings."""
+    xml = '<gml:Polygon gml:id="%s">' % pid
+    xml += '<gml:exterior><gml:LinearRing><gml:posList srsDimension="3">%s</gml:posList></gml:LinearRing></gml:exterior>' % ring(exterior)
+    for i in interiors:
+        xml += '<gml:interior><gml:LinearRing><gml:posList srsDimension="3">%s</gml:posList></gml:LinearRing></gml:interior>' % ring(i)
+    xml += '</gml:Polygon>'
+    return xml
+
+
+def footprint(k, x, y, size, rotation):
+    """Footprint of a building: a rectangle for flat and gabled roofs, otherwise a regular polygon with k sides."""
+    if k <= 2:
+        w = size
+        l = size * 1.6
+        corners = [(-l/2, -w/2), (l/2, -w/2), (l/2, w/2), (-l/2, w/2)]
+    else:
+        corners = [(size/2 * math.cos(2*math.pi*i/k), size/2 * math.sin(2*math.pi*i/k)) for i in range(k)]
+    c = math.cos(rotation)
+    s = math.sin(rotation)
+    return [[x + u*c - v*s, y + u*s + v*c] for u, v in corners]
+
+
+def buildingShell(k, fp, h, pitch):
+    """Roof, wall and ground polygons (exterior rings without the closing point) of a building.
+    The footprint is counterclockwise."""
+    n = len(fp)
+    bottom = [[p[0], p[1], 0.0] for p in fp]
+    top = [[p[0], p[1], h] for p in fp]
+    grounds = [bottom[::-1]]
+    walls = []
+    roofs = []
+    if k == 1:
+        roofs.append(top)
+        for i in range(n):
+            walls.append([bottom[i], bottom[(i+1)%n], top[(i+1)%n], top[i]])
+    elif k == 2:
+        #-- Ridge along the long side
+        ridgeh = h + (math.sqrt((fp[3][0]-fp[0][0])**2 + (fp[3][1]-fp[0][1])**2) / 2) * math.tan(pitch)
+        r0 = [(fp[0][0]+fp[3][0])/2, (fp[0][1]+fp[3][1])/2, ridgeh]
+        r1 = [(fp[1][0]+fp[2][0])/2, (fp[1][1]+fp[2][1])/2, ridgeh]
+        roofs.append([top[0], top[1], r1, r0])
+        roofs.append([top[2], top[3], r0, r1])
+        walls.append([bottom[0], bottom[1], top[1], top[0]])
+        walls.append([bottom[1], bottom[2], top[2], r1, top[1]])
+        walls.append([bottom[2], bottom[3], top[3], top[2]])
+        walls.append([bottom[3], bottom[0], top[0], r0, top[3]])
+    else:
+        cx = sum(p[0] for p in fp) / n
+        cy = sum(p[1] for p in fp) / n
+        apothem = math.sqrt(((fp[0][0]+fp[1][0])/2 - cx)**2 + ((fp[0][1]+fp[1][1])/2 - cy)**2)
+        apex = [cx, cy, h + apothem * math.tan(pitch)]
+        for i in range(n):
+            roofs.append([top[i], top[(i+1)%n], apex])
+            walls.append([bottom[i], bottom[(i+1)%n], top[(i+1)%n], top[i]])
+    return roofs, walls, grounds
+
+
+def windows(wall, h, count):
+    """Rectangular openings along the bottom edge of a wall (counterclockwise as the wall)."""
+    a = wall[0]
+    b = wall[1]
+    ws = []
+    for i in range(count):
+        u0 = (i + 0.25) / count
+        u1 = (i + 0.75) / count
+        p0 = [a[j] + u0 * (b[j] - a[j]) for j in range(3)]
+        p1 = [a[j] + u1 * (b[j] - a[j]) for j in range(3)]
+        ws.append([[p0[0], p0[1], 0.3*h], [p1[0], p1[1], 0.3*h], [p1[0], p1[1], 0.7*h], [p0[0], p0[1], 0.7*h]])
+    return ws
+
+
+def buildingXML(bid, ids, lod, k, fp, h, pitch, holes, openings, semantics):
+    """A <bldg:Building> as a string."""
+    roofs, walls, grounds = buildingShell(k, fp, h, pitch)
+    xml = '<cityObjectMember><bldg:Building gml:id="%s">' % bid
+    xml += '<bldg:measuredHeight uom="m">%.2f</bldg:measuredHeight>' % h
+    if not semantics:
+        polys = ''
+        for r in roofs + walls + grounds:
+            polys += '<gml:surfaceMember>%s</gml:surfaceMember>' % polygonXML(ids.next('p'), r)
+        xml += '<bldg:lod%dSolid><gml:Solid><gml:exterior><gml:CompositeSurface>%s</gml:CompositeSurface></gml:exterior></gml:Solid></bldg:lod%dSolid>' % (lod, polys, lod)
+        xml += '</bldg:Building></cityObjectMember>'
+        return xml
+    ms = 'bldg:lod%dMultiSurface' % max(lod, 2)
+
+    def surface(tag, exterior, interiors=[], opens=[]):
+        s = '<bldg:boundedBy><bldg:%s gml:id="%s">' % (tag, ids.next('s'))
+        s += '<%s><gml:MultiSurface><gml:surfaceMember>%s</gml:surfaceMember></gml:MultiSurface></%s>' % (ms, polygonXML(ids.next('p'), exterior, interiors), ms)
+        for tagO, o in opens:
+            s += '<bldg:opening><bldg:%s gml:id="%s">' % (tagO, ids.next('o'))
+            s += '<%s><gml:MultiSurface><gml:surfaceMember>%s</gml:surfaceMember></gml:MultiSurface></%s>' % (ms, polygonXML(ids.next('p'), o), ms)
+            s += '</bldg:%s></bldg:opening>' % tagO
+        s += '</bldg:%s></bldg:boundedBy>' % tag
+        return s
+
+    for r in roofs:
+        if holes and lod >= 2:
+            hole = scaled(r, 0.2)
+            if lod == 3:
+                #-- The hole is a roof window
+                xml += surface('RoofSurface', r, [hole[::-1]], [('Window', hole)])
+            else:
+                xml += surface('RoofSurface', r, [hole[::-1]])
+        else:
+            xml += surface('RoofSurface', r)
+    for w in walls:
+        if lod == 3 and openings:
+            ws = windows(w, h, openings)
+            xml += surface('WallSurface', w, [o[::-1] for o in ws], [('Window', o) for o in ws])
+        else:
+            xml += surface('WallSurface', w)
+    for g in grounds:
+        xml += surface('GroundSurface', g)
+    xml += '</bldg:Building></cityObjectMember>'
+    return xml
+
+
+def writeCity(path, n, lod=2, roof=2, holes=False, openings=0, semantics=True, seed=0, empty=0):
+    """Writes a synthetic CityGML file with n buildings to path.
+    roof is the number of roof facets (ignored at LOD1, which has flat roofs),
+    holes cuts a hole in each roof facet (filled with a roof window at LOD3),
+    openings is the number of windows per wall at LOD3, and
+    empty is the number of buildings without any geometry added after them.
+    Returns the number of roof polygons (without openings)."""
+    rnd = random.Random(seed)
+    ids = Ids()
+    if lod == 1:
+        roof = 1
+    side = int(math.ceil(math.sqrt(n)))
+    nroofs = 0
+    lower = [ORIGIN[0], ORIGIN[1], 0.0]
+    upper = [ORIGIN[0] + side * SPACING, ORIGIN[1] + side * SPACING, 0.0]
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<CityModel xmlns="%s" xmlns:gml="%s" xmlns:bldg="%s" xmlns:xsi="%s" xmlns:xAL="%s" xmlns:xlink="%s" xmlns:dem="%s">\n' % (ns_citygml, ns_gml, ns_bldg, ns_xsi, ns_xAL, ns_xlink, ns_dem))
+        members = []
+        for b in range(n):
+            x = ORIGIN[0] + (b % side + 0.5) * SPACING + rnd.uniform(-3, 3)
+            y = ORIGIN[1] + (b // side + 0.5) * SPACING + rnd.uniform(-3, 3)
+            size = rnd.uniform(8, 14)
+            h = rnd.uniform(3, 15)
+            pitch = math.radians(rnd.uniform(15, 50))
+            fp = footprint(roof, x, y, size, rnd.uniform(0, 2*math.pi))
+            members.append(buildingXML('b%d' % (b + 1), ids, lod, roof, fp, h, pitch, holes, openings, semantics))
+            upper[2] = max(upper[2], h + size * math.tan(pitch))
+            nroofs += roof if semantics else 0
+        for b in range(empty):
+            members.append('<cityObjectMember><bldg:Building gml:id="e%d"></bldg:Building></cityObjectMember>' % (b + 1))
+        f.write('<gml:boundedBy><gml:Envelope srsName="EPSG:28992" srsDimension="3"><gml:lowerCorner>%.3f %.3f %.3f</gml:lowerCorner><gml:upperCorner>%.3f %.3f %.3f</gml:upperCorner></gml:Envelope></gml:boundedBy>\n' % tuple(lower + upper))
+        for m in members:
+            f.write(m + '\n')
+        f.write('</CityModel>\n')
+    return nroofs
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Generate a synthetic CityGML city.')
+    PARSER.add_argument('-o', '--output',
+        help='Path of the CityGML file to write.', required=True)
+    PARSER.add_argument('-n', '--buildings',
+        help='Number of buildings.', required=False, default='100')
+    PARSER.add_argument('-l', '--lod',
+        help='Level of detail (1, 2 or 3).', required=False, default='2')
+    PARSER.add_argument('-r', '--roof',
+        help='Roof complexity: number of roof facets (1 flat, 2 gabled, 3+ pyramidal).', required=False, default='2')
+    PARSER.add_argument('--holes', action='store_true',
+        help='Cut a hole in each roof facet (a roof window at LOD3).')
+    PARSER.add_argument('--openings',
+        help='Number of windows per wall (LOD3).', required=False, default='0')
+    PARSER.add_argument('--nosemantics', action='store_true',
+        help='Store the geometry as a solid without thematic surfaces.')
+    PARSER.add_argument('-s', '--seed',
+        help='Seed of the random generator.', required=False, default='0')
+    ARGS = vars(PARSER.parse_args())
+    nroofs = writeCity(ARGS['output'], int(ARGS['buildings']), int(ARGS['lod']), int(ARGS['roof']), ARGS['holes'], int(ARGS['openings']), not ARGS['nosemantics'], int(ARGS['seed']))
+    print "Written", ARGS['buildings'], "buildings with", nroofs, "roof surfaces to", ARGS['output']
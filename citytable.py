@@ -0,0 +1,456 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""The buildings and polygons of a CityGML file as a compact table (struct of arrays).
+
+Each polygon is a row with the index of its building, its semantic class, area, azimuth, tilt and irradiation.
+No XML elements are kept: the polygons are found again in the tree by their order or their gml:id.
+The polygons of buildings without thematic surfaces (e.g. only an lod2Solid) are classified by their geometry."""
+
+import array
+import numpy as np
+import polygon3dmodule
+import markup3dmodule
+
+#-- Name spaces
+ns_citygml = "http://www.opengis.net/citygml/2.0"
+ns_gml = "http://www.opengis.net/gml"
+ns_bldg = "http://www.opengis.net/citygml/building/2.0"
+ns_xlink = "http://www.w3.org/1999/xlink"
+
+#-- xlink:role of the cityObjectMembers which are only context (e.g. the halo of a tile, see tiling.py): their
+#-- buildings are read, but not evaluated nor reported
+CONTEXT = 'context'
+
+#-- Semantic classes of the polygons
+OTHER = 0
+ROOF = 1
+WALL = 2
+GROUND = 3
+OPENING = 4
+#-- Polygons of a building without thematic surfaces, until they are classified by their geometry
+UNCLASSIFIED = 5
+
+#-- Classification by the geometry: the polygons tilted more than WALL_TILT (degrees) from the horizontal are walls,
+#-- and the polygons not tilted as walls within BASE_HEIGHT (m) of the lowest point of the building are ground
+WALL_TILT = 80.0
+BASE_HEIGHT = 0.5
+
+#-- Thematic surfaces and their classes
+SURFACES = {'{%s}RoofSurface' % ns_bldg : ROOF,
+            '{%s}WallSurface' % ns_bldg : WALL,
+            '{%s}GroundSurface' % ns_bldg : GROUND}
+
+
+class CityTable(object):
+    """Buildings and polygons of a CityGML file."""
+    __slots__ = ('srsName', 'bid', 'centroid', 'latitude', 'longitude', 'station', 'building', 'pids', 'pidoffsets', 'semantic', 'invalid', 'ringreasons', 'area', 'azimuth', 'tilt', 'irradiation', 'layers', 'failures', 'context', 'rings')
+
+    def __init__(self, srsName=None):
+        #-- CRS of the coordinates
+        self.srsName = srsName
+        #-- gml:id of each building
+        self.bid = []
+        #-- Per building, after geometry(): the mean of its points (x, y, z), and its latitude and longitude if they are known
+        self.centroid = None
+        self.latitude = None
+        self.longitude = None
+        #-- Per building: index of its weather station in the catalogue of the engine, if there is one
+        self.station = None
+        #-- Per polygon: index of the building and semantic class
+        self.building = array.array('i')
+        self.semantic = array.array('b')
+        #-- gml:ids of the polygons, concatenated, and the offset of each one
+        self.pids = []
+        self.pidoffsets = array.array('l', [0])
+        #-- Per polygon, after geometry(): the reasons of its invalid rings (see polygon3dmodule.validateRings), area,
+        #-- and azimuth and tilt (NaN for the polygons which are not evaluated)
+        self.invalid = None
+        #-- Per ring, after geometry(): the reasons why it is invalid
+        self.ringreasons = None
+        self.area = None
+        self.azimuth = None
+        self.tilt = None
+        #-- Per polygon, yearly irradiation in kWh/m^2 (NaN for the polygons which are not evaluated)
+        self.irradiation = None
+        #-- With a TOF with layers (e.g. of several weather years): the name of each layer after the first (which is the
+        #-- irradiation) and its values per polygon
+        self.layers = None
+        #-- The buildings which failed (index -> error): their polygons are not evaluated
+        self.failures = {}
+        #-- The buildings which are only context (indices, see CONTEXT)
+        self.context = set()
+        #-- After geometry(rings=True): the rings of the polygons (see readRings), so they are not read from the tree again
+        self.rings = None
+
+    def __len__(self):
+        return len(self.semantic)
+
+    def pid(self, k):
+        """gml:id of the polygon k."""
+        return self.pids[self.pidoffsets[k]:self.pidoffsets[k+1]]
+
+    def addBuilding(self, xml):
+        """Adds a <bldg:Building> and classifies its polygons. If it fails, the table is left as it was."""
+        bid = xml.attrib['{%s}id' % ns_gml]
+        polygons = xml.findall('.//{%s}Polygon' % ns_gml)
+        classes = {}
+        for child in xml.iter(*SURFACES.keys()):
+            for poly in child.iter('{%s}Polygon' % ns_gml):
+                classes[poly] = SURFACES[child.tag]
+        #-- Without thematic surfaces, the polygons of the highest LOD are classified by their geometry (see classify)
+        if not classes:
+            for lod in (4, 3, 2, 1):
+                for child in xml.iter('{%s}lod%dSolid' % (ns_bldg, lod), '{%s}lod%dMultiSurface' % (ns_bldg, lod)):
+                    for poly in child.iter('{%s}Polygon' % ns_gml):
+                        classes[poly] = UNCLASSIFIED
+                if classes:
+                    break
+        #-- Openings are not usable surfaces
+        for child in xml.iter('{%s}opening' % ns_bldg):
+            for poly in child.iter('{%s}Polygon' % ns_gml):
+                classes[poly] = OPENING
+        self.appendBuilding(bid, polygons, [classes.get(poly, OTHER) for poly in polygons])
+
+    def addFailed(self, xml, error):
+        """Adds a <bldg:Building> which could not be classified, with all its polygons OTHER."""
+        polygons = xml.findall('.//{%s}Polygon' % ns_gml)
+        self.failures[len(self.bid)] = error
+        self.appendBuilding(xml.attrib.get('{%s}id' % ns_gml, ''), polygons, [OTHER] * len(polygons))
+
+    def appendBuilding(self, bid, polygons, classes):
+        b = len(self.bid)
+        self.bid.append(bid)
+        for poly, cls in zip(polygons, classes):
+            pid = poly.attrib.get('{%s}id' % ns_gml, '')
+            self.building.append(b)
+            self.semantic.append(cls)
+            self.pids.append(pid)
+            self.pidoffsets.append(self.pidoffsets[-1] + len(pid))
+
+    def geometry(self, root, classes=(ROOF,), rings=False):
+        """Extracts the area of all polygons, and the azimuth and tilt of the polygons of the classes.
+        The polygons are read from the tree in the same order as they were classified. All rings are
+        validated at once and the invalid ones do not count in the area. The roofs are oriented one by one,
+        the walls (which are many more) all at once, see wallOrientations. With rings, the rings are kept in
+        the table (e.g. for a geometry store or the error propagation)."""
+        n = len(self.semantic)
+        self.building = np.array(self.building, dtype=np.int32)
+        self.semantic = np.array(self.semantic, dtype=np.int8)
+        self.pids = ''.join(self.pids)
+        self.pidoffsets = np.array(self.pidoffsets, dtype=np.int64)
+        errors = []
+        points, offsets, ringpolygon, exterior = readRings(root, errors)
+        if rings:
+            self.rings = points, offsets, ringpolygon, exterior
+        for k, error in errors:
+            self.failures.setdefault(int(self.building[k]), error)
+        #-- Mean of the points of each building
+        pointbuilding = self.building[ringpolygon[polygon3dmodule.ringIndex(offsets)]]
+        counts = np.bincount(pointbuilding, minlength=len(self.bid)).astype(float)
+        counts[counts == 0] = np.nan
+        self.centroid = np.column_stack([np.bincount(pointbuilding, weights=points[:, c], minlength=len(self.bid)) / counts for c in range(3)])
+        if (self.semantic == UNCLASSIFIED).any():
+            base = np.zeros(len(self.bid)) + np.inf
+            np.minimum.at(base, pointbuilding, points[:, 2])
+            self.classify(points, offsets, ringpolygon, exterior, base)
+
+        valid, reasons = polygon3dmodule.validateRings(points, offsets)
+        #-- Reasons of the invalid rings of each polygon
+        self.invalid = np.zeros(n, dtype=np.uint8)
+        np.bitwise_or.at(self.invalid, ringpolygon, reasons)
+        self.ringreasons = reasons
+        #-- Area of the exterior minus the area of the interiors
+        areas = polygon3dmodule.ringAreas(points, offsets)
+        areas = np.where(valid, np.where(exterior, areas, -areas), 0.0)
+        self.area = np.bincount(ringpolygon, weights=areas, minlength=n)
+
+        self.azimuth = np.empty(n)
+        self.azimuth.fill(np.nan)
+        self.tilt = np.empty(n)
+        self.tilt.fill(np.nan)
+        self.irradiation = np.empty(n)
+        self.irradiation.fill(np.nan)
+        #-- The orientation of the polygons of the classes from the first three points of their exterior
+        first = np.zeros(n, dtype=np.int64) - 1
+        first[ringpolygon[exterior]] = offsets[:-1][exterior]
+        for k in np.where((self.semantic == ROOF) & (ROOF in classes) & (first >= 0))[0]:
+            try:
+                try:
+                    normal = polygon3dmodule.getNormal(points[first[k]:first[k] + 3].tolist())
+                except SyntaxWarning:
+                    #-- The first three points are collinear, take the normal of the whole ring
+                    ring = np.searchsorted(offsets, first[k])
+                    newell = polygon3dmodule.ringNewell(points[offsets[ring]:offsets[ring + 1]], offsets[ring:ring + 2] - offsets[ring])[0]
+                    if not newell.any():
+                        continue
+                    normal = newell / np.sqrt((newell ** 2).sum())
+                self.azimuth[k], self.tilt[k] = orientation(normal)
+            except Exception as e:
+                self.failures.setdefault(int(self.building[k]), failure(e))
+        walls = np.where((self.semantic == WALL) & (WALL in classes) & (first >= 0))[0]
+        if len(walls):
+            self.azimuth[walls], self.tilt[walls] = wallOrientations(points, offsets, first[walls])
+        #-- The polygons of the buildings which failed are not evaluated
+        if self.failures:
+            failed = np.in1d(self.building, self.failures.keys())
+            self.azimuth[failed] = np.nan
+            self.tilt[failed] = np.nan
+
+    def classify(self, points, offsets, ringpolygon, exterior, base):
+        """Classifies the UNCLASSIFIED polygons as roofs, walls or ground from the normal of their exterior and
+        its height above the base (lowest point) of their building, all at once. The rings have to be oriented
+        as CityGML requires (counterclockwise seen from outside); the polygons facing down above the base are OTHER."""
+        rings = np.where(exterior & (self.semantic[ringpolygon] == UNCLASSIFIED))[0]
+        mask = np.zeros(len(offsets) - 1, dtype=bool)
+        mask[rings] = True
+        ringpoints, ringoffsets = polygon3dmodule.selectRings(points, offsets, mask)
+        centroids = polygon3dmodule.ringCentroids(ringpoints, ringoffsets)
+        newell = polygon3dmodule.ringNewell(ringpoints, ringoffsets, centroids)
+        length = np.sqrt((newell ** 2).sum(axis=1))
+        #-- Angle between the normal and the zenith: 0 for a flat roof, 90 for a wall, 180 for the ground
+        angle = np.degrees(np.arccos(np.clip(newell[:, 2] / np.where(length > 0, length, 1.0), -1.0, 1.0)))
+        polys = ringpolygon[rings]
+        atbase = centroids[:, 2] - base[self.building[polys]] <= BASE_HEIGHT
+        classes = np.where(angle < WALL_TILT, ROOF, np.where(angle <= 180.0 - WALL_TILT, WALL, OTHER))
+        classes[(classes != WALL) & atbase] = GROUND
+        classes[length == 0] = OTHER
+        self.semantic[self.semantic == UNCLASSIFIED] = OTHER
+        self.semantic[polys] = classes
+
+    def mesh(self, root, classes=(ROOF,)):
+        """Triangulates the valid polygons of the classes (with their holes) at once.
+        Returns the vertices, the triangles (indices of the vertices) and the polygon (row of the table) of each triangle."""
+        points, offsets, ringpolygon, exterior = self.polygonRings(root)
+        mask = np.in1d(self.semantic[ringpolygon], classes)
+        if self.ringreasons is not None:
+            mask &= self.ringreasons == 0
+        points, offsets = polygon3dmodule.selectRings(points, offsets, mask)
+        return polygon3dmodule.triangulateRings(points, offsets, ringpolygon[mask], exterior[mask])
+
+    def polygonRings(self, root):
+        """The rings of the polygons (see readRings): the ones kept by geometry(rings=True), or else read from the tree."""
+        if self.rings is not None:
+            return self.rings
+        return readRings(root)
+
+    def select(self, cls):
+        """Indices of the polygons of a semantic class (without the ones of the context buildings)."""
+        return self.evaluated((cls,))
+
+    def evaluated(self, classes):
+        """Indices of the polygons of the semantic classes, without the ones of the context buildings."""
+        mask = np.in1d(self.semantic, classes)
+        if self.context:
+            mask &= ~np.in1d(self.building, list(self.context))
+        return np.where(mask)[0]
+
+    def ownBuildings(self):
+        """Indices of the buildings which are not context."""
+        return np.setdiff1d(np.arange(len(self.bid)), list(self.context))
+
+    def buildingSum(self, values, cls=None):
+        """Sum of the values of the polygons (of a class) per building."""
+        if cls is None:
+            sel = np.arange(len(self.semantic))
+        else:
+            sel = self.select(cls)
+        return np.bincount(self.building[sel], weights=values[sel], minlength=len(self.bid))
+
+    def roofarea(self):
+        """The total area of RoofSurface per building (without openings)."""
+        return self.buildingSum(self.area, ROOF)
+
+    def wallarea(self):
+        """The total area of WallSurfaces per building (without openings)."""
+        return self.buildingSum(self.area, WALL)
+
+    def groundarea(self):
+        """The total area of GroundSurfaces per building."""
+        return self.buildingSum(self.area, GROUND)
+
+    def openingarea(self):
+        """The total area of Openings per building."""
+        return self.buildingSum(self.area, OPENING)
+
+    def allarea(self):
+        """The total area of all surfaces (including openings) per building."""
+        return self.buildingSum(self.area)
+
+    def realarea(self):
+        """The total area of all surfaces without openings per building."""
+        return self.allarea() - self.openingarea()
+
+    def totalIrradiation(self):
+        """Irradiation of each polygon in kWh (NaN for the polygons which are not evaluated)."""
+        return self.irradiation * self.area
+
+    def yearlyIrradiation(self, cls=ROOF):
+        """Sum of the irradiation of the polygons of the class per building in kWh."""
+        return self.buildingSum(self.totalIrradiation(), cls)
+
+
+def orientation(normal):
+    """Azimuth and tilt of a surface from its normal, as used for the TOF."""
+    #-- Get the azimuth and tilt from the surface normal
+    az, tilt = polygon3dmodule.getAngles(normal)
+    az = round(az, 3)
+    #-- 360 -> 0 degrees
+    if az == 360.0:
+        az = 0.0
+    tilt = round(tilt, 3)
+    #-- Peculiar problems with the normals, with a cheap solution. Luckily very uncommon.
+    if tilt == 180:
+        tilt = 0.0
+    if tilt >= 180:
+        tilt = tilt - 180.01
+    elif tilt > 90:
+        tilt = tilt - 90.01
+    elif tilt == 90:
+        tilt = 89.9
+    #-- Flat surfaces always have the azimuth zero
+    if tilt == 0.0:
+        az = 0.0
+    return az, tilt
+
+
+def orientations(normals):
+    """Azimuths and tilts of many normals (n x 3, not necessarily unit vectors) at once, as orientation()."""
+    normals = np.asarray(normals, dtype=float)
+    az = 90 - np.degrees(np.arctan2(normals[:, 1], normals[:, 0]))
+    az = np.where(az >= 360.0, az - 360.0, np.where(az < 0.0, az + 360.0, az))
+    t = np.sqrt(normals[:, 0]**2 + normals[:, 1]**2)
+    tilt = np.where(t == 0, 0.0, 90 - np.degrees(np.arctan(normals[:, 2] / np.where(t == 0, 1.0, t))))
+    az = np.round(az, 3)
+    az[az == 360.0] = 0.0
+    tilt = np.round(tilt, 3)
+    tilt[tilt == 180] = 0.0
+    tilt = np.where(tilt >= 180, tilt - 180.01, np.where(tilt > 90, tilt - 90.01, np.where(tilt == 90, 89.9, tilt)))
+    az[tilt == 0.0] = 0.0
+    return az, tilt
+
+
+def failure(error):
+    """Description of an error of a building."""
+    return '%s: %s' % (type(error).__name__, error)
+
+
+def wallOrientations(points, offsets, first):
+    """Azimuths and tilts of the walls with the first point of their exterior at first, from the normal of their first
+    three points (or of their whole exterior if these are collinear), as orientations(). A wall is at most vertical:
+    a wall leaning outwards (tilt above 90) gets the tilt 90 instead of the correction of orientation() for roofs."""
+    second = np.minimum(first + 1, len(points) - 1)
+    third = np.minimum(first + 2, len(points) - 1)
+    normals = np.cross(points[second] - points[first], points[third] - points[first])
+    collinear = ~normals.any(axis=1)
+    if collinear.any():
+        #-- The rings of the walls are distinct, and selectRings keeps their order
+        rings = np.searchsorted(offsets, first[collinear])
+        mask = np.zeros(len(offsets) - 1, dtype=bool)
+        mask[rings] = True
+        newell = polygon3dmodule.ringNewell(*polygon3dmodule.selectRings(points, offsets, mask))
+        normals[collinear] = newell[np.searchsorted(np.sort(rings), rings)]
+    t = np.sqrt(normals[:, 0]**2 + normals[:, 1]**2)
+    az = 90 - np.degrees(np.arctan2(normals[:, 1], normals[:, 0]))
+    az = np.round(np.where(az >= 360.0, az - 360.0, np.where(az < 0.0, az + 360.0, az)), 3)
+    az[az == 360.0] = 0.0
+    tilt = np.where(t == 0, 0.0, 90 - np.degrees(np.arctan(normals[:, 2] / np.where(t == 0, 1.0, t))))
+    tilt = np.round(np.minimum(tilt, 90.0), 3)
+    az[tilt == 0.0] = 0.0
+    #-- Degenerate walls are not evaluated
+    degenerate = ~normals.any(axis=1)
+    az[degenerate] = np.nan
+    tilt[degenerate] = np.nan
+    return az, tilt
+
+
+def buildings(root):
+    """Iterates the <bldg:Building> elements of the city objects."""
+    for obj in root.iter('{%s}cityObjectMember' % ns_citygml):
+        for child in obj.iterchildren('{%s}Building' % ns_bldg):
+            yield child
+
+
+def polygons(root):
+    """Iterates the <gml:Polygon> elements of all buildings, in the order of the table."""
+    for b in buildings(root):
+        for poly in b.iterfind('.//{%s}Polygon' % ns_gml):
+            yield poly
+
+
+def readRings(root, errors=None):
+    """All rings of the polygons in the order of the table, as one array of points (n x 3) with the offsets of the rings,
+    the polygon of each ring, and if the ring is the exterior. A polygon whose coordinates cannot be read has no rings,
+    and (polygon, error) is appended to the list errors if it is given."""
+    coordinates = array.array('d')
+    offsets = array.array('l', [0])
+    ringpolygon = array.array('i')
+    exterior = array.array('b')
+    for k, poly in enumerate(polygons(root)):
+        e, i = markup3dmodule.polydecomposer(poly)
+        try:
+            rings = [markup3dmodule.GMLcoordinates(ring) for ring in e[:1] + i]
+        except Exception as error:
+            if errors is not None:
+                errors.append((k, failure(error)))
+            continue
+        for r, ring in enumerate(rings):
+            coordinates.extend(ring)
+            offsets.append(len(coordinates) // 3)
+            ringpolygon.append(k)
+            exterior.append(r == 0)
+    points = np.frombuffer(coordinates, dtype=float).reshape(-1, 3)
+    return points, np.array(offsets, dtype=np.int64), np.array(ringpolygon, dtype=np.int64), np.array(exterior, dtype=bool)
+
+
+def srsName(root):
+    """The CRS of the CityGML: the srsName of its envelope, or else the first srsName in the file."""
+    envelope = root.find('{%s}boundedBy/{%s}Envelope' % (ns_gml, ns_gml))
+    if envelope is not None and envelope.get('srsName'):
+        return envelope.get('srsName')
+    names = root.xpath('(//*[@srsName])[1]/@srsName')
+    if names:
+        return names[0]
+    return None
+
+
+def readCityGML(root):
+    """Finds all buildings in the CityGML and classifies their polygons. Returns the number of city objects and the table."""
+    table = CityTable(srsName(root))
+    for obj in root.iter('{%s}cityObjectMember' % ns_citygml):
+        for b in obj.iterchildren('{%s}Building' % ns_bldg):
+            if obj.get('{%s}role' % ns_xlink) == CONTEXT:
+                table.context.add(len(table.bid))
+            try:
+                table.addBuilding(b)
+            except Exception as e:
+                table.addFailed(b, failure(e))
+    cityObjects = sum(1 for obj in root.iter('{%s}cityObjectMember' % ns_citygml))
+    return cityObjects, table
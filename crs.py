@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Latitude and longitude of coordinates given in the CRS of a CityGML file (its srsName).
+
+The Dutch RD (EPSG:28992, also with NAP heights as EPSG:7415), UTM (WGS84 and ETRS89) and geographic
+coordinates are converted without any dependency, which is more than accurate enough for the position of the sun.
+Other CRSs are converted with pyproj, if it is installed."""
+
+import re
+import numpy as np
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+#-- EPSG codes of the Dutch RD New (alone and with NAP heights)
+RD = (28992, 7415)
+#-- EPSG codes of geographic CRSs (latitude, longitude in this order)
+GEOGRAPHIC = (4326, 4258, 4979, 4937)
+
+#-- EPSG:28992, urn:ogc:def:crs:EPSG::28992, urn:ogc:def:crs:EPSG:6.12:28992, http://www.opengis.net/def/crs/EPSG/0/28992,
+#-- and the compound urn:ogc:def:crs,crs:EPSG::28992,crs:EPSG::5709 (the first one is the horizontal CRS)
+EPSG_PATTERN = re.compile(r'EPSG(?::[\d.]*:|/[\d.]+/|:)(\d+)', re.IGNORECASE)
+
+
+def epsgCode(srsName):
+    """EPSG code of the srsName, or None if it cannot be recognised."""
+    if not srsName:
+        return None
+    match = EPSG_PATTERN.search(srsName)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def isSupported(srsName):
+    """True if the coordinates in the srsName can be converted to latitude and longitude."""
+    code = epsgCode(srsName)
+    if code is None:
+        return False
+    return code in RD or code in GEOGRAPHIC or utmZone(code) is not None or pyproj is not None
+
+
+def rdToLatLon(x, y):
+    """Latitude and longitude (WGS84) of RD coordinates, with the approximation of Schreutjes and Strang van Hees
+    (accurate to about a metre, in the area of the Netherlands)."""
+    dX = (np.asarray(x, dtype=float) - 155000.) * 1e-5
+    dY = (np.asarray(y, dtype=float) - 463000.) * 1e-5
+    sumN = (3235.65389 * dY) + (-32.58297 * dX**2) + (-0.2475 * dY**2) + (-0.84978 * dX**2 * dY) + \
+           (-0.0655 * dY**3) + (-0.01709 * dX**2 * dY**2) + (-0.00738 * dX) + (0.0053 * dX**4) + \
+           (-0.00039 * dX**2 * dY**3) + (0.00033 * dX**4 * dY) + (-0.00012 * dX * dY)
+    sumE = (5260.52916 * dX) + (105.94684 * dX * dY) + (2.45656 * dX * dY**2) + (-0.81885 * dX**3) + \
+           (0.05594 * dX * dY**3) + (-0.05607 * dX**3 * dY) + (0.01199 * dY) + (-0.00256 * dX**3 * dY**2) + \
+           (0.00128 * dX * dY**4) + (0.00022 * dY**2) + (-0.00022 * dX**2) + (0.00026 * dX**5)
+    return 52.15517440 + sumN / 3600., 5.38720621 + sumE / 3600.
+
+
+def utmZone(code):
+    """Zone and hemisphere (True if north) of the UTM EPSG codes (WGS84 326zz/327zz, ETRS89 258zz), or None."""
+    if 32601 <= code <= 32660:
+        return code - 32600, True
+    if 32701 <= code <= 32760:
+        return code - 32700, False
+    if 25801 <= code <= 25860:
+        return code - 25800, True
+    return None
+
+
+def utmToLatLon(x, y, zone, north=True):
+    """Latitude and longitude of UTM coordinates (the GRS80 and WGS84 ellipsoids are equal for this purpose)."""
+    a = 6378137.
+    f = 1 / 298.257223563
+    e2 = f * (2 - f)
+    ep2 = e2 / (1 - e2)
+    k0 = 0.9996
+    x = np.asarray(x, dtype=float) - 500000.
+    y = np.asarray(y, dtype=float)
+    if not north:
+        y = y - 10000000.
+    #-- Footpoint latitude
+    m = y / k0
+    mu = m / (a * (1 - e2 / 4 - 3 * e2**2 / 64 - 5 * e2**3 / 256))
+    e1 = (1 - np.sqrt(1 - e2)) / (1 + np.sqrt(1 - e2))
+    phi1 = mu + (3 * e1 / 2 - 27 * e1**3 / 32) * np.sin(2 * mu) + (21 * e1**2 / 16 - 55 * e1**4 / 32) * np.sin(4 * mu) + \
+           (151 * e1**3 / 96) * np.sin(6 * mu) + (1097 * e1**4 / 512) * np.sin(8 * mu)
+    n1 = a / np.sqrt(1 - e2 * np.sin(phi1)**2)
+    t1 = np.tan(phi1)**2
+    c1 = ep2 * np.cos(phi1)**2
+    r1 = a * (1 - e2) / (1 - e2 * np.sin(phi1)**2)**1.5
+    d = x / (n1 * k0)
+    lat = phi1 - (n1 * np.tan(phi1) / r1) * (d**2 / 2 - (5 + 3 * t1 + 10 * c1 - 4 * c1**2 - 9 * ep2) * d**4 / 24 +
+                                             (61 + 90 * t1 + 298 * c1 + 45 * t1**2 - 252 * ep2 - 3 * c1**2) * d**6 / 720)
+    lon = (d - (1 + 2 * t1 + c1) * d**3 / 6 + (5 - 2 * c1 + 28 * t1 - 3 * c1**2 + 8 * ep2 + 24 * t1**2) * d**5 / 120) / np.cos(phi1)
+    return np.degrees(lat), (zone - 1) * 6 - 180 + 3 + np.degrees(lon)
+
+
+def toLatLon(srsName, x, y):
+    """Latitude and longitude (degrees) of the arrays of coordinates x and y in the CRS srsName."""
+    code = epsgCode(srsName)
+    if code is None:
+        raise ValueError("The CRS %s is not recognised." % srsName)
+    if code in RD:
+        return rdToLatLon(x, y)
+    if code in GEOGRAPHIC:
+        #-- The EPSG axis order of the geographic CRSs is latitude, longitude
+        return np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    zone = utmZone(code)
+    if zone is not None:
+        return utmToLatLon(x, y, zone[0], zone[1])
+    if pyproj is None:
+        raise ValueError("The CRS %s is not supported without pyproj." % srsName)
+    lon, lat = pyproj.transform(pyproj.Proj(init='epsg:%d' % code), pyproj.Proj(init='epsg:4326'), np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    return np.asarray(lat), np.asarray(lon)
@@ -28,165 +28,165 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from solpy import irradiation
+import irr
+import argparse
 import datetime
+import numpy as np
+
+#-- Parse command-line arguments
+PARSER = argparse.ArgumentParser(description='Plot the daily clear-sky global irradiance on tilted and oriented surfaces.')
+PARSER.add_argument('-lat', '--latitude',
+    help='latitude of the place', required=False)
+PARSER.add_argument('-lon', '--longitude',
+    help='longitude of the place', required=False)
+PARSER.add_argument('-s', '--surfaces', nargs='+',
+    help='Surfaces as name:tilt:azimuth, e.g. A:40:180 B:40:90', required=False)
+PARSER.add_argument('-d', '--dates', nargs='+',
+    help='Dates as YYYY-MM-DD or MMDD (the latter in the year 2015), e.g. 0327 0621', required=False)
+PARSER.add_argument('-i', '--interval',
+    help='Sampling interval in minutes.', required=False)
+PARSER.add_argument('-tz', '--tzoffset',
+    help='Offset of the local time from UTC in hours (for the plot).', required=False)
+PARSER.add_argument('-o', '--output',
+    help='Write the irradiance values to this CSV file.', required=False)
+PARSER.add_argument('-p', '--plot',
+    help='Plot the profiles (dailyplot.png and dailyplot.pdf).', required=False)
+
+
+def argRead(ar, default=None):
+    """Corrects the argument input in case it is not in the format True/False."""
+    if ar == "0" or ar == "False":
+        ar = False
+    elif ar == "1" or ar == "True":
+        ar = True
+    elif ar is None:
+        if default:
+            ar = default
+        else:
+            ar = False
+    else:
+        raise ValueError("Argument value not recognised.")
+    return ar
+
+
+def parseSurface(s):
+    """Convert name:tilt:azimuth to a surface setting."""
+    name, tilt, azimuth = s.rsplit(':', 2)
+    return {'Name' : name, 'Tilt' : float(tilt), 'Azimuth' : float(azimuth)}
+
+
+def parseDate(s, year=2015):
+    """Convert YYYY-MM-DD or MMDD to a date."""
+    if '-' in s:
+        return datetime.datetime.strptime(s, '%Y-%m-%d').date()
+    return datetime.date(year, int(s[:2]), int(s[2:]))
+
+
+def daily_profiles(place, surfaces, dates, interval=5, hours=(3, 20), cloud_cover=0.0):
+    """Clear-sky global irradiance (W/m^2) on each surface during each of the dates.
+    The sun positions and the sky components are computed once per timestamp, and all surfaces are evaluated in one pass.
+    Input: location (lat, lon), list of surface settings (Name, Tilt, Azimuth), list of dates,
+    the sampling interval in minutes, and the span of UTC hours (the sun is not up outside it anyway in our latitudes).
+    Returns the UTC timestamps, the irradiance matrix (surfaces x timestamps), and the irradiance on a horizontal surface."""
+    timestamps = []
+    for d in dates:
+        for hour in range(hours[0], hours[1]):
+            for minute in range(0, 60, interval):
+                timestamps.append(datetime.datetime.combine(d, datetime.time(hour, minute)))
+    az, alt = irr.sun_positions(place, timestamps)
+    ghi, dhi, dni, etr = irr.clearsky(timestamps, alt, cloud_cover)
+    tilts = [s['Tilt'] for s in surfaces]
+    azimuths = [s['Azimuth'] for s in surfaces]
+    values = irr.tilted_irradiance(ghi, dhi, dni, etr, az, alt, tilts, azimuths)
+    horizontal = irr.tilted_irradiance(ghi, dhi, dni, etr, az, alt, [0.0], [180.0])[0]
+    return timestamps, values, horizontal
+
+
+def writeCSV(path, surfaces, timestamps, values, horizontal):
+    """Store the profiles as surface, UTC time, irradiance, horizontal irradiance."""
+    with open(path, 'w') as f:
+        f.write('surface,utc_datetime,irradiance,horizontal_irradiance\n')
+        for s, setting in enumerate(surfaces):
+            for k, ts in enumerate(timestamps):
+                f.write('%s,%s,%s,%s\n' % (setting['Name'], ts.isoformat(), values[s][k], horizontal[k]))
+
+
+def plotProfiles(surfaces, dates, timestamps, values, tzoffset):
+    """Plot the profiles of all surfaces on all dates to dailyplot.png and dailyplot.pdf.
+    The colour distinguishes the surfaces and the line style the dates."""
+    import matplotlib as mpl
+    #-- No display required
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as md
+    plt.rc('font', family='serif')
+    import seaborn as sns
+    #-- Plotting properties
+    sns.set(style="white", font='serif', rc={'axes.facecolor': '#FFFFFF', 'grid.linestyle': '', 'axes.grid' : False, 'font.family': ['serif'], 'legend.frameon': True})
+    colors = sns.color_palette()
+    linestyles = ['--', '-', ':', '-.']
+    markers = ['o', 'v', 's', 'D', '^', '*']
+
+    fig, ax1 = plt.subplots(figsize=(8, 4))
+    days = np.array([ts.date() for ts in timestamps])
+    legend = []
+    for j, d in enumerate(dates):
+        sel = np.where(days == d)[0]
+        #-- Workaround to keep the data aligned: all days on the same date
+        local = [datetime.datetime.combine(datetime.date(2013, 1, 1), timestamps[k].time()) + tzoffset for k in sel]
+        for s, setting in enumerate(surfaces):
+            plt.plot(local, values[s][sel], color=colors[s % len(colors)], linestyle=linestyles[j % len(linestyles)], marker=markers[s % len(markers)], markevery=max(1, len(sel)//12))
+            legend.append('%s on %s' % (setting['Name'], d.strftime('%d %b').lstrip('0')))
+
+    xfmt = md.DateFormatter('%H:%M')
+    ax1.xaxis.set_major_formatter(xfmt)
+    sns.despine(left=False, bottom=False)
+    ax1.set_ylim([0, 1050])
+    plt.xlabel('Local time', size=14)
+    plt.ylabel(r'Global solar irradiance (W/m$^{2}$)', size=14)
+    plt.legend(legend, loc='upper center', bbox_to_anchor=(0.5, 1.15), fancybox=1, shadow=0, ncol=4, numpoints=1, prop={'size':12})
+    plt.savefig('dailyplot.png', bbox_inches='tight', dpi=300)
+    plt.savefig('dailyplot.pdf', bbox_inches='tight')
+
+
+if __name__ == '__main__':
+    ARGS = vars(PARSER.parse_args())
+
+    #-- Place [lat, lon]
+    if ARGS['latitude'] and ARGS['longitude']:
+        place = (float(ARGS['latitude']), float(ARGS['longitude']))
+    else:
+        place = (52.01, 4.36)
 
-settings = []
-
-place = (52.01, 4.36)
-
-tzoffset = datetime.timedelta(hours=2)
-
-settings.append({'Name' : 'Surface A',
-'Tilt' : 40.0,
-'Azimuth' : 180.0,
-})
-
-settings.append({'Name' : 'Surface B',
-'Tilt' : 40.0,
-'Azimuth' : 90.0,
-})
-
-#-- Which days
-#-- month, day format
-epochs = [[3, 27], [6, 21]]
+    #-- Which surfaces
+    if ARGS['surfaces']:
+        settings = [parseSurface(s) for s in ARGS['surfaces']]
+    else:
+        settings = [{'Name' : 'Surface A', 'Tilt' : 40.0, 'Azimuth' : 180.0},
+                    {'Name' : 'Surface B', 'Tilt' : 40.0, 'Azimuth' : 90.0}]
 
-#-- Sampling interval
-interval = 5
+    #-- Which days
+    if ARGS['dates']:
+        epochs = [parseDate(d) for d in ARGS['dates']]
+    else:
+        epochs = [datetime.date(2015, 3, 27), datetime.date(2015, 6, 21)]
 
-#-- Results
-res = {}
+    #-- Sampling interval
+    if ARGS['interval']:
+        interval = int(ARGS['interval'])
+    else:
+        interval = 5
 
-#-- Clouds: left for future work, at this moment the computations are clear-sky
-ccddatabase = None
+    if ARGS['tzoffset']:
+        tzoffset = datetime.timedelta(hours=float(ARGS['tzoffset']))
+    else:
+        tzoffset = datetime.timedelta(hours=2)
 
-#-- Iterate the days
-for epoch in epochs:
+    #-- Clouds: left for future work, at this moment the computations are clear-sky
+    timestamps, values, horizontal = daily_profiles(place, settings, epochs, interval)
 
-    month = epoch[0]
-    day = epoch[1]
+    if ARGS['output']:
+        writeCSV(ARGS['output'], settings, timestamps, values, horizontal)
 
-    d = datetime.date(2015, month, day)
-    #-- Tweaking to get the proper key values for dates
-    if month < 10:
-        m_s = '0' + str(month)
-    else:
-        m_s = str(month)
-    if day < 10:
-        d_s = '0' + str(day)
-    else:
-        d_s = str(day)
-    #-- These are UTC times. The program is not smart enough to use sunrise and sunset times, but this works too
-    for hour in range(3, 20):
-        for minute in range(0, 60, interval):
-            #-- Datetime
-            t = datetime.time(hour, minute)
-            dt = datetime.datetime.combine(d, t)
-
-            #-- Get the historic cloud cover for that day
-            # if ccddatabase:
-            #     cloud_cover = ccddatabase[str(m_s)+str(d_s)]
-            # else:
-            #     cloud_cover = 0.0
-
-            for setting in settings:
-                if setting['Name'] not in res:
-                    res[setting['Name']] = {}
-                e = str(m_s)+str(d_s)
-                if e not in res[setting['Name']]:
-                    res[setting['Name']][e] = []
-
-                #-- Global synthetic irradiation from Solpy
-                global_irradiation_rec = irradiation.blave(dt, place, 0, 180)
-                #-- Adjust it for the tilt. The value is now in W/m^2
-                irrValue = irradiation.irradiation(global_irradiation_rec, place, None, setting['Tilt'], setting['Azimuth'], 'p9')
-                horr_irrValue = irradiation.irradiation(global_irradiation_rec, place, None, 0, 180, 'p9')
-                #-- Workaround to keep the data aligned
-                d_ = datetime.date(2013, 1, 1)
-                t_ = datetime.time(hour, minute)
-                dt_ = datetime.datetime.combine(d_, t_)
-                res[setting['Name']][e].append([dt_, irrValue, horr_irrValue])
-
-import scipy
-import os
-#-- Fix LaTeX for macOS 10.12
-os.environ['PATH'] = os.environ['PATH'] + ':/Library/TeX/texbin'
-import matplotlib as mpl
-mpl.use('TkAgg')
-import matplotlib.pyplot as plt
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
-import seaborn as sns
-#-- Plotting properties
-sns.set(style="white", font='serif', rc={'axes.facecolor': '#FFFFFF', 'grid.linestyle': '', 'axes.grid' : False, 'font.family': ['serif'], 'legend.frameon': True})
-colors = sns.color_palette()
-
-# fig = plt.figure(1)
-fig, ax1 = plt.subplots(figsize=(8, 4))
-timestamp = []
-total_ir = []
-total_ir_h = []
-
-for v in res['Surface A']['0327']:
-        timestamp.append(v[0] + tzoffset)
-        total_ir.append(v[1])
-        total_ir_h.append(v[2])
-
-A_1 = plt.plot(timestamp, total_ir, color=colors[0], linestyle='--', marker='o', markevery=slice(60, 170, 15))
-
-timestamp = []
-total_ir = []
-total_ir_h = []
-
-for v in res['Surface B']['0327']:
-        timestamp.append(v[0] + tzoffset)
-        total_ir.append(v[1])
-        total_ir_h.append(v[2])
-
-B_1 = plt.plot(timestamp, total_ir, color=colors[1], linestyle='--', marker='v', markevery=slice(60, 170, 15))
-# H_1 = plt.plot(timestamp, total_ir_h, color=colors[2], linestyle='--')
-
-
-timestamp = []
-total_ir = []
-total_ir_h = []
-
-for v in res['Surface A']['0621']:
-        timestamp.append(v[0] + tzoffset)
-        total_ir.append(v[1])
-        total_ir_h.append(v[2])
-
-A_2 = plt.plot(timestamp, total_ir, color=colors[0], linestyle='-', marker='o', markevery=slice(30, 185, 15))
-
-timestamp = []
-total_ir = []
-total_ir_h = []
-
-for v in res['Surface B']['0621']:
-        timestamp.append(v[0] + tzoffset)
-        total_ir.append(v[1])
-        total_ir_h.append(v[2])
-
-B_2 = plt.plot(timestamp, total_ir, color=colors[1], linestyle='-', marker='v', markevery=slice(30, 185, 15))
-# H_2 = plt.plot(timestamp, total_ir_h, color=colors[2], linestyle='-')
-
-ddd = scipy.zeros(len(total_ir_h))
-#plt.fill_between(timestamp, total_ir_h, where=total_ir_h>=ddd, interpolate=True, color='k')
-
-import matplotlib.dates as md
-xfmt = md.DateFormatter('%H:%M')
-ax1.xaxis.set_major_formatter(xfmt)
-
-sns.despine(left=False, bottom=False)
-# ax1.tick_params(axis='x', which='major', bottom='on')
-# ax1.set_xlim([734869.16, 734869.84])
-ax1.set_ylim([0, 1050])
-
-# plt.title('Clear-sky global solar irradiance for Delft, the Netherlands', size=15)
-plt.xlabel('Local time', size=14)
-#plt.ylabel(u'Total solar irradiation (W/m²)', size=14)
-plt.ylabel(r'Global solar irradiance (W/m$^{2}$)', size=14)
-plt.legend(['A on 27 Mar', 'B on 27 Mar', 'A on 21 Jun', 'B on 21 Jun'], loc='upper center', bbox_to_anchor=(0.5, 1.15), fancybox=1, shadow=0, ncol=4, numpoints=1, prop={'size':12})
-plt.savefig('dailyplot.png', bbox_inches='tight', dpi=300)
-plt.savefig('dailyplot.pdf', bbox_inches='tight')
-# plt.show()
+    if argRead(ARGS['plot'], True):
+        plotProfiles(settings, epochs, timestamps, values, tzoffset)
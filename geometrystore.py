@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""The geometry of a CityGML file compiled once into a binary store, so later runs do not parse the XML again.
+
+A store is a directory Delft.s3d with the table of the file (see citytable.CityTable) after its geometry is computed:
+the points of the rings, the offsets of the rings and their polygon, the building, semantic class, gml:id, area,
+azimuth and tilt of each polygon, and the centroid of each building, as NumPy arrays (.npy) which are memory-mapped
+when they are loaded. meta.json has the gml:ids of the buildings, the CRS, the failed buildings, and the size and
+modification time of the CityGML it was compiled from, and the context buildings (see citytable.CONTEXT).
+
+    python geometrystore.py -i /path/to/CityGML/ -o /path/to/stores/
+
+Solar3Dcity processes the stores it finds in its input directory like the CityGML files, and writes the surfaces
+with their irradiation as CSV (there is no tree to enrich)."""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+import citytable
+import journal as runjournal
+
+#-- Extension of the directory of a store
+EXTENSION = '.s3d'
+#-- Version of the layout, a store of another version is compiled again
+VERSION = 1
+META = 'meta.json'
+#-- The arrays of the store: the rings, and the columns of the table
+RINGS = ['points', 'offsets', 'ringpolygon', 'exterior']
+COLUMNS = ['building', 'semantic', 'pidoffsets', 'invalid', 'ringreasons', 'area', 'azimuth', 'tilt', 'centroid']
+
+
+def isStore(path):
+    """True if the path is a store."""
+    return path.endswith(EXTENSION) and os.path.isdir(path)
+
+
+def stores(directory):
+    """All stores in the directory."""
+    return sorted(path for path in glob.glob(os.path.join(directory, '*' + EXTENSION)) if os.path.isdir(path))
+
+
+def storePath(path, directory):
+    """Path of the store of a CityGML file in the directory: Delft.gml (or Delft.gml.gz) becomes Delft.s3d."""
+    f = os.path.basename(path)
+    if f.endswith('.gz'):
+        f = f[:-3]
+    return os.path.join(directory, f[:f.rfind('.')] + EXTENSION)
+
+
+def save(path, cityObjects, table, source=None):
+    """Writes the table, after its geometry is computed (and with its rings), to the store path. The store is written
+    next to it and renamed, so it is either complete or absent. source is the CityGML it was compiled from."""
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    if os.path.exists(temporary):
+        shutil.rmtree(temporary)
+    os.makedirs(temporary)
+    for name, values in zip(RINGS, table.rings):
+        np.save(os.path.join(temporary, name + '.npy'), values)
+    for name in COLUMNS:
+        np.save(os.path.join(temporary, name + '.npy'), getattr(table, name))
+    np.save(os.path.join(temporary, 'pids.npy'), np.frombuffer(table.pids, dtype=np.uint8))
+    meta = {'version' : VERSION, 'srsName' : table.srsName, 'cityObjects' : cityObjects, 'bid' : table.bid,
+            'failures' : dict((str(b), error) for b, error in table.failures.items()), 'context' : sorted(table.context)}
+    if source is not None:
+        meta['source'] = os.path.abspath(source)
+        meta['size'], meta['mtime'] = runjournal.fingerprint(source)
+    with open(os.path.join(temporary, META), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(temporary, path)
+
+
+def readMeta(path):
+    with open(os.path.join(path, META)) as f:
+        return json.load(f)
+
+
+def isFresh(path, source):
+    """True if the store exists, has the current layout and was compiled from the CityGML source as it is now."""
+    if not os.path.exists(os.path.join(path, META)):
+        return False
+    meta = readMeta(path)
+    return meta['version'] == VERSION and meta.get('source') == os.path.abspath(source) and \
+        (meta['size'], meta['mtime']) == runjournal.fingerprint(source)
+
+
+def isStale(path):
+    """True if the CityGML which the store was compiled from has changed since (False if it is not there anymore)."""
+    meta = readMeta(path)
+    source = meta.get('source')
+    return source is not None and os.path.exists(source) and (meta['size'], meta['mtime']) != runjournal.fingerprint(source)
+
+
+def load(path, mmap=True):
+    """Reads a store, with its arrays memory-mapped (read-only), so only the pages which are used are read.
+    Returns the number of cityObjects and the table, ready for its irradiation."""
+    meta = readMeta(path)
+    if meta['version'] != VERSION:
+        raise ValueError("The store %s has the layout %s, this version reads %d. Compile it again." % (path, meta['version'], VERSION))
+    mode = 'r' if mmap else None
+    arrays = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)) for name in RINGS + COLUMNS)
+    table = citytable.CityTable(meta['srsName'])
+    table.bid = [bid.encode('utf-8') for bid in meta['bid']]
+    for name in COLUMNS:
+        setattr(table, name, arrays[name])
+    table.pids = np.load(os.path.join(path, 'pids.npy')).tostring()
+    table.rings = tuple(arrays[name] for name in RINGS)
+    table.failures = dict((int(b), error) for b, error in meta['failures'].items())
+    table.context = set(meta.get('context', []))
+    table.irradiation = np.empty(len(table.semantic))
+    table.irradiation.fill(np.nan)
+    return meta['cityObjects'], table
+
+
+def compileTree(root, path, source=None):
+    """Reads the buildings and the geometry of the CityGML tree and saves them to the store path.
+    The roofs and the walls are oriented, so the store can be used with and without walls."""
+    cityObjects, table = citytable.readCityGML(root)
+    table.geometry(root, (citytable.ROOF, citytable.WALL), rings=True)
+    save(path, cityObjects, table, source)
+    return cityObjects, table
+
+
+if __name__ == '__main__':
+    import Solar3Dcity
+    from lxml import etree
+    PARSER = argparse.ArgumentParser(description='Compile the geometry of CityGML files into binary stores for Solar3Dcity.')
+    PARSER.add_argument('-i', '--directory',
+        help='Directory containing CityGML file(s).', required=True)
+    PARSER.add_argument('-o', '--results',
+        help='Directory where the stores are written.', required=True)
+    PARSER.add_argument('--force', action='store_true',
+        help='Compile the files again, also if their store is up to date.')
+    ARGS = vars(PARSER.parse_args())
+
+    for f in Solar3Dcity.cityGMLFiles(ARGS['directory']):
+        STORE = storePath(f, ARGS['results'])
+        if not ARGS['force'] and isFresh(STORE, f):
+            print "%s is up to date." % STORE
+            continue
+        started = time.time()
+        with Solar3Dcity.openCityGML(f) as stream:
+            ROOT = etree.parse(stream).getroot()
+        COUNT, TABLE = compileTree(ROOT, STORE, f)
+        print "%s: %d buildings, %d polygons, %d points in %.1f s." % (STORE, len(TABLE.bid), len(TABLE), len(TABLE.rings[0]), time.time() - started)
+        for b, error in sorted(TABLE.failures.items()):
+            if b in TABLE.context:
+                continue
+            print "\tBuilding %s is not evaluated: %s" % (TABLE.bid[b], error)
@@ -32,15 +32,70 @@ from solpy import irradiation
 from caelum import eere
 # import eree
 import datetime
+import math
+import os
+import time
+import warnings
+import ephem
+import numpy as np
+from scipy.cluster.vq import kmeans2
 
-def yearly_total_irr(place, az, tr): #, interval=30, ccd=None
+#-- EPW Weather data
+STATION_CODE = '062400' # '062400' for Amsterdam
+
+#-- Weather records per station, read only once
+weatherCache = {}
+#-- Number of times the records were served from the cache (for the run metrics)
+cacheHits = 0
+
+def weather(station_code=STATION_CODE):
+    """The EPW records of the weather station, fetched thanks to the caelum library and cached."""
+    global cacheHits
+    if station_code in weatherCache:
+        cacheHits += 1
+    else:
+        weatherCache[station_code] = list(eere.EPWdata(station_code))
+    return weatherCache[station_code]
+
+def read_epw(path):
+    """Reads an EPW file directly, without caelum. Returns the station (name, code, latitude, longitude)
+    and the record_arrays of its records, with the UTC times computed as caelum does."""
+    with open(path) as f:
+        location = f.readline().strip().split(',')
+        #-- The other lines of the header
+        for _ in range(7):
+            f.readline()
+        times = []
+        ghi = []
+        dhi = []
+        dni = []
+        etr = []
+        tz = datetime.timedelta(hours=float(location[8]))
+        for line in f:
+            rec = line.split(',')
+            if len(rec) < 16:
+                continue
+            #-- The hours of EPW go from 1 to 24
+            local = datetime.datetime(int(rec[0]), int(rec[1]), int(rec[2]), int(rec[3]) % 24, int(rec[4]) % 60)
+            if int(rec[3]) // 24 > 0:
+                local += datetime.timedelta(days=int(rec[3]) // 24)
+            times.append(local - tz)
+            etr.append(float(rec[10]))
+            ghi.append(float(rec[13]))
+            dni.append(float(rec[14]))
+            dhi.append(float(rec[15]))
+    station = (location[1], location[5], float(location[6]), float(location[7]))
+    return station, (times, np.array(ghi), np.array(dhi), np.array(dni), np.array(etr))
+
+def yearly_total_irr(place, az, tr, records=None): #, interval=30, ccd=None
     """Function which estimates the total irradiation.
     Input: location (lat, lon),
     az (azimuth in degrees, south is at 180 degrees),
     tr (tilt of the roof in degrees, flat roof is 0),
     #interval (what is the precision of the integration in minutes),
     #cloud cover data (dictionary with floats from 0 to 1, for each day of the year in mmdd format (e.g. '1231');
-        get it from your local weather station).
+        get it from your local weather station),
+    records (the EPW records to integrate, by default those of STATION_CODE).
     Returns total yearly irradiation for the tilted and oriented surface in kWh/m^2.
     """
 
@@ -94,14 +149,321 @@ def yearly_total_irr(place, az, tr): #, interval=30, ccd=None
 
 
 
-    #-- EPW Weather data
-    STATION_CODE = '062400' # '062400' for Amsterdam
     #-- Fetch the dataset thanks to the caelum library
-    records = eere.EPWdata(STATION_CODE)
-    #-- Get the global yearly irradiance (Wh/m^2/year)
-    TOTAL = sum([irradiation.irradiation(record=rec, location=place, horizon=None, t=tr, array_azimuth=az, model='p9') for rec in records])     
+    if records is None:
+        records = weather(STATION_CODE)
+    #-- Get the global yearly irradiance (Wh/m^2/year), skipping the night (see daylight)
+    TOTAL = sum([irradiation.irradiation(record=rec, location=place, horizon=None, t=tr, array_azimuth=az, model='p9') for rec in records
+                 if float(rec['GHI (W/m^2)']) >= 1 or float(rec['DHI (W/m^2)']) >= 1 or float(rec['DNI (W/m^2)']) >= 1])
     #-- Divide it by 1000 to get the value in kWh/m^2/year
     yearly_sum = TOTAL/1000.
 
     #-- Yearly irradiation in kWh/m^2/year
-    return yearly_sum
\ No newline at end of file
+    return yearly_sum
+
+
+#-- Vectorised counterparts of the solpy functions -----------------
+#-- They evaluate many surfaces and many timestamps in one go: the sun
+#-- position and the sky components are computed once per timestamp and the
+#-- orientation terms are broadcast over a (surfaces x timestamps) array.
+
+#-- Perez et al. 1990, Table 6 (irradiance model), as in solpy
+PEREZ_IRR = np.array([[-0.008, 0.588, -0.062, -0.060, 0.072, -0.022],
+                      [0.130, 0.683, -0.151, -0.019, 0.066, -0.029],
+                      [0.330, 0.487, -0.221, 0.055, -0.064, -0.026],
+                      [0.568, 0.187, -0.295, 0.109, -0.152, -0.014],
+                      [0.873, -0.392, -0.362, 0.226, -0.462, 0.001],
+                      [1.132, -1.237, -0.412, 0.288, -0.823, 0.056],
+                      [1.060, -1.600, -0.359, 0.264, -1.127, 0.131],
+                      [0.678, -0.327, -0.250, 0.156, -1.377, 0.251]])
+
+#-- Upper limits of the sky clearness bins (Perez et al. 1990, Table 1)
+PEREZ_BINS = np.array([1.065, 1.23, 1.5, 1.95, 2.8, 4.5, 6.2])
+
+
+def sun_positions(place, utc_datetimes, timestep=60.):
+    """Azimuth and altitude of the sun (radians) for a list of UTC datetimes.
+    Same as solpy's ephem_sun: with a timestep the position is taken half a step earlier."""
+    observer = ephem.Observer()
+    observer.lat = math.radians(place[0])
+    observer.lon = math.radians(place[1])
+    sun = ephem.Sun()
+    shift = datetime.timedelta(minutes=timestep/2.)
+    az = np.empty(len(utc_datetimes))
+    alt = np.empty(len(utc_datetimes))
+    for k, dt in enumerate(utc_datetimes):
+        if timestep != 0:
+            observer.date = dt - shift
+        else:
+            observer.date = dt
+        sun.compute(observer)
+        az[k] = sun.az
+        alt[k] = sun.alt
+    return az, alt
+
+
+def clearsky(utc_datetimes, alt, cloud_cover=0.0):
+    """Synthetic clear-sky components for each timestamp, as solpy's blave() for a horizontal surface.
+    Returns the arrays GHI, DHI, DNI and ETR in W/m^2."""
+    day = np.array([(dt - datetime.datetime(dt.year, 1, 1, tzinfo=dt.tzinfo)).days for dt in utc_datetimes], dtype=float)
+    cs = 1 - (.25*cloud_cover + .5*cloud_cover**2)
+    etr = 1160 + 75*np.sin((2*np.pi/365)*(day - 275))
+    optical_depth = 0.174 + 0.035*np.sin((2*np.pi/365)*(day - 100))
+    up = alt > 0
+    dni = np.zeros(len(day))
+    dni[up] = etr[up]*np.exp(-optical_depth[up]/np.sin(alt[up]))*cs
+    C = 0.095 + 0.04*np.sin((2*np.pi/365)*(day - 100))
+    dhi = dni*C
+    ghi = C*dni + dni*np.cos(np.pi/2 - alt)
+    return ghi, dhi, dni, etr
+
+
+def airmass(zenith):
+    """Airmass for an array of zeniths in radians (Pickering 2002)."""
+    h = np.fabs(90 - np.degrees(zenith))
+    return 1/(np.sin(np.radians(h + 244/(165 + 47*h**1.1))))
+
+
+def perez_coefficients(dni, dhi, etr, zenith):
+    """The circumsolar (F1) and horizon (F2) brightening coefficients of Perez et al. 1990 for arrays (broadcast like numpy)."""
+    k = 1.041
+    m = airmass(zenith)
+    safe_dhi = np.where(dhi > 0, dhi, 1.)
+    clearness = ((safe_dhi + dni)/safe_dhi + k*zenith**3)/(1.0 + k*zenith**3)
+    e = np.where(dhi > 0, np.searchsorted(PEREZ_BINS, clearness), 0)
+    safe_etr = np.where(etr != 0, etr, 1.)
+    delta = np.where(etr != 0, dhi*m/safe_etr, 0.)
+    F1 = PEREZ_IRR[e, 0] + PEREZ_IRR[e, 1]*delta + PEREZ_IRR[e, 2]*zenith
+    F2 = PEREZ_IRR[e, 3] + PEREZ_IRR[e, 4]*delta + PEREZ_IRR[e, 5]*zenith
+    return F1, F2
+
+
+def perez(dni, dhi, etr, S, theta, zenith):
+    """Perez et al. 1990 diffuse irradiance on tilted surfaces for arrays (broadcast like numpy)."""
+    F1, F2 = perez_coefficients(dni, dhi, etr, zenith)
+    a = np.maximum(0, np.cos(theta))
+    b = np.maximum(0.087, np.cos(zenith))
+    Xc = dhi*((1 - F1)*(1 + np.cos(S))/2 + F1*a/b + F2*np.sin(S))
+    return np.maximum(Xc, 0.0)
+
+
+def incidence(sun_az, sun_alt, tilts, azimuths):
+    """The terms of the irradiance model which do not depend on the weather: the tilt S of the surfaces (surfaces x 1),
+    the zenith Z of the sun (timestamps) and the angle of incidence theta of the sun on the surfaces (surfaces x timestamps), in radians."""
+    S = np.radians(np.asarray(tilts, dtype=float)).reshape(-1, 1)
+    aaz = np.radians(np.asarray(azimuths, dtype=float) + 180).reshape(-1, 1)
+    Z = np.pi/2 - sun_alt
+    cos_theta = np.cos(Z)*np.cos(S) + np.sin(S)*np.sin(Z)*np.cos(sun_az - np.pi - aaz)
+    theta = np.arccos(np.clip(cos_theta, -1., 1.))
+    return S, Z, theta
+
+
+def tilted_irradiance(ghi, dhi, dni, etr, sun_az, sun_alt, tilts, azimuths, model='p9', truncate=True):
+    """Total irradiance on tilted and oriented surfaces, the batch version of solpy's irradiation().
+    The sky components and sun positions are arrays over the timestamps, tilts and azimuths (degrees) over the surfaces.
+    Returns an array (surfaces x timestamps) in W/m^2.
+    The sky components of several years can be given at once as arrays (years x 1 x timestamps), which gives an array
+    (years x surfaces x timestamps); the incidence of the sun on the surfaces is then computed once for all years."""
+    #-- solpy reads the weather records as integers (the representative hours are averages, truncated before)
+    if truncate:
+        ghi = np.trunc(ghi)
+        dhi = np.trunc(dhi)
+        dni = np.trunc(dni)
+        etr = np.trunc(etr)
+    S, Z, theta = incidence(sun_az, sun_alt, tilts, azimuths)
+    #-- Beam
+    Bth = np.maximum(0, dni*np.cos(theta))
+    #-- Sky diffuse
+    if model == 'p9':
+        Dth = perez(dni, dhi, etr, S, theta, Z)
+    elif model == 'lj':
+        Dth = (1 + np.cos(S))/2*dhi
+    else:
+        raise ValueError("Irradiance model not supported: %s" % model)
+    #-- Ground reflected
+    Rth = ghi*0.2*(1 - np.cos(S))/2
+    return np.where(S > 0, Bth + Dth + Rth, ghi)
+
+
+def record_arrays(records):
+    """The UTC datetimes and the arrays GHI, DHI, DNI and ETR (W/m^2) of the EPW records."""
+    times = [rec['utc_datetime'] for rec in records]
+    ghi = np.array([float(rec['GHI (W/m^2)']) for rec in records])
+    dhi = np.array([float(rec['DHI (W/m^2)']) for rec in records])
+    dni = np.array([float(rec['DNI (W/m^2)']) for rec in records])
+    etr = np.array([float(rec['ETR (W/m^2)']) for rec in records])
+    return times, ghi, dhi, dni, etr
+
+
+def daylight(arrays):
+    """The record_arrays without the records which give no irradiance to any surface (the night): their GHI, DHI and DNI
+    are all below 1 W/m^2, which solpy reads as 0. The GHI, DHI, DNI and ETR are truncated to integers, as solpy reads them."""
+    times, ghi, dhi, dni, etr = arrays
+    ghi, dhi, dni, etr = np.trunc(ghi), np.trunc(dhi), np.trunc(dni), np.trunc(etr)
+    day = (ghi > 0) | (dhi > 0) | (dni > 0)
+    return [t for t, d in zip(times, day) if d], ghi[day], dhi[day], dni[day], etr[day]
+
+
+def month_weights(place, times):
+    """The weights (hours x 13) which sum the hours over the year (the first column) and over each month (see MONTHS).
+    The month of an hour is the one of the local solar time at the place."""
+    shift = datetime.timedelta(hours=place[1] / 15.)
+    weights = np.zeros((len(times), 13))
+    weights[:, 0] = 1
+    weights[np.arange(len(times)), [(t + shift).month for t in times]] = 1
+    return weights
+
+
+def representative_hours(place, arrays, bins=0, iterations=20, seed=0, monthly=False):
+    """The hours of the year at the place which are integrated: the position of the sun (azimuth and altitude in radians),
+    the GHI, DHI, DNI and ETR (W/m^2) and the weight (in hours) of each.
+    With bins=0 these are all the daylight records (see daylight), which gives the same result as all the records.
+    Otherwise the daylight records are grouped in at most bins clusters of similar hours (k-means on the direction of the sun
+    and the beam and diffuse irradiance), each represented by its mean and weighted by its number of hours.
+    With monthly, the weights are an array (hours x 13) of the weights in the year and in each month (see month_weights);
+    the weight of a cluster in a month is its number of hours in that month."""
+    times, ghi, dhi, dni, etr = daylight(arrays)
+    sun_az, sun_alt = sun_positions(place, times)
+    weights = month_weights(place, times) if monthly else np.ones(len(times))
+    if not bins or bins >= len(times):
+        return sun_az, sun_alt, ghi, dhi, dni, etr, weights
+    sun = np.column_stack([np.cos(sun_alt) * np.sin(sun_az), np.cos(sun_alt) * np.cos(sun_az), np.sin(sun_alt)])
+    features = np.column_stack([sun, dni / 1000., dhi / 1000.])
+    #-- The initial centres are random hours, with a fixed seed so the same weather always gives the same hours
+    initial = features[np.random.RandomState(seed).choice(len(features), bins, replace=False)]
+    with warnings.catch_warnings():
+        #-- The clusters which end up empty are dropped
+        warnings.simplefilter('ignore')
+        cluster = kmeans2(features, initial, iter=iterations, minit='matrix')[1]
+    counts = np.bincount(cluster, minlength=bins).astype(float)
+    used = counts > 0
+
+    def mean(values):
+        return np.bincount(cluster, values, minlength=bins)[used] / counts[used]
+
+    #-- The mean direction of the sun
+    direction = np.column_stack([mean(sun[:, 0]), mean(sun[:, 1]), mean(sun[:, 2])])
+    direction /= np.sqrt((direction ** 2).sum(axis=1))[:, None]
+    if monthly:
+        #-- The hours of each cluster in the year and in each month
+        sums = np.zeros((bins, 13))
+        np.add.at(sums, cluster, weights)
+        weights = sums[used]
+    else:
+        weights = counts[used]
+    return (np.arctan2(direction[:, 0], direction[:, 1]) % (2 * np.pi), np.arcsin(direction[:, 2]),
+            mean(ghi), mean(dhi), mean(dni), mean(etr), weights)
+
+
+def hours_irradiation(hours, azimuths, tilts, chunk=256):
+    """Yearly irradiation (kWh/m^2) of the surfaces with the azimuths and tilts (degrees, one of each per surface)
+    from the representative hours. The surfaces are evaluated in chunks to bound the memory.
+    With the monthly weights, the irradiation in the year and in each month (surfaces x 13)."""
+    sun_az, sun_alt, ghi, dhi, dni, etr, weights = hours
+    azimuths = np.asarray(azimuths, dtype=float)
+    tilts = np.asarray(tilts, dtype=float)
+    total = np.empty((len(azimuths),) + weights.shape[1:])
+    for start in range(0, len(azimuths), chunk):
+        end = start + chunk
+        total[start:end] = tilted_irradiance(ghi, dhi, dni, etr, sun_az, sun_alt, tilts[start:end], azimuths[start:end],
+                                             truncate=False).dot(weights)
+    #-- Divide it by 1000 to get the value in kWh/m^2/year
+    return total / 1000.
+
+
+def yearly_grid(place, azimuths, tilts, records=None, chunk=256, arrays=None, bins=0, monthly=False):
+    """Yearly irradiation (kWh/m^2) for all combinations of the azimuths and tilts (degrees) at the place,
+    i.e. yearly_total_irr for a whole grid at once. Returns an array (azimuths x tilts).
+    The weather is given as records or, already converted, as their record_arrays. Only the daylight hours are integrated,
+    or bins representative hours of them (see representative_hours).
+    With monthly, the irradiation in the year and in each month, summed in the same pass (azimuths x tilts x 13)."""
+    if arrays is None:
+        if records is None:
+            records = weather(STATION_CODE)
+        arrays = record_arrays(records)
+    az, tr = np.meshgrid(np.asarray(azimuths, dtype=float), np.asarray(tilts, dtype=float), indexing='ij')
+    hours = representative_hours(place, arrays, bins, monthly=monthly)
+    total = hours_irradiation(hours, az.ravel(), tr.ravel(), chunk)
+    return total.reshape((len(azimuths), len(tilts)) + total.shape[1:])
+
+
+def reduction_error(place, bins, step=5.0, records=None, arrays=None):
+    """The error of the yearly irradiation with bins representative hours against all hours, on a grid of orientations
+    with the resolution step (degrees). Returns a dictionary with the number of hours integrated in both cases, the maximum
+    and mean absolute error (kWh/m^2), the mean error (bias), the maximum relative error (%) and the time of both integrations."""
+    if arrays is None:
+        if records is None:
+            records = weather(STATION_CODE)
+        arrays = record_arrays(records)
+    az, tr = np.meshgrid(np.linspace(0.0, 360.0, int(360.0 / step) + 1), np.linspace(0.0, 90.0, int(90.0 / step) + 1), indexing='ij')
+    results = []
+    for b in (0, bins):
+        started = time.time()
+        hours = representative_hours(place, arrays, b)
+        results.append((len(hours[0]), hours_irradiation(hours, az.ravel(), tr.ravel()), time.time() - started))
+    (n, full, fulltime), (m, reduced, reducedtime) = results
+    error = reduced - full
+    return {'records' : len(arrays[0]), 'daylight' : n, 'hours' : m, 'max' : np.abs(error).max(), 'mean' : np.abs(error).mean(),
+            'bias' : error.mean(), 'relative' : 100. * (np.abs(error) / full).max(), 'time' : fulltime, 'reducedtime' : reducedtime}
+
+
+#-- The layers of the TOF of an ensemble of weather years (see ensemble_layers)
+ENSEMBLE_LAYERS = ['mean', 'std', 'p50', 'p90']
+
+#-- The layers of the months (see month_weights)
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+
+def weather_years(paths):
+    """Reads the EPW files of several years of weather at the same place. The records are matched by their date and hour
+    (the ones missing in a year, such as February 29, are left out). Returns the names of the years (of the files),
+    the UTC times of the first year and the arrays GHI, DHI, DNI and ETR (years x records)."""
+    names = []
+    years = []
+    for path in paths:
+        names.append(os.path.splitext(os.path.basename(path))[0])
+        years.append(read_epw(path)[1])
+
+    def key(t):
+        return t.month, t.day, t.hour, t.minute
+
+    indices = [dict((key(t), k) for k, t in enumerate(year[0])) for year in years]
+    times = [t for t in years[0][0] if all(key(t) in index for index in indices[1:])]
+    positions = [np.array([index[key(t)] for t in times], dtype=int) for index in indices]
+    components = [np.array([year[c][p] for year, p in zip(years, positions)]) for c in range(1, 5)]
+    return [names, times] + components
+
+
+def ensemble_grid(place, azimuths, tilts, years, chunk=256, monthly=False):
+    """Yearly irradiation (kWh/m^2) for all combinations of the azimuths and tilts (degrees) in each of the years (see
+    weather_years), in one pass: the position of the sun (of the first year) and its incidence on each chunk of surfaces
+    are computed once for all years. Only the hours with irradiance in some year are integrated.
+    Returns an array (years x azimuths x tilts), or with monthly (years x azimuths x tilts x 13) with the irradiation
+    in the year and in each month (see month_weights)."""
+    names, times, ghi, dhi, dni, etr = years
+    ghi, dhi, dni, etr = np.trunc(ghi), np.trunc(dhi), np.trunc(dni), np.trunc(etr)
+    day = ((ghi > 0) | (dhi > 0) | (dni > 0)).any(axis=0)
+    times = [t for t, d in zip(times, day) if d]
+    sun_az, sun_alt = sun_positions(place, times)
+    weights = month_weights(place, times) if monthly else None
+    #-- The years on the first axis, broadcast over the surfaces
+    ghi, dhi, dni, etr = [x[:, None, day] for x in (ghi, dhi, dni, etr)]
+    az, tr = np.meshgrid(np.asarray(azimuths, dtype=float), np.asarray(tilts, dtype=float), indexing='ij')
+    az = az.ravel()
+    tr = tr.ravel()
+    total = np.empty((len(names), len(az)) + ((13,) if monthly else ()))
+    #-- Fewer surfaces per chunk with more years, to bound the memory
+    step = max(1, chunk // len(names))
+    for start in range(0, len(az), step):
+        end = start + step
+        irradiance = tilted_irradiance(ghi, dhi, dni, etr, sun_az, sun_alt, tr[start:end], az[start:end], truncate=False)
+        total[:, start:end] = irradiance.dot(weights) if monthly else irradiance.sum(axis=2)
+    return (total / 1000.).reshape((len(names), len(azimuths), len(tilts)) + total.shape[2:])
+
+
+def ensemble_layers(totals):
+    """The layers of the yearly irradiation of an ensemble of years (on the first axis of totals): the mean, the standard
+    deviation, the median (P50) and the value exceeded in 90% of the years (P90, the 10th percentile).
+    Returns an array with the layers (ENSEMBLE_LAYERS) on the last axis."""
+    p50, p90 = np.percentile(totals, [50, 10], axis=0)
+    return np.stack([totals.mean(axis=0), totals.std(axis=0), p50, p90], axis=-1)
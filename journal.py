@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""The journal of a run, so that a run which is interrupted can be resumed.
+
+The journal is a file in the directory of the results with one JSON object per line:
+
+    {"run": {...}}                                  the options of the run (the first line)
+    {"orientations": [[tilt, azimuth, value], ...]} a batch of irradiation values computed without a TOF
+    {"file": ..., "size": ..., "mtime": ..., ...}   a file which is done, with its output and failed buildings
+
+Each line is flushed to the disk when it is written, and a line cut by a crash is ignored when the journal is read.
+Running the same command again skips the files which are done (unless they changed) and reuses the orientations.
+With other options, the journal is started again."""
+
+import json
+import os
+
+#-- Name of the journal in the directory of the results
+JOURNAL = 'solar3dcity.journal'
+
+
+def fingerprint(path):
+    """Size and modification time of a file, to notice that it changed since it was done."""
+    stat = os.stat(path)
+    return stat.st_size, int(stat.st_mtime)
+
+
+def writeFile(path, data):
+    """Writes the data to a temporary file next to the path and renames it, so the path is either complete or absent."""
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.rename(temporary, path)
+
+
+class RunJournal(object):
+    """The journal of the run with the options (a dictionary which can be stored as JSON) in the directory."""
+    def __init__(self, directory, options):
+        self.path = os.path.join(directory, JOURNAL)
+        self.options = options
+        #-- The files which are done, by their absolute path
+        self.files = {}
+        #-- The irradiation per (tilt, azimuth) computed without a TOF
+        self.orientations = {}
+        lines = self.read()
+        if lines and lines[0].get('run') == options:
+            for line in lines[1:]:
+                if 'file' in line:
+                    self.files[line['file']] = line
+                elif 'orientations' in line:
+                    self.orientations.update(((tilt, azimuth), value) for tilt, azimuth, value in line['orientations'])
+            #-- Without the line cut by a crash, to which the next one would be appended
+            writeFile(self.path, ''.join(json.dumps(line) + '\n' for line in lines))
+            self.f = open(self.path, 'a')
+        else:
+            if lines:
+                print "The journal %s is of a run with other options, it is started again." % self.path
+            self.f = open(self.path, 'w')
+            self.write({'run' : options})
+
+    def read(self):
+        """The lines of the journal, without the last one if it is incomplete."""
+        if not os.path.exists(self.path):
+            return []
+        lines = []
+        with open(self.path) as f:
+            for text in f:
+                try:
+                    lines.append(json.loads(text))
+                except ValueError:
+                    break
+        return lines
+
+    def write(self, line):
+        self.f.write(json.dumps(line) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def done(self, path):
+        """True if the file was done in an earlier run, has not changed since, and its output is still there."""
+        entry = self.files.get(os.path.abspath(path))
+        if entry is None or (entry['size'], entry['mtime']) != fingerprint(path):
+            return False
+        return entry['output'] is None or os.path.exists(entry['output'])
+
+    def fileDone(self, path, output=None, failed=None):
+        """Records that the file is done, with its output (None if it has no roofs) and its failed buildings (gml:id -> error)."""
+        size, mtime = fingerprint(path)
+        entry = {'file' : os.path.abspath(path), 'size' : size, 'mtime' : mtime, 'output' : output, 'failed' : failed or {}}
+        self.files[entry['file']] = entry
+        self.write(entry)
+
+    def addOrientations(self, items):
+        """Records a batch of ((tilt, azimuth), irradiation)."""
+        items = [(float(tilt), float(azimuth), float(value)) for (tilt, azimuth), value in items]
+        if items:
+            self.orientations.update(((tilt, azimuth), value) for tilt, azimuth, value in items)
+            self.write({'orientations' : items})
+
+    def close(self):
+        self.f.close()
@@ -88,4 +88,17 @@ def GMLpoints(ring):
     else:
         return None
 
-    return listPoints
\ No newline at end of file
+    return listPoints
+
+
+def GMLcoordinates(ring):
+    "Extract the coordinates from a <gml:LinearRing> as a flat list of floats (x, y, z, x, y, z, ...)."
+    posList = ring.find('.//{%s}posList' %ns_gml)
+    if posList is not None:
+        coords = posList.text.split()
+    else:
+        coords = []
+        for p in ring.iterfind('.//{%s}pos' %ns_gml):
+            coords.extend(p.text.split())
+    assert(len(coords) % 3 == 0)
+    return [float(c) for c in coords]
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Timers, counters and progress reporting of a run, stored as JSON."""
+
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import platform
+import pstats
+import resource
+import sys
+import time
+
+
+def cputime():
+    """User and system CPU time of the process in seconds."""
+    t = os.times()
+    return t[0] + t[1]
+
+
+class RunMetrics(object):
+    """Wall and CPU time per stage and per file, counters, and the progress of a run."""
+    def __init__(self, name, settings=None):
+        self.name = name
+        self.settings = settings or {}
+        self.started = time.time()
+        self.cpu_started = cputime()
+        #-- Totals per stage: wall, cpu, calls
+        self.stages = {}
+        self.counters = {}
+        self.files = []
+        self.file = None
+        #-- Progress
+        self.progress_started = None
+        self.progress_printed = 0
+        self.interval = 5.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times a stage of the run (use with the with statement)."""
+        wall = time.time()
+        cpu = cputime()
+        try:
+            yield
+        finally:
+            self.addStage(name, time.time() - wall, cputime() - cpu)
+
+    def addStage(self, name, wall, cpu, calls=1):
+        """Adds time to a stage, also for the current file."""
+        for stages in [self.stages] + ([self.file['stages']] if self.file else []):
+            if name not in stages:
+                stages[name] = {'wall' : 0.0, 'cpu' : 0.0, 'calls' : 0}
+            stages[name]['wall'] += wall
+            stages[name]['cpu'] += cpu
+            stages[name]['calls'] += calls
+
+    def count(self, name, n=1):
+        """Increments a counter, also for the current file."""
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.file:
+            self.file['counters'][name] = self.file['counters'].get(name, 0) + n
+
+    def startFile(self, path):
+        """Starts the timers and counters of a file."""
+        self.file = {'file' : path, 'stages' : {}, 'counters' : {}, 'wall' : time.time(), 'cpu' : cputime()}
+
+    def endFile(self):
+        """Closes the timers and counters of the current file."""
+        if self.file:
+            self.file['wall'] = time.time() - self.file['wall']
+            self.file['cpu'] = cputime() - self.file['cpu']
+            self.files.append(self.file)
+            self.file = None
+
+    def addFile(self, report):
+        """Adds the timings and counters of a file measured elsewhere (e.g. in another process)."""
+        for name, stage in report['stages'].items():
+            self.addStage(name, stage['wall'], stage['cpu'], stage['calls'])
+        for name, n in report['counters'].items():
+            self.count(name, n)
+        self.files.append(report)
+
+    def progress(self, done, total, what='buildings'):
+        """Prints the progress with the estimated time to finish, at most every few seconds."""
+        now = time.time()
+        if done <= 1 or self.progress_started is None:
+            self.progress_started = now
+            self.progress_printed = now
+            return
+        if now - self.progress_printed < self.interval and done < total:
+            return
+        self.progress_printed = now
+        elapsed = now - self.progress_started
+        eta = elapsed / (done - 1) * (total - done)
+        print "\t\t%d/%d %s (%.0f%%), ETA %s" % (done, total, what, 100. * done / total, datetime.timedelta(seconds=int(eta)))
+
+    def report(self):
+        """All metrics as a dictionary."""
+        wall = time.time() - self.started
+        return {'name' : self.name,
+                'started' : datetime.datetime.fromtimestamp(self.started).isoformat(),
+                'wall' : wall,
+                'cpu' : cputime() - self.cpu_started,
+                #-- ru_maxrss is in kilobytes on Linux and in bytes on Mac OS X
+                'peak_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform == 'darwin' else 1),
+                'python' : platform.python_version(),
+                'settings' : self.settings,
+                'stages' : self.stages,
+                'counters' : self.counters,
+                'files' : self.files}
+
+    def dump(self, path):
+        """Writes the metrics to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+
+    def summary(self):
+        """Prints the time per stage and the counters."""
+        print "Time per stage (wall / cpu, seconds):"
+        for name in sorted(self.stages, key=lambda s: -self.stages[s]['wall']):
+            print "\t%-12s %9.2f %9.2f" % (name, self.stages[name]['wall'], self.stages[name]['cpu'])
+        for name in sorted(self.counters):
+            print "\t%-24s %d" % (name, self.counters[name])
+
+
+def profiled(function, path, *args, **kwargs):
+    """Runs the function under cProfile, dumps the statistics to path, and prints the top of the list."""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+        pstats.Stats(path).sort_stats('cumulative').print_stats(15)
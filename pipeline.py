@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Processing of many CityGML files as a pipeline of three stages running at the same time:
+
+    reader thread  -- reads (and decompresses) the files
+    process pool   -- parses, computes and serialises each file
+    writer thread  -- writes the enriched files
+
+The stages are connected by bounded queues, so a slow stage holds back the others instead of filling the memory.
+Reading and writing overlap with the computation, which matters on network file systems."""
+
+import Queue
+import threading
+import multiprocessing
+import time
+import traceback
+
+import journal as runjournal
+import metrics
+import resultsdb
+import Solar3Dcity
+
+#-- The engine of a worker process (see initWorker)
+workerEngine = None
+
+
+def initWorker(options):
+    """Loads the engine once in each worker process (options are the keyword arguments of Solar3Dcity.Engine)."""
+    global workerEngine
+    workerEngine = Solar3Dcity.Engine(verbose=False, **options)
+
+
+def processJob(path, data, rows=False):
+    """Processes a CityGML (its content, or None for a geometry store) in a worker process.
+    Returns the path, the enriched CityGML or CSV (None if there are no roofs), the statistics of the error propagation as CSV
+    (None without it), the rows for the database (if rows), the failed buildings, the metrics of the file and the error, if any."""
+    runmetrics = metrics.RunMetrics(path)
+    runmetrics.startFile(path)
+    output = None
+    statistics = None
+    dbrows = None
+    failed = {}
+    error = None
+    try:
+        if data is None:
+            result = workerEngine.processStore(path, Solar3Dcity.baseName(path), runmetrics)
+        else:
+            result = workerEngine.processStream(data, Solar3Dcity.baseName(path), runmetrics)
+        if result.hasRoofs():
+            with runmetrics.stage('serialize'):
+                output = result.tostring()
+                if result.uncertainty is not None:
+                    statistics = Solar3Dcity.uncertainty.tocsv(result.table, result.uncertainty)
+        if rows:
+            dbrows = resultsdb.rows(result)
+        failed = result.failed()
+    except Exception:
+        error = traceback.format_exc()
+    runmetrics.endFile()
+    return path, output, statistics, dbrows, failed, runmetrics.files[0], error
+
+
+def failedJob(path, error):
+    """The result of a file which could not be read, as processJob returns it."""
+    runmetrics = metrics.RunMetrics(path)
+    runmetrics.startFile(path)
+    runmetrics.endFile()
+    return path, None, None, None, {}, runmetrics.files[0], error
+
+
+def read(paths, queue):
+    """Reader stage: puts the content of the files in the queue, and None at the end. A file which cannot be read is
+    put with its error instead. The geometry stores are not read here, they are memory-mapped by the worker."""
+    for path in paths:
+        wall = time.time()
+        cpu = metrics.cputime()
+        data = None
+        error = None
+        try:
+            if not Solar3Dcity.geometrystore.isStore(path):
+                with Solar3Dcity.openCityGML(path) as f:
+                    data = f.read()
+        except Exception:
+            error = traceback.format_exc()
+        queue.put((path, data, time.time() - wall, metrics.cputime() - cpu, error))
+    queue.put(None)
+
+
+def write(queue, result, runmetrics, done, database=None, journal=None):
+    """Writer stage: writes the enriched files from the queue until None (and their results to the database), and collects their metrics.
+    The files which are written are recorded in the journal, if it is given. A file which cannot be written is reported as failed."""
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        try:
+            writeItem(item, result, runmetrics, database, journal)
+        finally:
+            done.release()
+
+
+def writeItem(item, result, runmetrics, database=None, journal=None):
+    """Writes the result of one file (see write)."""
+    path, output, statistics, dbrows, failed, report, error, readtime = item
+    report['stages']['read'] = {'wall' : readtime[0], 'cpu' : readtime[1], 'calls' : 1}
+    name = Solar3Dcity.baseName(path)
+    try:
+        if error is not None:
+            print "\t%s: failed\n%s" % (name, error)
+            report['counters']['failed_files'] = 1
+        elif output is None:
+            print "\t%s: I am afraid I did not find any RoofSurface in this file." % name
+        else:
+            wall = time.time()
+            cpu = metrics.cputime()
+            runjournal.writeFile(Solar3Dcity.outputPath(path, result), output)
+            if statistics is not None:
+                runjournal.writeFile(Solar3Dcity.uncertaintyPath(path, result), statistics)
+            report['stages']['write'] = {'wall' : time.time() - wall, 'cpu' : metrics.cputime() - cpu, 'calls' : 1}
+            print "\t%s: %d buildings, %d roof surfaces. File written." % (name, report['counters'].get('buildings', 0), report['counters'].get('roof_polygons', 0))
+        if error is None and database is not None:
+            wall = time.time()
+            cpu = metrics.cputime()
+            database.add(name, *dbrows)
+            report['stages']['database'] = {'wall' : time.time() - wall, 'cpu' : metrics.cputime() - cpu, 'calls' : 1}
+        for bid, message in sorted(failed.items()):
+            print "\t%s: building %s is not evaluated: %s" % (name, bid, message)
+        if error is None and journal is not None:
+            journal.fileDone(path, Solar3Dcity.outputPath(path, result) if output is not None else None, failed)
+    except Exception:
+        print "\t%s: failed\n%s" % (name, traceback.format_exc())
+        report['counters']['failed_files'] = 1
+    runmetrics.addFile(report)
+
+
+def processDirectory(options, directory, result, jobs=2, queuesize=2, runmetrics=None, database=None, journal=None):
+    """Processes all CityGML files (and geometry stores) in the directory with jobs worker processes, each with a Solar3Dcity.Engine(**options).
+    At most queuesize files wait between the stages, and at most jobs + queuesize files are being computed or waiting to be written.
+    The results are also stored in the database (a resultsdb.ResultsDB) by the writer thread, if it is given.
+    With the journal (a journal.RunJournal), the files done in an earlier run are skipped and the written ones are recorded."""
+    if runmetrics is None:
+        runmetrics = metrics.RunMetrics(directory)
+    paths = Solar3Dcity.inputFiles(directory)
+    if journal is not None:
+        for path in [path for path in paths if journal.done(path)]:
+            print "%s was done in an earlier run." % Solar3Dcity.baseName(path)
+            paths.remove(path)
+    readQueue = Queue.Queue(queuesize)
+    writeQueue = Queue.Queue(queuesize)
+    #-- Files handed to the workers and not yet written
+    inflight = threading.BoundedSemaphore(jobs + queuesize)
+
+    reader = threading.Thread(target=read, args=(paths, readQueue))
+    writer = threading.Thread(target=write, args=(writeQueue, result, runmetrics, inflight, database, journal))
+    reader.daemon = True
+    writer.daemon = True
+    pool = multiprocessing.Pool(jobs, initWorker, (options,))
+    reader.start()
+    writer.start()
+    try:
+        while True:
+            item = readQueue.get()
+            if item is None:
+                break
+            path, data, readwall, readcpu, error = item
+            inflight.acquire()
+            if error is not None:
+                writeQueue.put(failedJob(path, error) + ((readwall, readcpu),))
+                continue
+            #-- The callback runs in the result thread of the pool; it blocks when the writer is behind
+            pool.apply_async(processJob, (path, data, database is not None),
+                             callback=lambda r, t=(readwall, readcpu): writeQueue.put(r + (t,)))
+        pool.close()
+        pool.join()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    writeQueue.put(None)
+    writer.join()
+    return runmetrics
@@ -38,25 +38,29 @@ import numpy as np
 def getAreaOfGML(poly, height=True):
     """Function which reads <gml:Polygon> and returns its area.
     The function also accounts for the interior and checks for the validity of the polygon."""
-    exteriorarea = 0.0
-    interiorarea = 0.0
     #-- Decompose the exterior and interior boundary
     e, i = markup3dmodule.polydecomposer(poly)
-    #-- Extract points in the <gml:LinearRing> of <gml:exterior>
-    epoints =  markup3dmodule.GMLpoints(e[0])
+    #-- Extract points in the <gml:LinearRing> of <gml:exterior> and <gml:interior>
+    epoints = markup3dmodule.GMLpoints(e[0])
+    ipoints = [markup3dmodule.GMLpoints(iring) for iring in i]
+    return getAreaOfRings(epoints, ipoints, height)
+
+def getAreaOfRings(epoints, ipoints, height=True):
+    """Area of a polygon from the points of its exterior and the list of points of its interiors.
+    Invalid rings do not count."""
+    exteriorarea = 0.0
+    interiorarea = 0.0
     if isPolyValid(epoints):
         if height:
             exteriorarea += get3DArea(epoints)
         else:
             exteriorarea += get2DArea(epoints)
-    for idx, iring in enumerate(i):
-        #-- Extract points in the <gml:LinearRing> of <gml:interior>
-        ipoints = markup3dmodule.GMLpoints(iring)
-        if isPolyValid(ipoints):
+    for ipts in ipoints:
+        if isPolyValid(ipts):
             if height:
-                interiorarea += get3DArea(ipoints)
+                interiorarea += get3DArea(ipts)
             else:
-                interiorarea += get2DArea(ipoints)
+                interiorarea += get2DArea(ipts)
     #-- Account for the interior
     area = exteriorarea - interiorarea
     #-- Area in dimensionless units (coordinate units)
@@ -168,6 +172,111 @@ def intersection(p, q, r, s):
 #------------------------------------------
 
 
+#-- Validity and area of many rings at once ---------
+#-- The rings are stored as one array of points (n x 3) and the offsets of the rings in it (nrings + 1),
+#-- so the points of the ring r are points[offsets[r]:offsets[r+1]], including the doubled first/last point.
+
+#-- Reasons why a ring is invalid (bit flags, a ring can have several)
+NOT_CLOSED = 1
+TOO_FEW_POINTS = 2
+NOT_PLANAR = 4
+ZERO_AREA = 8
+
+REASONS = [(NOT_CLOSED, 'First and last points do not match'),
+           (TOO_FEW_POINTS, 'The number of points is smaller than 3'),
+           (NOT_PLANAR, 'The points are not planar'),
+           (ZERO_AREA, 'The area is zero')]
+
+def ringSums(values, offsets):
+    """Sum of the values (one row per point) of each ring."""
+    starts = offsets[:-1]
+    nonempty = offsets[1:] > starts
+    sums = np.zeros((len(starts),) + values.shape[1:])
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(values, starts[nonempty], axis=0)
+    return sums
+
+def ringMax(values, offsets):
+    """Maximum of the values (one per point) of each ring, zero for empty rings."""
+    starts = offsets[:-1]
+    nonempty = offsets[1:] > starts
+    maxima = np.zeros(len(starts))
+    if nonempty.any():
+        maxima[nonempty] = np.maximum.reduceat(values, starts[nonempty])
+    return maxima
+
+def ringIndex(offsets):
+    """Index of the ring of each point."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+def ringCentroids(points, offsets):
+    """Mean of the points of each ring."""
+    counts = np.maximum(np.diff(offsets), 1)
+    return ringSums(points, offsets) / counts[:, None]
+
+def ringPlanes(points, offsets):
+    """Best-fit plane of each ring: the centroid and the unit normal (least squares, the direction of the smallest
+    spread of the points). The normal is oriented as the ring, i.e. counter-clockwise seen from the normal."""
+    centroids = ringCentroids(points, offsets)
+    d = points - centroids[ringIndex(offsets)]
+    covariance = ringSums((d[:, :, None] * d[:, None, :]).reshape(-1, 9), offsets).reshape(-1, 3, 3)
+    normals = np.linalg.eigh(covariance)[1][:, :, 0]
+    #-- Orient the normals as the rings
+    flip = np.einsum('ij,ij->i', normals, ringNewell(points, offsets, centroids)) < 0
+    normals[flip] *= -1
+    return centroids, normals
+
+def ringNewell(points, offsets, centroids=None):
+    """Newell vector of each ring: its direction is the normal of the ring and its length twice the area.
+    The points are taken relative to the centroid to keep the precision with large coordinates."""
+    if centroids is None:
+        centroids = ringCentroids(points, offsets)
+    d = points - centroids[ringIndex(offsets)]
+    return ringSums(np.cross(d, d[ringFollowing(offsets)]), offsets)
+
+def ringAreas(points, offsets):
+    """Area of each ring (from the Newell vector, no assumption on the planarity)."""
+    return 0.5 * np.sqrt((ringNewell(points, offsets) ** 2).sum(axis=1))
+
+def validateRings(points, offsets, eps=0.01, minarea=1e-6):
+    """Checks the validity of all rings at once: closure, number of points, planarity within eps from the
+    best-fit plane, and area larger than minarea. Returns the mask of valid rings and the reasons (bit flags)."""
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    reasons = np.zeros(len(counts), dtype=np.uint8)
+    nonempty = counts > 0
+    #-- Closure
+    closed = np.zeros(len(counts), dtype=bool)
+    closed[nonempty] = (points[offsets[:-1][nonempty]] == points[offsets[1:][nonempty] - 1]).all(axis=1)
+    reasons[~closed] |= NOT_CLOSED
+    #-- Four because the first point is doubled as the last one in the ring
+    reasons[counts < 4] |= TOO_FEW_POINTS
+    #-- Distance of the points from the best-fit plane
+    centroids, normals = ringPlanes(points, offsets)
+    rings = ringIndex(offsets)
+    distance = np.abs(np.einsum('ij,ij->i', points - centroids[rings], normals[rings]))
+    reasons[(ringMax(distance, offsets) > eps) & (counts >= 4)] |= NOT_PLANAR
+    areas = 0.5 * np.sqrt((ringNewell(points, offsets, centroids) ** 2).sum(axis=1))
+    reasons[areas <= minarea] |= ZERO_AREA
+    return reasons == 0, reasons
+
+def validationSummary(reasons):
+    """Number of invalid rings for each reason, as a list of (description, count)."""
+    return [(description, int(np.count_nonzero(reasons & flag))) for flag, description in REASONS]
+
+def printValidationSummary(reasons, what='rings'):
+    """Prints the number of invalid rings and the reasons as a table instead of a message per ring."""
+    invalid = np.count_nonzero(reasons)
+    if invalid == 0:
+        return
+    print "\t%d of %d %s are degenerate:" % (invalid, len(reasons), what)
+    for description, count in validationSummary(reasons):
+        if count:
+            print "\t\t%-45s %d" % (description, count)
+#------------------------------------------
+
+
 #-- Area and other handy computations
 def det(a):
     """Determinant of matrix a."""
@@ -347,128 +456,140 @@ def reverse_vertices(vertices):
     return reversed_vertices
 
 def triangulation(e, i):
-    """Triangulate the polygon with the exterior and interior list of points. Works only for convex polygons.
-    Assumes planarity. Projects to a 2D plane and goes back to 3D."""
-    vertices = []
-    holes = []
-    segments = []
-    index_point = 0
-
-    #-- Slope computation points
-    a = [[], [], []]
-    b = [[], [], []]
-    for ip in range(len(e)-1):
-        vertices.append(e[ip])
-        if a == [[], [], []] and index_point == 0:
-            a = [e[ip][0], e[ip][1], e[ip][2]]
-        if index_point > 0 and (e[ip] != e[ip-1]):
-            if b == [[], [], []]:
-                b = [e[ip][0], e[ip][1], e[ip][2]]
-        if ip == len(e) - 2:
-            segments.append([index_point, 0])
-        else:
-            segments.append([index_point, index_point+1])
-        index_point += 1
-    for hole in i:
-        first_point_in_hole = index_point
-        for p in range(len(hole)-1):
-            if p == len(hole)-2:
-                segments.append([index_point, first_point_in_hole])
-            else:
-                segments.append([index_point, index_point+1])
-            index_point += 1
-            vertices.append(hole[p])
-        holes.append(centroid(hole[:-1]))
-
-    #-- Project to 2D since the triangulation cannot be done in 3D with the library that is used
-    npolypoints = len(vertices)
-    nholes = len(holes)
-    #-- Check if the polygon is vertical, i.e. a projection cannot be made.
-    #-- First copy the list so the originals are not modified
-    temppolypoints = copy.deepcopy(vertices)
-    newpolypoints = copy.deepcopy(vertices)
-    tempholes = copy.deepcopy(holes)
-    newholes = copy.deepcopy(holes)
-    #-- Compute the normal of the polygon for detecting vertical polygons and
-    #-- for the correct orientation of the new triangulated faces
-    #-- If the polygon is vertical
-    normal = unit_normal(temppolypoints[0], temppolypoints[1], temppolypoints[2])
-    if math.fabs(normal[2]) < 10e-6:
-        vertical = True
-    else:
-        vertical = False
-    #-- We want to project the vertical polygon to the XZ plane
-    #-- If a polygon is parallel with the YZ plane that will not be possible
-    YZ = True
-    for i in range(1, npolypoints):
-        if temppolypoints[i][0] != temppolypoints[0][0]:
-            YZ = False
-            continue
-    #-- Project the plane in the special case
-    if YZ:
-        for i in range(0, npolypoints):
-            newpolypoints[i][0] = temppolypoints[i][1]
-            newpolypoints[i][1] = temppolypoints[i][2]
-        for i in range(0, nholes):
-            newholes[i][0] = tempholes[i][1]
-            newholes[i][1] = tempholes[i][2]
-    #-- Project the plane
-    elif vertical:
-        for i in range(0, npolypoints):
-            newpolypoints[i][1] = temppolypoints[i][2]
-        for i in range(0, nholes):
-            newholes[i][1] = tempholes[i][2]
-    else:
-        pass #-- No changes here
-
-    #-- Drop the last point (identical to first)
-    for p in newpolypoints:
-        p.pop(-1)
-
-    #-- If there are no holes
-    if len(newholes) == 0:
-        newholes = None
-    else:
-        for h in newholes:
-            h.pop(-1)
-
-    #-- Plane information (assumes planarity)
-    a = e[0]
-    b = e[1]
-    c = e[2]
-    #-- Construct the plane
-    pl = plane(a, b, c)
- 
-    #-- Prepare the polygon to be triangulated
-    poly = {'vertices' : np.array(newpolypoints), 'segments' : np.array(segments), 'holes' : np.array(newholes)}
-    #-- Triangulate
-    t = triangle.triangulate(poly, "pQjz")
-    #-- Get the triangles and their vertices
+    """Triangulate the polygon with the exterior and interior list of points.
+    Returns the list of triangles (three points each), oriented as the polygon."""
+    rings = [e] + list(i)
+    points = np.array([p for r in rings for p in r], dtype=float)
+    offsets = np.cumsum([0] + [len(r) for r in rings])
+    vertices, triangles, tripolygon = triangulateRings(points, offsets, np.zeros(len(rings), dtype=int), np.arange(len(rings)) == 0)
+    return vertices[triangles].tolist()
+
+
+#-- Triangulation of many polygons at once ---------
+def selectRings(points, offsets, mask):
+    """Points and offsets of the rings in the mask."""
+    counts = np.diff(offsets)
+    return points[np.repeat(mask, counts)], np.concatenate([[0], np.cumsum(counts[mask])])
+
+def ringFollowing(offsets):
+    """Index of the next point of each point in its ring (the last one is followed by the first one)."""
+    following = np.arange(1, offsets[-1] + 1)
+    nonempty = offsets[1:] > offsets[:-1]
+    following[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+    return following
+
+def polygonBases(normals):
+    """Two unit vectors (u, v) in the plane of each normal, so that u, v and the normal are right-handed."""
+    helper = np.zeros_like(normals)
+    vertical = np.abs(normals[:, 2]) < 0.9
+    helper[vertical, 2] = 1.0
+    helper[~vertical, 0] = 1.0
+    u = np.cross(helper, normals)
+    u /= np.sqrt((u ** 2).sum(axis=1))[:, None]
+    return u, np.cross(normals, u)
+
+def triangulateRings(points, offsets, ringpolygon, exterior, gap=1.0):
+    """Triangulates many polygons with holes at once.
+    The rings are given as one array of points and their offsets (see validateRings), with the polygon
+    of each ring and if it is the exterior. Every polygon is projected onto the best-fit plane of its exterior,
+    the projections are laid side by side and triangulated with a single call of Triangle.
+    Returns one indexed mesh: the vertices (n x 3), the triangles (m x 3 indices, oriented as their polygon)
+    and the polygon of each triangle. Polygons without a usable exterior are left out."""
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    offsets = np.asarray(offsets)
+    ringpolygon = np.asarray(ringpolygon)
+    exterior = np.asarray(exterior, dtype=bool)
+    empty = (np.zeros((0, 3)), np.zeros((0, 3), dtype=int), np.zeros(0, dtype=int))
+    if len(ringpolygon) == 0:
+        return empty
+    npolygons = int(ringpolygon.max()) + 1
+    #-- Drop the doubled last point of the closed rings, and the rings with less than three points
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    closed = np.zeros(len(counts), dtype=bool)
+    closed[nonempty] = (points[offsets[:-1][nonempty]] == points[offsets[1:][nonempty] - 1]).all(axis=1)
+    last = np.zeros(len(points), dtype=bool)
+    last[(offsets[1:] - 1)[closed]] = True
+    points = points[~last]
+    offsets = np.concatenate([[0], np.cumsum(counts - closed)])
+    usable = np.diff(offsets) >= 3
+    #-- The exterior of each polygon (the first one), and only the rings of the polygons with an exterior
+    extring = np.zeros(npolygons, dtype=int) - 1
+    outer = np.where(usable & exterior)[0][::-1]
+    extring[ringpolygon[outer]] = outer
+    usable &= extring[ringpolygon] >= 0
+    usable &= ~exterior | (extring[ringpolygon] == np.arange(len(ringpolygon)))
+    points, offsets = selectRings(points, offsets, usable)
+    ringpolygon = ringpolygon[usable]
+    exterior = exterior[usable]
+    if len(points) == 0:
+        return empty
+    rings = ringIndex(offsets)
+    pointpolygon = ringpolygon[rings]
+
+    #-- Best-fit plane of the exterior of each polygon and the projection onto it
+    centroids, normals = ringPlanes(points, offsets)
+    extring = np.zeros(npolygons, dtype=int) - 1
+    extring[ringpolygon[exterior]] = np.where(exterior)[0]
+    polygons = np.where(extring >= 0)[0]
+    centroids = centroids[extring]
+    normals = normals[extring]
+    u, v = polygonBases(normals)
+    d = points - centroids[pointpolygon]
+    xy = np.column_stack([np.einsum('ij,ij->i', d, u[pointpolygon]), np.einsum('ij,ij->i', d, v[pointpolygon])])
+
+    #-- Lay the polygons side by side along x, with a gap, so they can be triangulated together
+    xmin = np.zeros(npolygons) + np.inf
+    xmax = np.zeros(npolygons) - np.inf
+    np.minimum.at(xmin, pointpolygon, xy[:, 0])
+    np.maximum.at(xmax, pointpolygon, xy[:, 0])
+    starts = np.zeros(npolygons)
+    starts[polygons] = np.concatenate([[0.0], np.cumsum(xmax[polygons] - xmin[polygons] + gap)[:-1]])
+    shift = starts - xmin
+    xy[:, 0] += shift[pointpolygon]
+
+    #-- Constrained triangulation of all polygons. Without the 'c' switch, Triangle removes the triangles
+    #-- outside of the exteriors (also the ones between the polygons). No holes are given, since their centroid
+    #-- is not always inside them; the triangles in the interiors are removed afterwards.
+    segments = np.column_stack([np.arange(len(xy)), ringFollowing(offsets)])
+    t = triangle.triangulate({'vertices' : xy, 'segments' : segments}, 'pQz')
+    if 'triangles' not in t or len(t['triangles']) == 0:
+        return empty
     tris = t['triangles']
-    vert = t['vertices'].tolist()
-    #-- Store the vertices of each triangle in a list
-    tri_points = []
-    for tri in tris:
-        tri_points_tmp = []
-        for v in tri.tolist():
-            vert_adj = [[], [], []]
-            if YZ:
-                vert_adj[0] = temppolypoints[0][0]
-                vert_adj[1] = vert[v][0]
-                vert_adj[2] = vert[v][1]
-            elif vertical:
-                vert_adj[0] = vert[v][0]            
-                vert_adj[2] = vert[v][1]
-                vert_adj[1] = get_y(pl, vert_adj[0], vert_adj[2])
-            else:
-                vert_adj[0] = vert[v][0]
-                vert_adj[1] = vert[v][1]
-                vert_adj[2] = get_height(pl, vert_adj[0], vert_adj[1])
-            tri_points_tmp.append(vert_adj)
-        tri_normal = unit_normal(tri_points_tmp[0], tri_points_tmp[1], tri_points_tmp[2])
-        if compare_normals(normal, tri_normal):
-            tri_points.append(tri_points_tmp)
-        else:
-            tri_points_tmp = reverse_vertices(tri_points_tmp)
-            tri_points.append(tri_points_tmp)
-    return tri_points
\ No newline at end of file
+    txy = t['vertices']
+    centres = txy[tris].mean(axis=1)
+    tripolygon = polygons[np.searchsorted(starts[polygons], centres[:, 0], 'right') - 1]
+
+    #-- Remove the triangles in the interiors: an odd number of crossings of a ray with the interior rings of the polygon
+    inner = ~exterior[rings]
+    if inner.any():
+        edges = np.where(inner)[0]
+        edges = edges[np.argsort(pointpolygon[edges], kind='mergesort')]
+        nedges = np.bincount(pointpolygon[edges], minlength=npolygons)
+        firstedge = np.concatenate([[0], np.cumsum(nedges)[:-1]])
+        pairs = nedges[tripolygon]
+        pairtri = np.repeat(np.arange(len(tris)), pairs)
+        pairedge = edges[np.arange(pairs.sum()) - np.repeat(np.cumsum(pairs) - pairs, pairs) + np.repeat(firstedge[tripolygon], pairs)]
+        following = ringFollowing(offsets)
+        x1, y1 = xy[pairedge, 0], xy[pairedge, 1]
+        x2, y2 = xy[following[pairedge], 0], xy[following[pairedge], 1]
+        cx, cy = centres[pairtri, 0], centres[pairtri, 1]
+        straddle = (y1 > cy) != (y2 > cy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = straddle & (cx < x1 + (cy - y1) * (x2 - x1) / (y2 - y1))
+        holes = np.bincount(pairtri[crossing], minlength=len(tris)) % 2 == 1
+        tris = tris[~holes]
+        tripolygon = tripolygon[~holes]
+
+    #-- Back to 3D: the original points stay as they are, the new ones (at intersections) are lifted from the plane
+    vertices = np.empty((len(txy), 3))
+    vertices[:len(points)] = points
+    if len(txy) > len(points):
+        extra = txy[len(points):]
+        p = polygons[np.searchsorted(starts[polygons], extra[:, 0], 'right') - 1]
+        vertices[len(points):] = centroids[p] + (extra[:, 0] - shift[p])[:, None] * u[p] + extra[:, 1][:, None] * v[p]
+    #-- Orient the triangles as their polygon: counter-clockwise in the plane of the polygon
+    a, b, c = txy[tris[:, 0]], txy[tris[:, 1]], txy[tris[:, 2]]
+    clockwise = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]) < 0
+    tris[clockwise] = tris[clockwise][:, ::-1]
+    return vertices, tris, tripolygon
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""The results of the roofs and buildings in an SQLite database, and queries on them.
+
+The rows of a file are inserted in bulk, in transactions of at most batch rows, in WAL mode.
+The indexes (irradiation, area, orientation, building) are created at the end of a run, which is faster than
+updating them at every insert. Queries select the roofs within ranges of irradiation, area, tilt and azimuth,
+optionally grouped by building:
+
+    python resultsdb.py -d results.db roofs --irradiation 1000: --tilt :45 --area 20:
+    python resultsdb.py -d results.db buildings --irradiation 1000: --tilt :45 --area 20:"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+import numpy as np
+
+import citytable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, name TEXT UNIQUE, buildings INTEGER, roofs INTEGER, added TEXT);
+CREATE TABLE IF NOT EXISTS buildings (id INTEGER PRIMARY KEY, file INTEGER, gmlid TEXT, roofArea REAL, yearlyIrradiation REAL,
+                                      latitude REAL, longitude REAL);
+CREATE TABLE IF NOT EXISTS roofs (id INTEGER PRIMARY KEY, building INTEGER, gmlid TEXT, area REAL, azimuth REAL, tilt REAL,
+                                  irradiation REAL, totalIrradiation REAL);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS roofs_irradiation ON roofs (irradiation, tilt, area, building);
+CREATE INDEX IF NOT EXISTS roofs_area ON roofs (area);
+CREATE INDEX IF NOT EXISTS roofs_orientation ON roofs (tilt, azimuth);
+CREATE INDEX IF NOT EXISTS roofs_building ON roofs (building);
+CREATE INDEX IF NOT EXISTS buildings_gmlid ON buildings (gmlid);
+CREATE INDEX IF NOT EXISTS buildings_file ON buildings (file);
+"""
+
+#-- The columns of the roofs which can be filtered by a range
+RANGES = ['irradiation', 'area', 'tilt', 'azimuth', 'totalIrradiation']
+#-- The columns of the results of the queries of the roofs and of the buildings
+ROOF_COLUMNS = ['roof', 'building', 'area', 'azimuth', 'tilt', 'irradiation', 'totalIrradiation']
+BUILDING_COLUMNS = ['building', 'roofs', 'area', 'totalIrradiation', 'irradiation']
+#-- The index used for a range of a column, in order of preference. SQLite does not know the distribution of the
+#-- values (ANALYZE only counts), and with a range on the tilt it scans most of the roofs by their orientation
+INDEXED = [('irradiation', 'roofs_irradiation'), ('area', 'roofs_area'), ('tilt', 'roofs_orientation')]
+
+
+def rows(result):
+    """The rows of the buildings and of the roofs of a Solar3Dcity result (plain tuples, so they can be sent
+    between processes). The building of a roof is its index in the buildings. The context buildings are left out."""
+    table = result.table
+    roofarea = table.roofarea()
+    yearly = table.yearlyIrradiation()
+    located = table.latitude is not None
+    own = table.ownBuildings()
+    buildings = [(table.bid[b], float(roofarea[b]), float(yearly[b]),
+                  float(table.latitude[b]) if located else None, float(table.longitude[b]) if located else None)
+                 for b in own]
+    roofs = table.select(citytable.ROOF)
+    total = table.totalIrradiation()
+    index = np.searchsorted(own, table.building[roofs])
+    roofrows = [(int(i), table.pid(k), value(table.area[k]), value(table.azimuth[k]), value(table.tilt[k]),
+                 value(table.irradiation[k]), value(total[k])) for i, k in zip(index, roofs)]
+    return buildings, roofrows
+
+
+def value(x):
+    """A number for the database, NULL (None) if it is NaN."""
+    x = float(x)
+    if np.isnan(x):
+        return None
+    return x
+
+
+class ResultsDB(object):
+    """An SQLite database with the results of the buildings and their roofs."""
+    def __init__(self, path, batch=100000):
+        self.path = path
+        self.batch = batch
+        #-- The database is used by one thread at a time, but not always by the one that opened it (see pipeline.py)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def add(self, name, buildings, roofs):
+        """Inserts the rows (see rows()) of a file, replacing the ones of an earlier run of the same file."""
+        c = self.connection
+        with c:
+            self.remove(name)
+            cursor = c.execute('INSERT INTO files (name, buildings, roofs, added) VALUES (?, ?, ?, ?)',
+                               (name, len(buildings), len(roofs), time.strftime('%Y-%m-%dT%H:%M:%S')))
+            fileid = cursor.lastrowid
+            first = (c.execute('SELECT MAX(id) FROM buildings').fetchone()[0] or 0) + 1
+        #-- The ids of the buildings are given here, so the roofs refer to them without looking them up
+        for start in range(0, len(buildings), self.batch):
+            with c:
+                c.executemany('INSERT INTO buildings (id, file, gmlid, roofArea, yearlyIrradiation, latitude, longitude) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              ((first + start + b, fileid) + row for b, row in enumerate(buildings[start:start + self.batch])))
+        for start in range(0, len(roofs), self.batch):
+            with c:
+                c.executemany('INSERT INTO roofs (building, gmlid, area, azimuth, tilt, irradiation, totalIrradiation) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              ((first + row[0],) + row[1:] for row in roofs[start:start + self.batch]))
+
+    def addResult(self, result):
+        """Inserts the buildings and roofs of a Solar3Dcity result."""
+        buildings, roofs = rows(result)
+        self.add(result.name, buildings, roofs)
+
+    def remove(self, name):
+        """Deletes the rows of a file."""
+        c = self.connection
+        row = c.execute('SELECT id FROM files WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return
+        c.execute('DELETE FROM roofs WHERE building IN (SELECT id FROM buildings WHERE file = ?)', row)
+        c.execute('DELETE FROM buildings WHERE file = ?', row)
+        c.execute('DELETE FROM files WHERE id = ?', row)
+
+    def index(self):
+        """Creates the indexes (if they do not exist yet) and updates the statistics of the query planner."""
+        self.connection.executescript(INDEXES)
+        self.connection.execute('ANALYZE')
+        self.connection.commit()
+
+    def indexes(self):
+        """The names of the indexes of the database."""
+        return set(name for name, in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+
+    def close(self):
+        self.index()
+        self.connection.close()
+
+    def query(self, ranges=None, group=False, order=None, descending=False, limit=None):
+        """The roofs (or, with group, the buildings with the sum of their matching roofs) within the ranges,
+        a dictionary column -> (minimum, maximum) where either can be None, sorted by the column order.
+        Returns the names of the columns and the rows."""
+        conditions = []
+        parameters = []
+        for column, (low, high) in sorted((ranges or {}).items()):
+            if column not in RANGES:
+                raise ValueError("Unknown column: %s" % column)
+            if low is not None:
+                conditions.append('r.%s >= ?' % column)
+                parameters.append(low)
+            if high is not None:
+                conditions.append('r.%s <= ?' % column)
+                parameters.append(high)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        #-- The indexes are created by close(), a database which is still written (or of an interrupted run) has none yet
+        existing = self.indexes()
+        indexed = [index for column, index in INDEXED if column in (ranges or {}) and index in existing]
+        roofs = 'roofs r INDEXED BY %s' % indexed[0] if indexed else 'roofs r'
+        if group:
+            sql = ('SELECT b.gmlid AS building, COUNT(*) AS roofs, SUM(r.area) AS area, SUM(r.totalIrradiation) AS totalIrradiation, '
+                   'SUM(r.totalIrradiation) / SUM(r.area) AS irradiation FROM %s JOIN buildings b ON b.id = r.building%s '
+                   'GROUP BY r.building' % (roofs, where))
+        else:
+            sql = ('SELECT r.gmlid AS roof, b.gmlid AS building, r.area, r.azimuth, r.tilt, r.irradiation, r.totalIrradiation '
+                   'FROM %s JOIN buildings b ON b.id = r.building%s' % (roofs, where))
+        if order:
+            if order not in (BUILDING_COLUMNS if group else ROOF_COLUMNS):
+                raise ValueError("Cannot sort by %s." % order)
+            sql += ' ORDER BY %s%s' % (order, ' DESC' if descending else '')
+        if limit:
+            sql += ' LIMIT %d' % int(limit)
+        cursor = self.connection.execute(sql, parameters)
+        return [d[0] for d in cursor.description], cursor.fetchall()
+
+    def summary(self):
+        """Number of files, buildings and roofs, and the totals of the roofs."""
+        c = self.connection
+        files, = c.execute('SELECT COUNT(*) FROM files').fetchone()
+        buildings, = c.execute('SELECT COUNT(*) FROM buildings').fetchone()
+        roofs, area, total = c.execute('SELECT COUNT(*), SUM(area), SUM(totalIrradiation) FROM roofs').fetchone()
+        return {'files' : files, 'buildings' : buildings, 'roofs' : roofs, 'roofArea' : area, 'totalIrradiation' : total}
+
+
+def parseRange(text):
+    """A range 'min:max' (either can be omitted) as (min, max)."""
+    low, _, high = text.partition(':')
+    return (float(low) if low else None, float(high) if high else None)
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Query the results of Solar3Dcity stored in an SQLite database.')
+    PARSER.add_argument('-d', '--database',
+        help='The SQLite database.', required=True)
+    PARSER.add_argument('what', choices=['roofs', 'buildings', 'summary'],
+        help='List the roofs, the buildings (with the sum of their matching roofs), or a summary.')
+    for COLUMN in RANGES:
+        PARSER.add_argument('--' + COLUMN, metavar='MIN:MAX',
+            help='Range of the %s of the roofs (either bound can be omitted).' % COLUMN, required=False)
+    PARSER.add_argument('--order', metavar='COLUMN',
+        help='Sort by this column.', required=False)
+    PARSER.add_argument('--descending', action='store_true',
+        help='Sort in descending order.')
+    PARSER.add_argument('--limit',
+        help='Maximum number of rows.', required=False)
+    ARGS = vars(PARSER.parse_args())
+
+    #-- Connecting would create an empty database at a mistyped path
+    if not os.path.exists(ARGS['database']):
+        print "The database %s does not exist." % ARGS['database']
+        sys.exit(1)
+    RESULTS = ResultsDB(ARGS['database'])
+    started = time.time()
+    if ARGS['what'] == 'summary':
+        for key, val in sorted(RESULTS.summary().items()):
+            print "%s\t%s" % (key, val)
+    else:
+        SELECTION = dict((c, parseRange(ARGS[c])) for c in RANGES if ARGS[c])
+        columns, found = RESULTS.query(SELECTION, ARGS['what'] == 'buildings', ARGS['order'], ARGS['descending'], ARGS['limit'])
+        writer = csv.writer(sys.stdout)
+        writer.writerow(columns)
+        writer.writerows(found)
+        sys.stderr.write("%d rows in %.1f ms\n" % (len(found), (time.time() - started) * 1000.))
@@ -0,0 +1,334 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Solar3Dcity as a local service: the engine (with its TOF) stays loaded and jobs are sent over HTTP.
+
+The server listens on localhost or on a Unix socket.
+    POST /solar        CityGML in the body. Returns JSON with the buildings and roofs,
+                       or the enriched CityGML with /solar?format=citygml.
+    GET  /stats        Latency and throughput statistics (JSON).
+    GET  /health       "ok".
+Jobs arriving within a short window are batched, so the roofs of all of them are sampled from the TOF together."""
+
+import argparse
+import BaseHTTPServer
+import collections
+import httplib
+import json
+import os
+import Queue
+import socket
+import SocketServer
+import threading
+import time
+import urllib
+import urlparse
+
+import numpy as np
+from lxml import etree
+
+import Solar3Dcity
+
+
+class Job(object):
+    """A CityGML sent to the server, and its result once processed."""
+    def __init__(self, root, name):
+        self.root = root
+        self.name = name
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Stats(object):
+    """Latency of the recent requests, and the number of requests, roofs and batches."""
+    def __init__(self, keep=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = collections.deque(maxlen=keep)
+        self.finished = collections.deque(maxlen=keep)
+        self.requests = 0
+        self.errors = 0
+        self.buildings = 0
+        self.roofs = 0
+        self.batches = 0
+        self.batched = 0
+
+    def request(self, latency, buildings=0, roofs=0, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            self.buildings += buildings
+            self.roofs += roofs
+            self.latencies.append(latency)
+            self.finished.append(time.time())
+
+    def batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batched += size
+
+    def report(self):
+        """The statistics as a dictionary (latencies in milliseconds)."""
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000.
+            now = time.time()
+            uptime = now - self.started
+            recent = sum(1 for t in self.finished if now - t <= 60.)
+            report = {'uptime' : uptime,
+                      'requests' : self.requests,
+                      'errors' : self.errors,
+                      'buildings' : self.buildings,
+                      'roofs' : self.roofs,
+                      'batches' : self.batches,
+                      'mean_batch_size' : float(self.batched) / self.batches if self.batches else 0.0,
+                      'requests_per_sec' : self.requests / uptime if uptime > 0 else 0.0,
+                      'requests_per_sec_last_minute' : recent / min(60., uptime) if uptime > 0 else 0.0}
+        if len(latencies):
+            report['latency_ms'] = {'mean' : float(latencies.mean()),
+                                    'p50' : float(np.percentile(latencies, 50)),
+                                    'p95' : float(np.percentile(latencies, 95)),
+                                    'p99' : float(np.percentile(latencies, 99)),
+                                    'max' : float(latencies.max())}
+        return report
+
+
+class Batcher(threading.Thread):
+    """Processes the jobs in batches: a batch is closed after the window (seconds) or when it is full.
+    The geometry is read per job, and the irradiation of the roofs of the whole batch is estimated at once."""
+    def __init__(self, engine, stats, window=0.005, size=64):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.engine = engine
+        self.stats = stats
+        self.window = window
+        self.size = size
+        self.jobs = Queue.Queue()
+
+    def submit(self, root, name=''):
+        """Queues a parsed CityGML and waits for the result."""
+        job = Job(root, name)
+        self.jobs.put(job)
+        job.done.wait()
+        return job
+
+    def run(self):
+        while True:
+            batch = [self.jobs.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.jobs.get(timeout=remaining))
+                except Queue.Empty:
+                    break
+            self.process(batch)
+
+    def process(self, batch):
+        """Processes a batch of jobs. A failing job does not affect the others: if the batched estimate fails, the jobs
+        are estimated one by one, and only the ones which fail get the error."""
+        self.stats.batch(len(batch))
+        prepared = []
+        for job in batch:
+            try:
+                job.result = self.engine.prepare(job.root, job.name)
+                prepared.append(job)
+            except Exception as e:
+                job.error = e
+        try:
+            self.engine.solarinfoBatch([job.result.table for job in prepared])
+        except Exception:
+            for job in list(prepared):
+                try:
+                    self.engine.solarinfo(job.result.table)
+                except Exception as e:
+                    job.error = e
+                    prepared.remove(job)
+        for job in prepared:
+            try:
+                self.engine.complete(job.result)
+            except Exception as e:
+                job.error = e
+        for job in batch:
+            job.done.set()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP requests to the server."""
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, code, body, contenttype='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if path == '/stats':
+            self.reply(200, json.dumps(self.server.stats.report(), indent=1, sort_keys=True))
+        elif path == '/health':
+            self.reply(200, 'ok', 'text/plain')
+        else:
+            self.reply(404, json.dumps({'error' : 'not found'}))
+
+    def do_POST(self):
+        started = time.time()
+        url = urlparse.urlparse(self.path)
+        if url.path != '/solar':
+            self.reply(404, json.dumps({'error' : 'not found'}))
+            return
+        query = urlparse.parse_qs(url.query)
+        form = query.get('format', ['json'])[0]
+        name = query.get('name', [''])[0]
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            root = etree.fromstring(data)
+        except etree.XMLSyntaxError as e:
+            self.server.stats.request(time.time() - started, error=True)
+            self.reply(400, json.dumps({'error' : 'invalid CityGML: %s' % e}))
+            return
+        job = self.server.batcher.submit(root, name)
+        if job.error is not None:
+            self.server.stats.request(time.time() - started, error=True)
+            self.reply(500, json.dumps({'error' : str(job.error)}))
+            return
+        result = job.result
+        if form == 'citygml':
+            body = result.tostring()
+            contenttype = 'application/xml'
+        else:
+            body = json.dumps({'name' : name, 'cityObjects' : result.cityObjects, 'buildings' : result.buildings(), 'roofs' : result.roofs()})
+            contenttype = 'application/json'
+        self.server.stats.request(time.time() - started, len(result.table.ownBuildings()), len(result.table.select(Solar3Dcity.citytable.ROOF)))
+        self.reply(200, body, contenttype)
+
+    def address_string(self):
+        #-- There is no address for the connections over a Unix socket
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    #-- The connections of a burst wait to be accepted (the default of 5 refuses most of them)
+    request_queue_size = socket.SOMAXCONN
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = socket.SOMAXCONN
+
+
+def serve(engine, port=8600, unixsocket=None, window=0.005, size=64, verbose=False):
+    """Starts the server on localhost:port, or on the Unix socket, and serves until interrupted."""
+    stats = Stats()
+    batcher = Batcher(engine, stats, window, size)
+    batcher.start()
+    if unixsocket:
+        if os.path.exists(unixsocket):
+            os.remove(unixsocket)
+        server = UnixHTTPServer(unixsocket, Handler)
+        where = unixsocket
+    else:
+        server = HTTPServer(('127.0.0.1', port), Handler)
+        where = 'http://127.0.0.1:%d' % port
+    server.batcher = batcher
+    server.stats = stats
+    server.verbose = verbose
+    print "Solar3Dcity is listening on", where
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unixsocket and os.path.exists(unixsocket):
+            os.remove(unixsocket)
+        print json.dumps(stats.report(), indent=1, sort_keys=True)
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+    def __init__(self, path, timeout=60):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def request(data, port=8600, unixsocket=None, form='json', name=''):
+    """Sends a CityGML to a running server and returns its answer (decoded if it is JSON)."""
+    if unixsocket:
+        connection = UnixHTTPConnection(unixsocket)
+    else:
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+    try:
+        connection.request('POST', '/solar?' + urllib.urlencode({'format' : form, 'name' : name}), data, {'Content-Type' : 'application/xml'})
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError('Server error %d: %s' % (response.status, body))
+    if form == 'json':
+        return json.loads(body)
+    return body
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Run Solar3Dcity as a local service with the engine kept in memory.')
+    PARSER.add_argument('-f', '--factors',
+        help='Load the TOF if previously precomputed', required=False)
+    PARSER.add_argument('-p', '--port',
+        help='Port on localhost.', required=False, default='8600')
+    PARSER.add_argument('-u', '--socket',
+        help='Listen on this Unix socket instead of a port.', required=False)
+    PARSER.add_argument('-w', '--window',
+        help='Time in milliseconds to wait for more jobs to batch together.', required=False, default='5')
+    PARSER.add_argument('-b', '--batch',
+        help='Maximum number of jobs in a batch.', required=False, default='64')
+    PARSER.add_argument('-v', '--verbose', action='store_true',
+        help='Log every request.')
+    ARGS = vars(PARSER.parse_args())
+
+    engine = Solar3Dcity.Engine(ARGS['factors'], verbose=False)
+    serve(engine, int(ARGS['port']), ARGS['socket'], float(ARGS['window']) / 1000., int(ARGS['batch']), ARGS['verbose'])
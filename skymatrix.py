@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""The cumulative sky: the irradiance model of irr.tilted_irradiance summed over the hours of the year into a few
+hundred sources, so the irradiation of any surface is a dot product, and the one of a whole city a matrix product.
+
+The hours are split into the terms of the model (see irr.perez_coefficients):
+
+    sun      the beam and the circumsolar diffuse, binned by the position of the sun in the patches of a
+             Reinhart subdivision of the sky; each bin is at the mean position of the sun weighted by its energy
+    sky      the isotropic diffuse, spread over the patches of the sky (the Tregenza subdivision of 145 patches,
+             or a Reinhart subdivision MF:n of 144 n^2 + 1 patches)
+    horizon  the horizon brightening, on points along the horizon
+    ground   the reflection of the ground (albedo 0.2), which a surface sees with the view factor (1 - cos tilt) / 2
+
+A surface receives the energy of each source times the cosine of the angle between its normal and the source (0 if
+the source is behind it). With the normals N (surfaces x 3), the directions of the sources D (sources x 3) and their
+energy E (sources x layers, e.g. the year and the months), the irradiation is max(0, N D^T) E. A mask of the
+obstructions (surfaces x sources) would multiply max(0, N D^T) at the same cost. Horizontal surfaces get the global
+horizontal irradiation, as in irr.tilted_irradiance.
+
+The sky is computed once per place and weather, from all daylight hours or from representative hours
+(see irr.representative_hours)."""
+
+import time
+import numpy as np
+
+import irr
+
+#-- Number of patches in each band of altitude of the Tregenza subdivision, from the horizon up (and one at the zenith)
+TREGENZA = [30, 30, 24, 24, 18, 12, 6]
+#-- Subdivision of the patches of the sky (isotropic diffuse) and of the bins of the sun, and number of points on the horizon
+SKY = 2
+SUN = 4
+HORIZON = 72
+#-- Albedo of the ground, as in irr.tilted_irradiance
+ALBEDO = 0.2
+
+
+def patches(subdivision=1):
+    """The patches of the Reinhart subdivision MF:subdivision of the sky (1 is the Tregenza subdivision): 7 x subdivision
+    bands of altitude with TREGENZA x subdivision patches each, and a cap at the zenith half a band high.
+    Returns the width of the bands (radians), the number of patches in each band, and the direction (patches x 3: east,
+    north, up) and the solid angle (sr) of each patch."""
+    width = np.radians(90.) / (7 * subdivision + .5)
+    counts = np.repeat(TREGENZA, subdivision) * subdivision
+    directions = []
+    solid = []
+    for band, count in enumerate(counts):
+        altitude = (band + .5) * width
+        azimuth = (np.arange(count) + .5) * 2 * np.pi / count
+        directions.append(np.column_stack([np.cos(altitude) * np.sin(azimuth), np.cos(altitude) * np.cos(azimuth),
+                                           np.zeros(count) + np.sin(altitude)]))
+        solid.append(np.zeros(count) + 2 * np.pi / count * (np.sin((band + 1) * width) - np.sin(band * width)))
+    directions.append(np.array([[0., 0., 1.]]))
+    solid.append(np.array([2 * np.pi * (1 - np.sin(len(counts) * width))]))
+    return width, counts, np.concatenate(directions), np.concatenate(solid)
+
+
+def patchIndex(azimuth, altitude, subdivision=1):
+    """The patch of the Reinhart subdivision (see patches) of each direction (azimuth and altitude in radians).
+    The directions below the horizon are in the lowest band."""
+    width, counts, directions, solid = patches(subdivision)
+    first = np.concatenate([[0], np.cumsum(counts)])
+    band = np.clip(np.floor(np.asarray(altitude) / width).astype(int), 0, len(counts))
+    count = np.append(counts, 1)[band]
+    return first[band] + np.floor((np.asarray(azimuth) % (2 * np.pi)) / (2 * np.pi) * count).astype(int) % count
+
+
+def normals(azimuths, tilts):
+    """The unit normals (surfaces x 3: east, north, up) of the surfaces with the azimuths and tilts (degrees)."""
+    A = np.radians(np.asarray(azimuths, dtype=float))
+    S = np.radians(np.asarray(tilts, dtype=float))
+    return np.column_stack([np.sin(S) * np.sin(A), np.sin(S) * np.cos(A), np.cos(S)])
+
+
+class SkyMatrix(object):
+    """The cumulative sky of the hours (see irr.representative_hours), with the sky patches of the Reinhart subdivision
+    sky (1 is Tregenza), the bins of the sun of the subdivision sun and horizon points on the horizon.
+    With monthly weights of the hours, the sky has the layers of the year and of each month (see irr.month_weights)."""
+    def __init__(self, hours, sky=SKY, sun=SUN, horizon=HORIZON):
+        sun_az, sun_alt, ghi, dhi, dni, etr, weights = hours
+        self.monthly = weights.ndim == 2
+        weights = weights.reshape(len(weights), -1)
+        zenith = np.pi / 2 - sun_alt
+        F1, F2 = irr.perez_coefficients(dni, dhi, etr, zenith)
+        #-- The sun: beam and circumsolar, in W/m^2 on a surface facing the sun
+        beam = dni + F1 * dhi / np.maximum(0.087, np.cos(zenith))
+        direction = np.column_stack([np.cos(sun_alt) * np.sin(sun_az), np.cos(sun_alt) * np.cos(sun_az), np.sin(sun_alt)])
+        bins = patchIndex(sun_az, sun_alt, sun)
+        used, bins = np.unique(bins, return_inverse=True)
+        energy = np.zeros((len(used), weights.shape[1]))
+        np.add.at(energy, bins, beam[:, None] * weights)
+        #-- The position of a bin is the mean of the positions of the sun weighted by the energy of the year (not
+        #-- normalised, so the bin gives the exact sum for the surfaces which see the sun in all its hours)
+        total = np.bincount(bins, beam * weights[:, 0], minlength=len(used))
+        mean = np.column_stack([np.bincount(bins, direction[:, c] * beam * weights[:, 0], minlength=len(used)) for c in range(3)])
+        keep = total != 0
+        sunDirections = mean[keep] / total[keep, None]
+        sunEnergy = energy[keep]
+        #-- The sky: the isotropic diffuse spread over the patches by their solid angle, normalised so that the patches
+        #-- give a horizontal surface all of it
+        skyDirections, solid = patches(sky)[2:]
+        isotropic = ((dhi * (1 - F1))[:, None] * weights).sum(axis=0)
+        share = solid / (solid * skyDirections[:, 2]).sum()
+        skyEnergy = share[:, None] * isotropic
+        #-- The horizon: a surface with the tilt S gets F2 DHI sin(S), the mean of max(0, cos) along the horizon is 1/pi
+        azimuth = (np.arange(horizon) + .5) * 2 * np.pi / horizon
+        horizonDirections = np.column_stack([np.sin(azimuth), np.cos(azimuth), np.zeros(horizon)])
+        horizonEnergy = np.repeat(np.pi / horizon * ((F2 * dhi)[:, None] * weights).sum(axis=0)[None], horizon, axis=0)
+        self.directions = np.concatenate([sunDirections, skyDirections, horizonDirections])
+        self.energy = np.concatenate([sunEnergy, skyEnergy, horizonEnergy])
+        self.ground = ALBEDO * (ghi[:, None] * weights).sum(axis=0)
+        self.globalHorizontal = (ghi[:, None] * weights).sum(axis=0)
+        self.sources = {'sun' : len(sunDirections), 'sky' : len(skyDirections), 'horizon' : horizon}
+
+    def lookup(self, azimuth, tilt, chunk=4096):
+        """Yearly irradiation (kWh/m^2) of the surfaces with the azimuths and tilts (degrees), in chunks of surfaces to
+        bound the memory. With the monthly layers, an array (surfaces x 13). NaN for the surfaces without an orientation."""
+        azimuth = np.asarray(azimuth, dtype=float)
+        tilt = np.asarray(tilt, dtype=float)
+        N = normals(azimuth, tilt)
+        values = np.empty((len(azimuth), self.energy.shape[1]))
+        for start in range(0, len(azimuth), chunk):
+            end = start + chunk
+            values[start:end] = np.maximum(0, N[start:end].dot(self.directions.T)).dot(self.energy)
+            values[start:end] += ((1 - N[start:end, 2]) / 2)[:, None] * self.ground
+        values[tilt == 0] = self.globalHorizontal
+        values /= 1000.
+        if not self.monthly:
+            return values[:, 0]
+        return values
+
+
+def grid(place, azimuths, tilts, arrays, bins=0, monthly=False, sky=SKY):
+    """Yearly irradiation (kWh/m^2) for all combinations of the azimuths and tilts (degrees) at the place from its
+    cumulative sky, as irr.yearly_grid. Returns an array (azimuths x tilts), or with monthly (azimuths x tilts x 13)."""
+    az, tr = np.meshgrid(np.asarray(azimuths, dtype=float), np.asarray(tilts, dtype=float), indexing='ij')
+    values = SkyMatrix(irr.representative_hours(place, arrays, bins, monthly=monthly), sky).lookup(az.ravel(), tr.ravel())
+    return values.reshape((len(azimuths), len(tilts)) + values.shape[1:])
+
+
+def accuracy(place, sky=SKY, step=5.0, bins=0, arrays=None):
+    """The error of the cumulative sky against the integration of the same hours, on a grid of orientations with the
+    resolution step (degrees). Returns a dictionary with the number of sources of the sky, the maximum and mean absolute
+    error (kWh/m^2), the mean error (bias), the maximum relative error (%), and the time of the integration, of the
+    computation of the sky and of its lookup."""
+    if arrays is None:
+        arrays = irr.record_arrays(irr.weather(irr.STATION_CODE))
+    az, tr = np.meshgrid(np.linspace(0.0, 360.0, int(360.0 / step) + 1), np.linspace(0.0, 90.0, int(90.0 / step) + 1), indexing='ij')
+    hours = irr.representative_hours(place, arrays, bins)
+    started = time.time()
+    reference = irr.hours_irradiation(hours, az.ravel(), tr.ravel())
+    integration = time.time() - started
+    started = time.time()
+    matrix = SkyMatrix(hours, sky)
+    computed = time.time() - started
+    started = time.time()
+    error = matrix.lookup(az.ravel(), tr.ravel()) - reference
+    return {'sources' : len(matrix.directions), 'max' : np.abs(error).max(), 'mean' : np.abs(error).mean(), 'bias' : error.mean(),
+            'relative' : 100. * (np.abs(error) / reference).max(), 'time' : integration, 'skytime' : computed, 'lookuptime' : time.time() - started}
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""A local catalogue of weather stations (EPW files) and the nearest station of many places at once.
+
+The catalogue is a CSV file with the columns station_code, name, latitude, longitude and path (the EPW file,
+relative to the CSV file), or it is made by reading the headers of all EPW files in a directory.
+The stations are put in a KD-tree of their positions on the unit sphere, so the nearest station of
+thousands of buildings is found in one query."""
+
+import argparse
+import csv
+import glob
+import os
+import numpy as np
+from scipy.spatial import cKDTree
+
+#-- Mean radius of the Earth in km
+EARTH_RADIUS = 6371.0
+
+#-- Columns of the catalogue
+FIELDS = ['station_code', 'name', 'latitude', 'longitude', 'path']
+
+
+def unitVectors(latitude, longitude):
+    """Positions (n x 3) on the unit sphere of the latitudes and longitudes in degrees."""
+    lat = np.radians(np.asarray(latitude, dtype=float))
+    lon = np.radians(np.asarray(longitude, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class StationCatalogue(object):
+    """The weather stations, with their code, name, latitude, longitude and EPW file."""
+    def __init__(self, codes, names, latitudes, longitudes, paths):
+        if len(codes) == 0:
+            raise ValueError("The catalogue of weather stations is empty.")
+        self.codes = list(codes)
+        self.names = list(names)
+        self.latitude = np.asarray(latitudes, dtype=float)
+        self.longitude = np.asarray(longitudes, dtype=float)
+        self.paths = list(paths)
+        self.tree = cKDTree(unitVectors(self.latitude, self.longitude))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def nearest(self, latitude, longitude):
+        """Index of the nearest station of each place, and its distance in km (along the great circle)."""
+        chord, index = self.tree.query(unitVectors(np.atleast_1d(latitude), np.atleast_1d(longitude)))
+        return index, 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2., 1.))
+
+    def save(self, path):
+        """Writes the catalogue as CSV, with the paths of the EPW files relative to it."""
+        base = os.path.dirname(os.path.abspath(path))
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for k in range(len(self)):
+                writer.writerow([self.codes[k], self.names[k], repr(self.latitude[k]), repr(self.longitude[k]),
+                                 os.path.relpath(os.path.abspath(self.paths[k]), base)])
+
+
+def loadCatalogue(path):
+    """Reads a catalogue from a CSV file."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'rb') as f:
+        rows = list(csv.DictReader(f))
+    return StationCatalogue([r['station_code'] for r in rows], [r['name'] for r in rows],
+                            [float(r['latitude']) for r in rows], [float(r['longitude']) for r in rows],
+                            [os.path.join(base, r['path']) for r in rows])
+
+
+def scanDirectory(directory):
+    """Makes a catalogue of all EPW files in the directory from the LOCATION line of their header."""
+    codes, names, latitudes, longitudes, paths = [], [], [], [], []
+    for path in sorted(glob.glob(os.path.join(directory, '*.epw'))):
+        with open(path) as f:
+            location = f.readline().strip().split(',')
+        if location[0] != 'LOCATION' or len(location) < 9:
+            print "\t%s is not an EPW file, skipped." % path
+            continue
+        codes.append(location[5])
+        names.append(location[1])
+        latitudes.append(float(location[6]))
+        longitudes.append(float(location[7]))
+        paths.append(path)
+    return StationCatalogue(codes, names, latitudes, longitudes, paths)
+
+
+def catalogue(path):
+    """The catalogue in the CSV file, or of the EPW files in the directory."""
+    if os.path.isdir(path):
+        return scanDirectory(path)
+    return loadCatalogue(path)
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Make a catalogue of weather stations, or find the nearest station of places.')
+    PARSER.add_argument('-c', '--catalogue',
+        help='Catalogue (CSV) or directory with EPW files.', required=True)
+    PARSER.add_argument('-o', '--output',
+        help='Write the catalogue to this CSV file.', required=False)
+    PARSER.add_argument('-p', '--place', nargs=2, action='append', metavar=('LAT', 'LON'),
+        help='Print the nearest station of this place (can be repeated).', required=False)
+    ARGS = vars(PARSER.parse_args())
+
+    STATIONS = catalogue(ARGS['catalogue'])
+    print "There are", len(STATIONS), "weather station(s) in the catalogue."
+    if ARGS['output']:
+        STATIONS.save(ARGS['output'])
+        print "Catalogue written to", ARGS['output']
+    if ARGS['place']:
+        places = np.array(ARGS['place'], dtype=float)
+        index, distance = STATIONS.nearest(places[:, 0], places[:, 1])
+        for place, k, d in zip(places, index, distance):
+            print "%.4f %.4f\t%s %s (%.1f km)" % (place[0], place[1], STATIONS.codes[k], STATIONS.names[k], d)
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Spatial tiling of CityGML files too large to be processed at once.
+
+split  streams the file once and writes its cityObjectMembers to square tiles by the centroid of their footprint.
+       Members closer than the halo to a tile are also written to it, as context: they have the xlink:role context
+       (see citytable.CONTEXT), so Solar3Dcity reads them but does not evaluate nor report them.
+       The tiles are ordinary CityGML files, listed in a manifest, and can be processed by Solar3Dcity anywhere.
+merge  reassembles the enriched tiles into one file, with the members in their original order and without the halos.
+
+Only one member (per tile when merging) is kept in memory at a time."""
+
+import argparse
+import collections
+import heapq
+import json
+import math
+import os
+import numpy as np
+from lxml import etree
+
+import citytable
+import markup3dmodule
+import Solar3Dcity
+
+ns_citygml = Solar3Dcity.ns_citygml
+ns_gml = Solar3Dcity.ns_gml
+ns_bldg = Solar3Dcity.ns_bldg
+
+#-- Name of the manifest in the directory of the tiles
+MANIFEST = 'manifest.json'
+
+
+def members(stream):
+    """Iterates the children of the root of a CityGML stream as (root, element), clearing them afterwards.
+    The root is given first as (root, None) when its first child is complete, so its text is known.
+    A child is given when the next one starts (or the root ends), since only then its tail is complete."""
+    depth = 0
+    root = None
+    pending = None
+    first = True
+    for event, element in etree.iterparse(stream, events=('start', 'end'), huge_tree=True):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = element
+            if depth > 2 or pending is None:
+                continue
+        else:
+            depth -= 1
+            if depth == 1:
+                pending = element
+            if depth != 0 or pending is None:
+                continue
+        if first:
+            yield root, None
+            first = False
+        yield root, pending
+        #-- Free the memory of the element and of the ones before it
+        pending.clear()
+        while pending.getprevious() is not None:
+            del root[0]
+        pending = None
+
+
+def rootTags(root):
+    """The start tag (with the namespaces and attributes, as in the file) and the end tag of the root."""
+    text = etree.tostring(root, with_tail=False)
+    #-- lxml escapes > in the attributes
+    return text[:text.index('>') + 1], text[text.rindex('</'):]
+
+
+def serialise(element, declarations):
+    """The element (with its tail) without the namespace declarations of the root, which it inherits in the tile."""
+    text = etree.tostring(element)
+    end = text.index('>')
+    tag = text[:end]
+    for declaration in declarations:
+        tag = tag.replace(declaration, '', 1)
+    return tag + text[end:]
+
+
+def namespaceDeclarations(root):
+    """The namespace declarations of the root, as lxml writes them."""
+    return [' xmlns="%s"' % uri if prefix is None else ' xmlns:%s="%s"' % (prefix, uri) for prefix, uri in root.nsmap.items()]
+
+
+def footprintCentroid(member):
+    """Centroid (x, y) of the footprint of a city object: the mean of the points of its GroundSurfaces,
+    or of all its points if it has none. None if it has no geometry."""
+    for surfaces in (list(member.iter('{%s}GroundSurface' % ns_bldg)), [member]):
+        coordinates = []
+        for surface in surfaces:
+            for ring in surface.iter('{%s}LinearRing' % ns_gml):
+                coordinates.extend(markup3dmodule.GMLcoordinates(ring))
+        if coordinates:
+            points = np.array(coordinates).reshape(-1, 3)
+            return points[:, 0].mean(), points[:, 1].mean()
+    return None
+
+
+class TileWriter(object):
+    """Appends serialised members to the tile files, keeping at most maxopen files open."""
+    def __init__(self, directory, maxopen=64):
+        self.directory = directory
+        self.maxopen = maxopen
+        self.files = collections.OrderedDict()
+        self.started = set()
+
+    def write(self, name, header, text):
+        if name in self.files:
+            f = self.files.pop(name)
+        else:
+            if len(self.files) >= self.maxopen:
+                self.files.popitem(last=False)[1].close()
+            f = open(os.path.join(self.directory, name + '.gml'), 'a' if name in self.started else 'w')
+            if name not in self.started:
+                f.write(header)
+                self.started.add(name)
+        self.files[name] = f
+        f.write(text)
+
+    def close(self, footer):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+        for name in self.started:
+            with open(os.path.join(self.directory, name + '.gml'), 'a') as f:
+                f.write(footer)
+
+
+def split(path, directory, size=500.0, halo=0.0, maxopen=64):
+    """Splits the CityGML file into tiles of size x size (in the units of its CRS) in the directory, with members
+    closer than halo to a tile written to it too. Writes and returns the manifest."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    base = Solar3Dcity.baseName(path)
+    writer = TileWriter(directory, maxopen)
+    tiles = {}
+    header = None
+    other = []
+    seq = 0
+    with Solar3Dcity.openCityGML(path) as stream:
+        for root, element in members(stream):
+            if element is None:
+                declarations = namespaceDeclarations(root)
+                preamble = root.text or ''
+                continue
+            if element.tag != '{%s}cityObjectMember' % ns_citygml:
+                #-- Elements before the members are repeated in every tile, the others are kept for the merge
+                if header is None:
+                    preamble += serialise(element, declarations)
+                else:
+                    other.append(serialise(element, declarations))
+                continue
+            if header is None:
+                start, footer = rootTags(root)
+                header = start + preamble
+            centroid = footprintCentroid(element)
+            if centroid is None:
+                home = base + '_nogeometry'
+                names = [home]
+                if home not in tiles:
+                    tiles[home] = {'name' : home, 'bounds' : None, 'members' : [], 'halo' : []}
+            else:
+                home = '%s_%d_%d' % (base, math.floor(centroid[0] / size), math.floor(centroid[1] / size))
+                #-- The tiles within the halo of the centroid
+                cells = [(a, b) for a in range(int(math.floor((centroid[0] - halo) / size)), int(math.floor((centroid[0] + halo) / size)) + 1)
+                                for b in range(int(math.floor((centroid[1] - halo) / size)), int(math.floor((centroid[1] + halo) / size)) + 1)]
+                names = ['%s_%d_%d' % (base, a, b) for a, b in cells]
+                for name, (a, b) in zip(names, cells):
+                    if name not in tiles:
+                        tiles[name] = {'name' : name, 'bounds' : [a * size, b * size, (a + 1) * size, (b + 1) * size], 'members' : [], 'halo' : []}
+            text = serialise(element, declarations)
+            if len(names) > 1:
+                element.set('{%s}role' % citytable.ns_xlink, citytable.CONTEXT)
+                context = serialise(element, declarations)
+            for name in names:
+                tiles[name]['members'].append(seq)
+                if name != home:
+                    tiles[name]['halo'].append(seq)
+                writer.write(name, header, text if name == home else context)
+            seq += 1
+    if header is None:
+        raise ValueError("There are no city objects in %s." % path)
+    writer.close(footer)
+    #-- The tiles with only halo members are not needed
+    for name in [name for name in tiles if len(tiles[name]['halo']) == len(tiles[name]['members'])]:
+        os.remove(os.path.join(directory, name + '.gml'))
+        del tiles[name]
+    manifest = {'source' : os.path.abspath(path), 'name' : base, 'size' : size, 'halo' : halo, 'members' : seq,
+                'header' : header, 'footer' : footer, 'other' : ''.join(other),
+                'tiles' : [tiles[name] for name in sorted(tiles)]}
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def loadManifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def tileMembers(path, tile, declarations):
+    """The members of an (enriched) tile which belong to it, as (sequence number, serialised member)."""
+    halo = set(tile['halo'])
+    sequence = iter(tile['members'])
+    with open(path, 'rb') as stream:
+        for root, element in members(stream):
+            if element is None or element.tag != '{%s}cityObjectMember' % ns_citygml:
+                continue
+            seq = next(sequence)
+            if seq not in halo:
+                yield seq, serialise(element, declarations)
+
+
+def merge(directory, results, output):
+    """Reassembles the enriched tiles in the directory results (or the original tile, for the tiles without roofs)
+    into the file output, with the members in their original order. Returns the number of members written."""
+    manifest = loadManifest(directory)
+    root = etree.fromstring(manifest['header'].encode('utf-8') + manifest['footer'].encode('utf-8'))
+    declarations = namespaceDeclarations(root)
+    streams = []
+    for tile in manifest['tiles']:
+        path = os.path.join(directory, tile['name'] + '.gml')
+        enriched = Solar3Dcity.solarPath(path, results)
+        if os.path.exists(enriched):
+            path = enriched
+        else:
+            print "\t%s has no results, its members are copied as they are." % tile['name']
+        streams.append(tileMembers(path, tile, declarations))
+    n = 0
+    with open(output, 'w') as f:
+        f.write(manifest['header'].encode('utf-8'))
+        for seq, text in heapq.merge(*streams):
+            f.write(text)
+            n += 1
+        f.write(manifest['other'].encode('utf-8'))
+        f.write(manifest['footer'].encode('utf-8'))
+    if n != manifest['members']:
+        print "\tWarning: %d of the %d members were found in the tiles." % (n, manifest['members'])
+    return n
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Split a large CityGML file into spatial tiles, or merge the enriched tiles.')
+    SUBPARSERS = PARSER.add_subparsers(dest='command')
+    SPLIT = SUBPARSERS.add_parser('split', help='Split a CityGML file into tiles.')
+    SPLIT.add_argument('-i', '--input',
+        help='CityGML file (can be gzipped).', required=True)
+    SPLIT.add_argument('-d', '--directory',
+        help='Directory of the tiles and their manifest.', required=True)
+    SPLIT.add_argument('-s', '--size',
+        help='Size of the tiles in the units of the CRS.', required=False, default='500')
+    SPLIT.add_argument('--halo',
+        help='Distance within which the neighbouring city objects are added to a tile as context.', required=False, default='0')
+    MERGE = SUBPARSERS.add_parser('merge', help='Merge the enriched tiles into one CityGML file.')
+    MERGE.add_argument('-d', '--directory',
+        help='Directory of the tiles and their manifest.', required=True)
+    MERGE.add_argument('-r', '--results',
+        help='Directory of the enriched tiles.', required=True)
+    MERGE.add_argument('-o', '--output',
+        help='The merged CityGML file.', required=True)
+    ARGS = vars(PARSER.parse_args())
+
+    if ARGS['command'] == 'split':
+        RESULT = split(ARGS['input'], ARGS['directory'], float(ARGS['size']), float(ARGS['halo']))
+        print "%d city objects in %d tiles." % (RESULT['members'], len(RESULT['tiles']))
+    else:
+        print "%d city objects merged." % merge(ARGS['directory'], ARGS['results'], ARGS['output'])
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Propagation of the positional error of the vertices to the area, orientation and irradiation of the roofs (Monte Carlo).
+
+The vertices are perturbed with an error model in many realizations at once: the points of all roofs of a file
+form one array (points x realizations x 3), on which the area and the normal of the roofs are computed with the
+ring kernels of polygon3dmodule, and the irradiation is sampled from the TOF in one lookup.
+Coincident vertices (the closing point of a ring, the corners shared by adjacent roofs) get the same error,
+so the rings stay closed and the roofs stay connected."""
+
+import numpy as np
+
+import citytable
+import polygon3dmodule
+
+#-- The quantities of each roof
+QUANTITIES = ['area', 'tilt', 'azimuth', 'irradiation', 'totalIrradiation']
+
+
+class ErrorModel(object):
+    """Random error of the coordinates, 'normal' or 'uniform', with the standard deviation sigmaxy in x and y and
+    sigmaz in z (metres). The uniform errors lie within sqrt(3) times the standard deviation."""
+    KINDS = ('normal', 'uniform')
+
+    def __init__(self, kind='normal', sigmaxy=0.1, sigmaz=0.1):
+        if kind not in self.KINDS:
+            raise ValueError("Error model not supported: %s" % kind)
+        self.kind = kind
+        self.sigmaxy = sigmaxy
+        self.sigmaz = sigmaz
+
+    def sample(self, n, realizations, rng):
+        """Errors of n vertices in each realization, as an array (n x realizations x 3)."""
+        sigma = np.array([self.sigmaxy, self.sigmaxy, self.sigmaz])
+        if self.kind == 'normal':
+            errors = rng.standard_normal((n, realizations, 3))
+        else:
+            errors = rng.uniform(-np.sqrt(3.), np.sqrt(3.), (n, realizations, 3))
+        return errors * sigma
+
+
+def roofRings(table, root):
+    """The rings of the roofs which are evaluated (valid, with an area and an orientation).
+    Returns the roofs (rows of the table), their points and offsets, the roof (index in roofs) and exterior of each ring."""
+    roofs = table.select(citytable.ROOF)
+    roofs = roofs[(table.invalid[roofs] == 0) & (table.area[roofs] > 0) & ~np.isnan(table.tilt[roofs])]
+    points, offsets, ringpolygon, exterior = table.polygonRings(root)
+    mask = np.in1d(ringpolygon, roofs)
+    points, offsets = polygon3dmodule.selectRings(points, offsets, mask)
+    return roofs, points, offsets, np.searchsorted(roofs, ringpolygon[mask]), exterior[mask]
+
+
+def realizations(table, root, lookup, n=1000, errors=None, rng=None, maxpoints=2**20):
+    """Area, tilt, azimuth, irradiation and total irradiation of the evaluated roofs in n realizations of the error.
+    lookup(roofs, azimuth, tilt) returns the irradiation of the roofs for arrays of azimuths and tilts (roofs x realizations).
+    The realizations are computed in chunks of at most maxpoints points in total.
+    Returns the roofs (rows of the table) and a dictionary quantity -> array (roofs x n)."""
+    if errors is None:
+        errors = ErrorModel()
+    if rng is None:
+        rng = np.random.RandomState()
+    roofs, points, offsets, ringroof, exterior = roofRings(table, root)
+    samples = dict((q, np.empty((len(roofs), n))) for q in QUANTITIES)
+    if len(roofs) == 0:
+        return roofs, samples
+    #-- The rings of a roof follow each other, the exterior first
+    starts = np.searchsorted(ringroof, np.arange(len(roofs)))
+    first = offsets[:-1][starts]
+    sign = np.where(exterior, 1.0, -1.0)[:, None]
+    following = polygon3dmodule.ringFollowing(offsets)
+    #-- The points relative to the centroid of their ring, to keep the precision with large coordinates
+    centroids = polygon3dmodule.ringCentroids(points, offsets)
+    relative = points - centroids[polygon3dmodule.ringIndex(offsets)]
+    #-- Coincident points share the error
+    vertices, inverse = np.unique(points, axis=0, return_inverse=True)
+    chunk = max(1, maxpoints // len(points))
+    for start in range(0, n, chunk):
+        m = min(chunk, n - start)
+        d = relative[:, None, :] + errors.sample(len(vertices), m, rng)[inverse]
+        newell = polygon3dmodule.ringSums(np.cross(d, d[following]), offsets)
+        area = np.add.reduceat(0.5 * np.sqrt((newell ** 2).sum(axis=2)) * sign, starts, axis=0)
+        #-- The normal of the first three points of the exterior, as in the deterministic pass
+        normal = np.cross(d[first + 1] - d[first], d[first + 2] - d[first])
+        collinear = (normal ** 2).sum(axis=2) == 0
+        normal[collinear] = newell[starts][collinear]
+        azimuth, tilt = citytable.orientations(normal.reshape(-1, 3))
+        azimuth = azimuth.reshape(len(roofs), m)
+        tilt = tilt.reshape(len(roofs), m)
+        irradiation = lookup(roofs, azimuth, tilt)
+        window = slice(start, start + m)
+        samples['area'][:, window] = area
+        samples['tilt'][:, window] = tilt
+        samples['azimuth'][:, window] = azimuth
+        samples['irradiation'][:, window] = irradiation
+        samples['totalIrradiation'][:, window] = irradiation * area
+    return roofs, samples
+
+
+def summarise(values, reference, confidence=0.95, circular=False):
+    """Mean, standard deviation and the bounds of the confidence interval (percentiles) of the values (roofs x realizations).
+    Circular values (azimuths) are unwrapped around the reference (the deterministic value) first."""
+    if circular:
+        values = reference[:, None] + (values - reference[:, None] + 180.0) % 360.0 - 180.0
+    tail = 50.0 * (1 - confidence)
+    lower, upper = np.percentile(values, [tail, 100 - tail], axis=1)
+    stats = {'mean' : values.mean(axis=1), 'std' : values.std(axis=1), 'lower' : lower, 'upper' : upper}
+    if circular:
+        for s in ('mean', 'lower', 'upper'):
+            stats[s] = stats[s] % 360.0
+    return stats
+
+
+def propagate(table, root, lookup, n=1000, errors=None, confidence=0.95, rng=None, maxpoints=2**20):
+    """Propagates the error of the vertices to the roofs of the table (after the deterministic pass).
+    Returns a dictionary with the roofs (rows of the table), the number of realizations, the confidence, and for each
+    quantity the deterministic value, mean, std, lower and upper bound of each roof."""
+    roofs, samples = realizations(table, root, lookup, n, errors, rng, maxpoints)
+    reference = {'area' : table.area[roofs], 'tilt' : table.tilt[roofs], 'azimuth' : table.azimuth[roofs],
+                 'irradiation' : table.irradiation[roofs], 'totalIrradiation' : table.totalIrradiation()[roofs]}
+    result = {'roofs' : roofs, 'realizations' : n, 'confidence' : confidence}
+    for q in QUANTITIES:
+        result[q] = summarise(samples[q], reference[q], confidence, q == 'azimuth')
+        result[q]['value'] = reference[q]
+    return result
+
+
+def tocsv(table, result):
+    """The statistics of the roofs as CSV, one line per roof."""
+    columns = ['value', 'mean', 'std', 'lower', 'upper']
+    lines = [','.join(['id', 'building'] + ['%s_%s' % (q, c) for q in QUANTITIES for c in columns])]
+    for r, k in enumerate(result['roofs']):
+        values = [repr(float(result[q][c][r])) for q in QUANTITIES for c in columns]
+        lines.append(','.join([table.pid(k), table.bid[table.building[k]]] + values))
+    return '\n'.join(lines) + '\n'
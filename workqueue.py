@@ -0,0 +1,332 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the Solar3Dcity package
+
+# Copyright (c) 2015
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Processing of the CityGML files (or tiles, see tiling.py) of a directory by workers on many machines,
+coordinated through a directory on a shared file system, without a broker:
+
+    init    the coordinator stores the arguments of Solar3Dcity.py and the files to process in the queue
+    work    a worker claims a file with a lease file, keeps the lease alive while it computes the file, and marks it done
+    status  the number of files to do, leased and done, and the failed ones
+    merge   the metrics (and the results in the database) of all files, and the tiles into one file
+
+A lease is a file created exclusively, and touched by the worker (heartbeat). A lease which is not touched for
+longer than its expiry belongs to a dead worker: another worker renames it away (only one can) and claims the file again.
+The ages of the leases are measured with the clock of the file system, so the clocks of the machines do not matter.
+Several workers can be started on one machine to try it out:
+
+    python workqueue.py init -q /shared/queue -- -i /shared/tiles -o /shared/results -f TOF.dict
+    python workqueue.py work -q /shared/queue &
+    python workqueue.py work -q /shared/queue &
+    python workqueue.py merge -q /shared/queue"""
+
+import argparse
+import errno
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+import journal as runjournal
+import metrics
+import resultsdb
+import Solar3Dcity
+import tiling
+
+#-- The description of the queue, and the directories of the leases, of the files which are done and of the clocks
+QUEUE = 'queue.json'
+LEASES = 'leases'
+DONE = 'done'
+CLOCKS = 'clocks'
+
+
+class WorkQueue(object):
+    """The queue in the directory (on a shared file system)."""
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, QUEUE)) as f:
+            description = json.load(f)
+        #-- The arguments of Solar3Dcity.py, and the path of each file by its name
+        self.arguments = description['arguments']
+        self.items = description['items']
+
+    def path(self, kind, name):
+        return os.path.join(self.directory, kind, name + '.json')
+
+    def isDone(self, name):
+        return os.path.exists(self.path(DONE, name))
+
+    def done(self, name):
+        with open(self.path(DONE, name)) as f:
+            return json.load(f)
+
+    def now(self, worker):
+        """The current time of the file system (the modification time of a file touched now)."""
+        clock = os.path.join(self.directory, CLOCKS, worker)
+        with open(clock, 'a'):
+            os.utime(clock, None)
+        return os.stat(clock).st_mtime
+
+    def claim(self, worker, expiry):
+        """Claims a file which is not done and not leased (or whose lease expired). Returns its name, or None."""
+        for name in sorted(self.items):
+            if self.isDone(name):
+                continue
+            lease = self.path(LEASES, name)
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self.expire(name, worker, expiry)
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'worker' : worker, 'host' : socket.gethostname(), 'pid' : os.getpid()}, f)
+            #-- It could have been finished by the worker of an expired lease in the meantime
+            if self.isDone(name):
+                self.release(name, worker)
+                continue
+            return name
+        return None
+
+    def expire(self, name, worker, expiry):
+        """Removes the lease of the file if it was not touched for expiry seconds, so it can be claimed again."""
+        lease = self.path(LEASES, name)
+        try:
+            age = self.now(worker) - os.stat(lease).st_mtime
+        except OSError:
+            return
+        if age <= expiry:
+            return
+        stale = '%s.%s.expired' % (lease, worker)
+        try:
+            os.rename(lease, stale)
+        except OSError:
+            #-- Another worker was first
+            return
+        print "\tThe lease of %s expired (%.0f s), it is queued again." % (name, age)
+        os.remove(stale)
+
+    def owns(self, name, worker):
+        """True if the worker holds the lease of the file."""
+        try:
+            with open(self.path(LEASES, name)) as f:
+                return json.load(f)['worker'] == worker
+        except (IOError, ValueError):
+            return False
+
+    def heartbeat(self, name, worker):
+        """Touches the lease of the file. Returns False if the worker lost it."""
+        if not self.owns(name, worker):
+            return False
+        try:
+            os.utime(self.path(LEASES, name), None)
+        except OSError:
+            return False
+        return True
+
+    def release(self, name, worker):
+        """Removes the lease of the file if the worker holds it."""
+        if self.owns(name, worker):
+            try:
+                os.remove(self.path(LEASES, name))
+            except OSError:
+                pass
+
+    def complete(self, name, worker, result):
+        """Marks the file as done with its result (a dictionary), and releases its lease."""
+        runjournal.writeFile(self.path(DONE, name), json.dumps(result))
+        self.release(name, worker)
+
+    def status(self):
+        """The names of the files to do, leased (by a worker) and done, and the failed ones (with their error)."""
+        done = [name for name in self.items if self.isDone(name)]
+        failed = dict((name, result['error']) for name, result in ((name, self.done(name)) for name in done) if result['error'])
+        leased = [name for name in self.items if name not in done and os.path.exists(self.path(LEASES, name))]
+        todo = [name for name in self.items if name not in done and name not in leased]
+        return sorted(todo), sorted(leased), sorted(done), failed
+
+
+def create(directory, arguments):
+    """Creates the queue in the directory with the arguments of Solar3Dcity.py and the CityGML files of its input.
+    If the queue exists, the files which failed are queued again and the ones which are done are kept."""
+    ARGS = vars(Solar3Dcity.PARSER.parse_args(arguments))
+    for kind in (LEASES, DONE, CLOCKS):
+        if not os.path.isdir(os.path.join(directory, kind)):
+            os.makedirs(os.path.join(directory, kind))
+    items = dict((Solar3Dcity.baseName(path), os.path.abspath(path)) for path in Solar3Dcity.inputFiles(ARGS['directory']))
+    runjournal.writeFile(os.path.join(directory, QUEUE), json.dumps({'arguments' : arguments, 'items' : items}, indent=1))
+    queue = WorkQueue(directory)
+    for name in queue.status()[3]:
+        os.remove(queue.path(DONE, name))
+    return queue
+
+
+class Heartbeat(threading.Thread):
+    """Touches the lease of a file every interval seconds until it is stopped."""
+    def __init__(self, queue, name, worker, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.item = name
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.queue.heartbeat(self.item, self.worker):
+                self.lost = True
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def work(directory, expiry=120.0, poll=5.0, worker=None):
+    """Claims and computes the files of the queue until all are done. Returns the number of files computed."""
+    queue = WorkQueue(directory)
+    if worker is None:
+        worker = '%s-%d' % (socket.gethostname(), os.getpid())
+    ARGS = vars(Solar3Dcity.PARSER.parse_args(queue.arguments))
+    engine = Solar3Dcity.Engine(verbose=False, **Solar3Dcity.engineOptions(ARGS))
+    computed = 0
+    while True:
+        name = queue.claim(worker, expiry)
+        if name is None:
+            if all(queue.isDone(name) for name in queue.items):
+                break
+            #-- The files leased by other workers, which may die
+            time.sleep(poll)
+            continue
+        heartbeat = Heartbeat(queue, name, worker, expiry / 4.0)
+        heartbeat.start()
+        path = queue.items[name]
+        runmetrics = metrics.RunMetrics(worker)
+        result = {'worker' : worker, 'output' : None, 'failed' : {}, 'rows' : None, 'report' : None, 'error' : None}
+        try:
+            res = engine.processFile(path, ARGS['results'], runmetrics)
+            if res.hasRoofs():
+                result['output'] = Solar3Dcity.outputPath(path, ARGS['results'])
+            result['failed'] = res.failed()
+            if ARGS['database']:
+                result['rows'] = resultsdb.rows(res)
+        except Exception:
+            result['error'] = traceback.format_exc()
+            runmetrics.endFile()
+        result['report'] = runmetrics.files[-1] if runmetrics.files else None
+        heartbeat.stop()
+        if heartbeat.lost:
+            print "\t%s: the lease was lost, the file is computed again by another worker." % name
+        queue.complete(name, worker, result)
+        computed += 1
+        print "\t%s: %s by %s" % (name, 'failed' if result['error'] else 'done', worker)
+    return computed
+
+
+def merge(directory, database=None, output=None):
+    """Collects the metrics of all files which are done, stores their results in the database (a path, by default the
+    one of the arguments of the queue, with which the workers keep the rows of the results), and merges the tiles into the file output if the input is a directory of tiles (see tiling.py).
+    Returns the metrics."""
+    queue = WorkQueue(directory)
+    ARGS = vars(Solar3Dcity.PARSER.parse_args(queue.arguments))
+    runmetrics = metrics.RunMetrics('Solar3Dcity', ARGS)
+    database = database or ARGS['database']
+    results = resultsdb.ResultsDB(database) if database else None
+    for name in sorted(queue.items):
+        if not queue.isDone(name):
+            print "\t%s is not done." % name
+            continue
+        result = queue.done(name)
+        if result['report'] is not None:
+            runmetrics.addFile(result['report'])
+        if result['error']:
+            print "\t%s failed:\n%s" % (name, result['error'])
+            continue
+        for bid, error in sorted(result['failed'].items()):
+            print "\t%s: building %s is not evaluated: %s" % (name, bid, error)
+        if results is not None and result['rows'] is not None:
+            buildings, roofs = result['rows']
+            results.add(name, [tuple(row) for row in buildings], [tuple(row) for row in roofs])
+    if results is not None:
+        results.close()
+    if output and os.path.exists(os.path.join(ARGS['directory'], tiling.MANIFEST)):
+        print "%d city objects merged." % tiling.merge(ARGS['directory'], ARGS['results'], output)
+    return runmetrics
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Process the CityGML files of a directory by workers on many machines, through a queue on a shared file system.')
+    SUBPARSERS = PARSER.add_subparsers(dest='command')
+    INIT = SUBPARSERS.add_parser('init', help='Create the queue (the files of the input of Solar3Dcity.py).')
+    INIT.add_argument('-q', '--queue',
+        help='Directory of the queue (on the shared file system).', required=True)
+    INIT.add_argument('arguments', nargs=argparse.REMAINDER,
+        help='The arguments of Solar3Dcity.py after --, e.g. -- -i tiles/ -o results/ -f TOF.dict')
+    WORK = SUBPARSERS.add_parser('work', help='Compute the files of the queue until all are done.')
+    WORK.add_argument('-q', '--queue',
+        help='Directory of the queue.', required=True)
+    WORK.add_argument('--expiry',
+        help='Seconds after which the lease of a worker which stopped touching it expires.', required=False, default='120')
+    WORK.add_argument('--poll',
+        help='Seconds between the checks for expired leases when all files are leased.', required=False, default='5')
+    STATUS = SUBPARSERS.add_parser('status', help='Show the progress of the queue.')
+    STATUS.add_argument('-q', '--queue',
+        help='Directory of the queue.', required=True)
+    MERGE = SUBPARSERS.add_parser('merge', help='Merge the results of the files which are done.')
+    MERGE.add_argument('-q', '--queue',
+        help='Directory of the queue.', required=True)
+    MERGE.add_argument('-d', '--database',
+        help='Store the results in this SQLite database instead of the one in the arguments of the queue (-d, with which the workers keep the results).', required=False)
+    MERGE.add_argument('-o', '--output',
+        help='With tiles: the merged CityGML file.', required=False)
+    MERGE.add_argument('-m', '--metrics',
+        help='Write the timings and counters of all files to this JSON file.', required=False)
+    ARGS = vars(PARSER.parse_args())
+
+    if ARGS['command'] == 'init':
+        ARGUMENTS = ARGS['arguments'][1:] if ARGS['arguments'][:1] == ['--'] else ARGS['arguments']
+        QUEUE = create(ARGS['queue'], ARGUMENTS)
+        print "%d files in the queue, %d of them done." % (len(QUEUE.items), len(QUEUE.status()[2]))
+    elif ARGS['command'] == 'work':
+        print "%d files computed." % work(ARGS['queue'], float(ARGS['expiry']), float(ARGS['poll']))
+    elif ARGS['command'] == 'status':
+        TODO, LEASED, FINISHED, FAILED = WorkQueue(ARGS['queue']).status()
+        print "%d to do, %d leased, %d done (%d failed)." % (len(TODO), len(LEASED), len(FINISHED), len(FAILED))
+        for NAME in sorted(FAILED):
+            print "\t%s failed:\n%s" % (NAME, FAILED[NAME])
+    else:
+        RUNMETRICS = merge(ARGS['queue'], ARGS['database'], ARGS['output'])
+        RUNMETRICS.summary()
+        if ARGS['metrics']:
+            RUNMETRICS.dump(ARGS['metrics'])